@@ -1,6 +1,176 @@
 from dotenv import load_dotenv
+import asyncio
 import os
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from llama_index.core.agent.workflow import (
+    AgentOutput,
+    AgentWorkflow,
+    FunctionAgent,
+    ToolCall,
+    ToolCallResult,
+)
+from llama_index.core.llms import ChatMessage
+from llama_index.core.memory import BaseMemory
+from llama_index.core.tools import AsyncBaseTool, ToolOutput, ToolSelection
+from llama_index.core.workflow import Context, StopEvent, step
+from llama_index.core.workflow.checkpointer import CheckpointCallback
+from llama_index.core.workflow.handler import WorkflowHandler
+
+import scheduler
+from tools import is_parallel_safe, touched_spreadsheets
 
 load_dotenv()
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
\ No newline at end of file
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
+# Maximum number of tool calls of one LLM turn that run at the same time
+PARALLEL_TOOL_WORKERS = int(os.getenv("PARALLEL_TOOL_WORKERS", "4"))
+
+
+def plan_tool_dependencies(tool_calls: List[ToolSelection]) -> Dict[str, List[str]]:
+    """Work out which earlier calls of a turn each tool call has to wait for.
+
+    Read-only tools run in parallel with each other. A write waits for every
+    earlier call touching the same spreadsheet, and a read waits for earlier
+    writes to its spreadsheet, so calls on one spreadsheet keep the order
+    the LLM gave them. A write whose spreadsheet is unknown serializes
+    against everything: it waits for every earlier call and every later call
+    waits for it.
+    """
+    dependencies: Dict[str, List[str]] = {}
+    earlier: List[tuple] = []  # (tool_id, spreadsheets, parallel_safe)
+    for call in tool_calls:
+        safe = is_parallel_safe(call.tool_name)
+        # Empty when unknown: then it overlaps with every other call
+        spreadsheets = set(touched_spreadsheets(call.tool_name, call.tool_kwargs))
+
+        waits = []
+        for tool_id, other_spreadsheets, other_safe in earlier:
+            if safe and other_safe:
+                continue
+            if not spreadsheets or not other_spreadsheets or spreadsheets & other_spreadsheets:
+                waits.append(tool_id)
+        dependencies[call.tool_id] = waits
+        earlier.append((call.tool_id, spreadsheets, safe))
+    return dependencies
+
+
+class ParallelAgentWorkflow(AgentWorkflow):
+    """AgentWorkflow that runs the tool calls of one turn concurrently.
+
+    Independent calls are dispatched to PARALLEL_TOOL_WORKERS workers while
+    calls on the same spreadsheet respect `plan_tool_dependencies`. Results
+    are written to the event stream, and handed to the aggregation step, in
+    the order the LLM issued the calls, however they complete.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._dependencies: Dict[str, List[str]] = {}
+        self._finished: Dict[str, asyncio.Event] = {}
+        self._released: Dict[str, asyncio.Event] = {}
+        self._predecessor: Dict[str, Optional[str]] = {}
+
+    @step
+    async def parse_agent_output(
+        self, ctx: Context, ev: AgentOutput
+    ) -> Union[StopEvent, ToolCall, None]:
+        if ev.tool_calls:
+            self._dependencies = plan_tool_dependencies(ev.tool_calls)
+            previous = None
+            for call in ev.tool_calls:
+                self._finished[call.tool_id] = asyncio.Event()
+                self._released[call.tool_id] = asyncio.Event()
+                self._predecessor[call.tool_id] = previous
+                previous = call.tool_id
+                # Announce every call of the turn up front, in order
+                ctx.write_event_to_stream(
+                    ToolCall(
+                        tool_name=call.tool_name,
+                        tool_kwargs=call.tool_kwargs,
+                        tool_id=call.tool_id,
+                    )
+                )
+        return await super().parse_agent_output(ctx, ev)
+
+    @step(num_workers=PARALLEL_TOOL_WORKERS)
+    async def call_tool(self, ctx: Context, ev: ToolCall) -> ToolCallResult:
+        """Calls the tool once its dependencies are done, releases results in order"""
+        for tool_id in self._dependencies.get(ev.tool_id, []):
+            await self._finished[tool_id].wait()
+
+        current_agent_name = await ctx.get("current_agent_name")
+        tools = await self.get_tools(current_agent_name, ev.tool_name)
+        tools_by_name = {tool.metadata.name: tool for tool in tools}
+        tool = tools_by_name.get(ev.tool_name)
+        try:
+            if tool is None:
+                result = ToolOutput(
+                    content=f"Tool {ev.tool_name} not found. Please select a tool that is available.",
+                    tool_name=ev.tool_name,
+                    raw_input=ev.tool_kwargs,
+                    raw_output=None,
+                    is_error=True,
+                )
+            else:
+                result = await self._call_tool(ctx, tool, ev.tool_kwargs)
+        finally:
+            if ev.tool_id in self._finished:
+                self._finished[ev.tool_id].set()
+
+        result_ev = ToolCallResult(
+            tool_name=ev.tool_name,
+            tool_kwargs=ev.tool_kwargs,
+            tool_id=ev.tool_id,
+            tool_output=result,
+            return_direct=tool.metadata.return_direct if tool else False,
+        )
+
+        predecessor = self._predecessor.get(ev.tool_id)
+        if predecessor is not None:
+            await self._released[predecessor].wait()
+        ctx.write_event_to_stream(result_ev)
+        if ev.tool_id in self._released:
+            self._released[ev.tool_id].set()
+        return result_ev
+
+
+class ParallelFunctionAgent(FunctionAgent):
+    """FunctionAgent that runs in a ParallelAgentWorkflow.
+
+    Each LLM call waits for a slot of the shared fair-share scheduler.
+    """
+
+    async def take_step(
+        self,
+        ctx: Context,
+        llm_input: List[ChatMessage],
+        tools: Sequence[AsyncBaseTool],
+        memory: BaseMemory,
+    ) -> AgentOutput:
+        async with scheduler.llm_calls.slot():
+            return await super().take_step(ctx, llm_input, tools, memory)
+
+    def _get_steps(self):
+        return ParallelAgentWorkflow(agents=[self])._get_steps()
+
+    def run(
+        self,
+        user_msg: Optional[Union[str, ChatMessage]] = None,
+        chat_history: Optional[List[ChatMessage]] = None,
+        memory: Optional[BaseMemory] = None,
+        ctx: Optional[Context] = None,
+        stepwise: bool = False,
+        checkpoint_callback: Optional[CheckpointCallback] = None,
+        **workflow_kwargs: Any,
+    ) -> WorkflowHandler:
+        workflow = ParallelAgentWorkflow(agents=[self], **workflow_kwargs)
+        return workflow.run(
+            user_msg=user_msg,
+            chat_history=chat_history,
+            memory=memory,
+            ctx=ctx,
+            stepwise=stepwise,
+            checkpoint_callback=checkpoint_callback,
+        )
@@ -0,0 +1,315 @@
+import asyncio
+import json
+import logging
+import time
+from functools import lru_cache
+from typing import Awaitable, Callable, List, Optional
+
+import websockets
+
+try:
+    import vosk
+except ImportError:
+    vosk = None
+
+logger = logging.getLogger(__name__)
+
+# Called with the transcript so far whenever it changes
+TranscriptCallback = Callable[[str], Awaitable[None]]
+
+# Bytes read from ffmpeg at a time: 0.1s of 16 kHz 16-bit mono PCM
+PCM_READ_BYTES = 3200
+
+# Bytes of ffmpeg's error output kept for the error message
+STDERR_TAIL_BYTES = 4096
+
+
+class AsrError(Exception):
+    """Speech recognition of a voice message failed"""
+
+
+class Recognizer:
+    """Streaming speech recognizer fed with 16-bit mono PCM.
+
+    Vosk returns a partial hypothesis for the current utterance while audio
+    arrives and a final text each time it detects the end of an utterance.
+    The transcript is the final texts so far followed by the partial one.
+    """
+
+    def __init__(self, on_update: Optional[TranscriptCallback] = None):
+        self.on_update = on_update
+        self.segments: List[str] = []
+        self.partial = ""
+        self._reported = ""
+
+    @property
+    def text(self) -> str:
+        return " ".join(self.segments + ([self.partial] if self.partial else []))
+
+    async def start(self, sample_rate: int):
+        raise NotImplementedError
+
+    async def feed(self, pcm: bytes):
+        raise NotImplementedError
+
+    async def finish(self) -> str:
+        """Flush the last utterance and return the final transcript"""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    async def _handle(self, result: dict):
+        if "partial" in result:
+            self.partial = result["partial"]
+        elif "text" in result:
+            if result["text"]:
+                self.segments.append(result["text"])
+            self.partial = ""
+        text = self.text
+        if self.on_update is not None and text != self._reported:
+            self._reported = text
+            await self.on_update(text)
+
+
+class VoskServerRecognizer(Recognizer):
+    """Streams audio to a Vosk WebSocket server (alphacep/kaldi-vosk-server)"""
+
+    def __init__(self, url: str, on_update: Optional[TranscriptCallback] = None, final_timeout: float = 15.0):
+        super().__init__(on_update)
+        self.url = url
+        self.final_timeout = final_timeout
+        self._ws = None
+        self._reader: Optional[asyncio.Task] = None
+
+    async def start(self, sample_rate: int):
+        try:
+            self._ws = await websockets.connect(self.url, max_size=None)
+        except (OSError, websockets.exceptions.WebSocketException) as e:
+            raise AsrError(f"Cannot connect to the Vosk server at {self.url}: {str(e)}")
+        await self._ws.send(json.dumps({"config": {"sample_rate": sample_rate}}))
+        self._reader = asyncio.create_task(self._read())
+
+    async def feed(self, pcm: bytes):
+        if self._reader.done():
+            self._reader.result()
+            raise AsrError("The Vosk server closed the connection")
+        await self._ws.send(pcm)
+
+    async def finish(self) -> str:
+        await self._ws.send(json.dumps({"eof": 1}))
+        # The server answers eof with the final result and closes the socket
+        try:
+            await asyncio.wait_for(asyncio.shield(self._reader), self.final_timeout)
+        except asyncio.TimeoutError:
+            raise AsrError(f"No final result from the Vosk server within {self.final_timeout}s")
+        return self.text
+
+    async def close(self):
+        if self._reader is not None and not self._reader.done():
+            self._reader.cancel()
+        if self._ws is not None:
+            await self._ws.close()
+
+    async def _read(self):
+        try:
+            async for message in self._ws:
+                await self._handle(json.loads(message))
+        except websockets.exceptions.ConnectionClosedError as e:
+            raise AsrError(f"Lost the connection to the Vosk server: {str(e)}")
+
+
+@lru_cache(maxsize=None)
+def load_vosk_model(path: str):
+    """Load a Vosk model once per process; loading takes seconds"""
+    if vosk is None:
+        raise AsrError("ASR_BACKEND=vosk but the vosk package is not installed")
+    return vosk.Model(path)
+
+
+class LocalVoskRecognizer(Recognizer):
+    """Runs a Vosk recognizer in process, decoding in a worker thread"""
+
+    def __init__(self, model_path: str, on_update: Optional[TranscriptCallback] = None):
+        super().__init__(on_update)
+        self.model_path = model_path
+        self._recognizer = None
+
+    async def start(self, sample_rate: int):
+        model = await asyncio.to_thread(load_vosk_model, self.model_path)
+        self._recognizer = vosk.KaldiRecognizer(model, sample_rate)
+
+    async def feed(self, pcm: bytes):
+        await self._handle(await asyncio.to_thread(self._accept, pcm))
+
+    async def finish(self) -> str:
+        await self._handle(json.loads(await asyncio.to_thread(self._recognizer.FinalResult)))
+        return self.text
+
+    def _accept(self, pcm: bytes) -> dict:
+        if self._recognizer.AcceptWaveform(pcm):
+            return json.loads(self._recognizer.Result())
+        return json.loads(self._recognizer.PartialResult())
+
+
+class FfmpegDecoder:
+    """Decodes a compressed stream (OGG/Opus, WebM, MP3, ...) to PCM on the fly.
+
+    Audio is piped through ffmpeg's stdin and stdout, so decoding overlaps
+    the upload and nothing touches the disk. Its error output is read all
+    along, so ffmpeg never blocks on a full stderr pipe.
+    """
+
+    def __init__(self, sample_rate: int, on_pcm: Callable[[bytes], Awaitable[None]], binary: str = "ffmpeg"):
+        self.sample_rate = sample_rate
+        self.on_pcm = on_pcm
+        self.binary = binary
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._pump: Optional[asyncio.Task] = None
+        self._stderr: Optional[asyncio.Task] = None
+
+    async def start(self):
+        try:
+            self._process = await asyncio.create_subprocess_exec(
+                self.binary, "-loglevel", "error", "-i", "pipe:0",
+                "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(self.sample_rate), "pipe:1",
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except FileNotFoundError:
+            raise AsrError(f"Compressed audio needs ffmpeg, but '{self.binary}' was not found")
+        self._pump = asyncio.create_task(self._read())
+        self._stderr = asyncio.create_task(self._read_stderr())
+
+    async def feed(self, chunk: bytes):
+        if self._pump.done():
+            self._pump.result()
+            raise AsrError("ffmpeg stopped decoding the audio")
+        self._process.stdin.write(chunk)
+        await self._process.stdin.drain()
+
+    async def finish(self):
+        self._process.stdin.close()
+        await self._pump
+        if await self._process.wait() != 0:
+            error = (await self._stderr).decode(errors="replace").strip()
+            raise AsrError(f"ffmpeg could not decode the audio: {error or 'unknown error'}")
+
+    async def close(self):
+        for task in (self._pump, self._stderr):
+            if task is not None and not task.done():
+                task.cancel()
+        if self._process is not None and self._process.returncode is None:
+            self._process.kill()
+            await self._process.wait()
+
+    async def _read(self):
+        while True:
+            pcm = await self._process.stdout.read(PCM_READ_BYTES)
+            if not pcm:
+                return
+            await self.on_pcm(pcm)
+
+    async def _read_stderr(self) -> bytes:
+        """Read ffmpeg's error output until it exits, keeping the end of it"""
+        tail = b""
+        while True:
+            data = await self._process.stderr.read(STDERR_TAIL_BYTES)
+            if not data:
+                return tail
+            tail = (tail + data)[-STDERR_TAIL_BYTES:]
+
+
+class AudioTranscription:
+    """One voice message, transcribed while its binary frames arrive.
+
+    The connection handler `put`s frames and calls `end`; `run`, in the
+    request's task, feeds them to the recognizer (through ffmpeg unless the
+    audio is already raw PCM) and returns the transcript. The queue is
+    bounded, so a slow recognizer slows down reading from the client.
+    Finishing decoding and recognition after the end of the audio may take
+    at most `final_timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        task_id: str,
+        recognizer: Recognizer,
+        audio_format: str = "pcm",
+        sample_rate: int = 16000,
+        max_bytes: int = 20 * 1024 * 1024,
+        queue_frames: int = 64,
+        ffmpeg: str = "ffmpeg",
+        final_timeout: float = 15.0,
+    ):
+        self.task_id = task_id
+        self.recognizer = recognizer
+        self.audio_format = audio_format
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.ffmpeg = ffmpeg
+        self.final_timeout = final_timeout
+        self.received = 0
+        self.closed = False
+        self.ended_at: Optional[float] = None
+        # Seconds from the end of the upload to the final transcript
+        self.finalize_seconds: Optional[float] = None
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_frames)
+
+    async def put(self, chunk: bytes):
+        """Queue a binary frame; frames of a stopped transcription are dropped"""
+        if not self.closed and self.ended_at is None:
+            await self._queue.put(chunk)
+
+    async def end(self):
+        """Mark the end of the audio"""
+        if not self.closed and self.ended_at is None:
+            self.ended_at = time.monotonic()
+            await self._queue.put(None)
+
+    async def run(self) -> str:
+        decoder = None
+        try:
+            # Raw PCM is sent at the client's sample rate, decoded audio at ours
+            await self.recognizer.start(self.sample_rate)
+            sink = self.recognizer.feed
+            if self.audio_format != "pcm":
+                decoder = FfmpegDecoder(self.sample_rate, self.recognizer.feed, self.ffmpeg)
+                await decoder.start()
+                sink = decoder.feed
+
+            while True:
+                chunk = await self._queue.get()
+                if chunk is None:
+                    break
+                self.received += len(chunk)
+                if self.received > self.max_bytes:
+                    raise AsrError(f"Voice message is larger than {self.max_bytes} bytes")
+                await sink(chunk)
+
+            try:
+                text = await asyncio.wait_for(self._finish(decoder), self.final_timeout)
+            except asyncio.TimeoutError:
+                raise AsrError(f"No final transcript within {self.final_timeout}s of the end of the audio")
+            self.finalize_seconds = time.monotonic() - self.ended_at
+            return text
+        finally:
+            await self.close(decoder)
+
+    async def _finish(self, decoder: Optional[FfmpegDecoder]) -> str:
+        if decoder is not None:
+            await decoder.finish()
+        return await self.recognizer.finish()
+
+    async def close(self, decoder: Optional[FfmpegDecoder] = None):
+        self.closed = True
+        # Wake up a connection handler blocked on a full queue
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        if decoder is not None:
+            await decoder.close()
+        try:
+            await self.recognizer.close()
+        except Exception as e:
+            logger.debug(f"Error closing recognizer of task {self.task_id}: {str(e)}")
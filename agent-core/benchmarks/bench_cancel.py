@@ -0,0 +1,205 @@
+"""
+How quickly a cancelled agent request frees its LLM stream and MCP call.
+
+Runs websocket_server's request handling in-process against a slow stub LLM
+and the stub MCP server (benchmarks/stub_mcp_server.py, spawned here), and
+cancels requests the way `cancel_request` does. For each scenario it reports:
+
+    task        cancel -> request task finished (task_cancelled sent)
+    llm_freed   cancel -> no stub LLM stream left open
+    mcp_freed   cancel -> no tool call left running on the MCP server
+    history     chat history restored to the last completed turn
+    follow_up   the next request on the same session completes
+
+A round whose tool call is not freed within half the stub tool latency
+counts as failed: the cancellation did not reach the MCP server and the
+tool ran (nearly) to the end. Failed rounds are listed, not folded into the
+percentiles.
+
+    python benchmarks/bench_cancel.py --rounds 10 --mcp-latency 5 --token-delay 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import ClassVar
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from bench_load import wait_for_port  # noqa: E402
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return "-"
+    pick = lambda p: values[min(len(values) - 1, int(p * len(values)))] * 1000  # noqa: E731
+    return f"p50 {pick(0.5):7.1f} ms  p95 {pick(0.95):7.1f} ms  max {values[-1] * 1000:7.1f} ms"
+
+
+class RecordingSender:
+    """Stands in for EventSender, keeping the events sent to the client"""
+
+    def __init__(self):
+        self.capabilities = {"delta"}
+        self.events = asyncio.Queue()
+
+    async def send(self, event_type, data):
+        await self.events.put((event_type, data))
+
+    async def wait_for(self, task_id, *event_types):
+        """The next of `event_types` sent for `task_id`, skipping everything else"""
+        while True:
+            event_type, data = await self.events.get()
+            if event_type in event_types and data.get("task_id") == task_id:
+                return event_type, data
+
+
+def mcp_in_flight(stats_url):
+    with urllib.request.urlopen(stats_url, timeout=5) as response:
+        return json.loads(response.read())["in_flight"]
+
+
+async def wait_until(predicate, timeout):
+    """Seconds until predicate() holds, or None after timeout"""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if await predicate():
+            return time.perf_counter() - started
+        await asyncio.sleep(0.01)
+    return None
+
+
+async def run_scenario(server, llm_class, args, name, trigger, tool_plan):
+    stats_url = f"http://127.0.0.1:{args.mcp_port}/stats"
+    route = server.router.default
+    route.llm = llm_class(
+        answer=" ".join(["token"] * 200),
+        token_delay=args.token_delay,
+        tool_plan=tool_plan,
+    )
+    results = {"task": [], "llm_freed": [], "mcp_freed": [], "history": 0, "follow_up": 0}
+    failed = []
+
+    for i in range(args.rounds):
+        sender = RecordingSender()
+        session_id = await server.handle_login(sender, "bench", {})
+        session = server.active_sessions[session_id]
+        # One completed turn to roll back to
+        route.llm.tool_plan = []
+        route.llm.answer = "Ready."
+        await server.process_agent_request(sender, "bench", session_id, "warmup", "hello")
+        before = len(await session.memory.aget_all())
+
+        route.llm.tool_plan = tool_plan
+        route.llm.answer = " ".join(["token"] * 200)
+        task = asyncio.create_task(server.process_agent_request(sender, "bench", session_id, f"t{i}", "go"))
+        session.add_task(f"t{i}", task)
+        await asyncio.wait_for(sender.wait_for(f"t{i}", trigger), args.timeout)
+
+        cancelled_at = time.perf_counter()
+        task.cancel()
+        await task
+        results["task"].append(time.perf_counter() - cancelled_at)
+
+        async def llm_idle():
+            return llm_class.in_flight == 0
+
+        async def mcp_idle():
+            return await asyncio.to_thread(mcp_in_flight, stats_url) == 0
+
+        for key, predicate in (("llm_freed", llm_idle), ("mcp_freed", mcp_idle)):
+            freed = await wait_until(predicate, args.timeout)
+            seconds = time.perf_counter() - cancelled_at
+            if key == "mcp_freed" and (freed is None or seconds >= args.mcp_latency / 2):
+                failed.append((i, None if freed is None else seconds))
+            elif freed is not None:
+                results[key].append(seconds)
+
+        if len(await session.memory.aget_all()) == before:
+            results["history"] += 1
+
+        route.llm.tool_plan = []
+        route.llm.answer = "Done."
+        follow_up = asyncio.create_task(server.process_agent_request(sender, "bench", session_id, f"f{i}", "again"))
+        try:
+            event_type, _ = await asyncio.wait_for(sender.wait_for(f"f{i}", "agent_response", "error"), args.timeout)
+            results["follow_up"] += event_type == "agent_response"
+        except asyncio.TimeoutError:
+            follow_up.cancel()
+        server.end_session(session_id)
+
+    print(f"{name} ({args.rounds} rounds)")
+    for key in ("task", "llm_freed", "mcp_freed"):
+        print(f"  {key:<10} {len(results[key]):>3} freed  {percentiles(results[key])}")
+    for i, seconds in failed:
+        print(f"  FAILED     round {i}: tool call {'still running' if seconds is None else f'freed after {seconds * 1000:.1f} ms'}")
+    print(f"  history    {results['history']:>3} restored")
+    print(f"  follow_up  {results['follow_up']:>3} completed")
+
+
+async def bench(args, server):
+    # Builds the routes and MCP client and lists the tools, as the server does after it starts listening
+    await server.start_agent_runtime()
+    from stub_llm import StubLLM
+
+    class CountingStubLLM(StubLLM):
+        """StubLLM counting its open response streams"""
+
+        in_flight: ClassVar[int] = 0
+
+        async def astream_chat(self, messages, **kwargs):
+            inner = await super().astream_chat(messages, **kwargs)
+
+            async def gen():
+                CountingStubLLM.in_flight += 1
+                try:
+                    async for chunk in inner:
+                        yield chunk
+                finally:
+                    CountingStubLLM.in_flight -= 1
+
+            return gen()
+
+    await run_scenario(server, CountingStubLLM, args, "cancel while streaming the answer", "agent_delta", [])
+    await run_scenario(
+        server, CountingStubLLM, args, "cancel during a slow tool call", "tool_call",
+        [{"name": "get_sheet_data", "kwargs": {"spreadsheet_id": "bench", "sheet": "Sheet1"}}],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--mcp-port", type=int, default=8932)
+    parser.add_argument("--mcp-latency", type=float, default=5.0, help="Seconds each stub tool call takes")
+    parser.add_argument("--token-delay", type=float, default=0.2, help="Seconds between stub LLM tokens")
+    parser.add_argument("--timeout", type=float, default=15.0)
+    args = parser.parse_args()
+
+    mcp = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "stub_mcp_server.py"),
+         "--port", str(args.mcp_port), "--latency", str(args.mcp_latency)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port("127.0.0.1", args.mcp_port, 30, mcp)
+        os.environ["MCP_SERVER_URL"] = f"http://127.0.0.1:{args.mcp_port}/sse"
+        os.environ["LLM_ROUTES"] = json.dumps([{"name": "stub", "provider": "stub"}])
+        import websocket_server as server
+        logging.getLogger().setLevel(logging.WARNING)
+        asyncio.run(bench(args, server))
+    finally:
+        mcp.terminate()
+        mcp.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Prompt-token reduction from tool-result compaction.
+
+Replays recorded sessions (JSON lines of the events a client received, one
+session per file) and counts how many prompt tokens the tool results cost
+with and without compaction. Every tool result stays in the chat history, so
+it is paid again on each later LLM call of the session; an `agent_output`
+event marks one LLM call.
+
+    python benchmarks/bench_compaction.py recordings/*.jsonl
+    python benchmarks/bench_compaction.py --synthetic
+
+Recordings made before compaction carry the pydantic repr of the MCP
+CallToolResult as `tool_output`; the text items are recovered from it.
+"""
+
+import argparse
+import ast
+import json
+import os
+import re
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llama_index.core.tools import ToolOutput  # noqa: E402
+
+from compaction import COMPACT_THRESHOLD_CHARS, ToolResultStore, compact_output  # noqa: E402
+
+_TEXT_ITEM = re.compile(r"TextContent\(type='text', text=('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")")
+
+
+def count_tokens_fn():
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("o200k_base")
+        return lambda text: len(encoding.encode(text))
+    except Exception:
+        # No tokenizer files available offline: ~4 characters per token
+        return lambda text: len(text) // 4 + 1
+
+
+def recorded_output(tool_output: str):
+    """Rebuild a CallToolResult-like object from a recorded tool_output"""
+    texts = [ast.literal_eval(m.group(1)) for m in _TEXT_ITEM.finditer(tool_output)]
+    if not texts:
+        texts = [tool_output]
+    return SimpleNamespace(content=[SimpleNamespace(text=t) for t in texts])
+
+
+def load_session(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                event = json.loads(line)
+                # Batched frames hold several events
+                yield from event if isinstance(event, list) else [event]
+
+
+def synthetic_session(rows=300, turns=4):
+    """A few turns of reading a sales sheet, flattened by MCP into one item per cell"""
+    cells = ["date", "customer", "amount"]
+    for i in range(rows):
+        cells += [f"2025-05-{i % 28 + 1:02d}", f"Customer {i % 37}", str(100 + i * 7 % 900)]
+    content = "meta=None content=[" + ", ".join(
+        f"TextContent(type='text', text={c!r}, annotations=None)" for c in cells
+    ) + "] isError=False"
+    for _ in range(turns):
+        yield {"event": "tool_call", "data": {"tool_name": "get_sheet_data"}}
+        yield {"event": "agent_output", "data": {}}
+        yield {"event": "tool_result", "data": {"tool_name": "get_sheet_data", "tool_output": content}}
+        yield {"event": "agent_output", "data": {}}
+
+
+def measure(events, count_tokens, threshold):
+    store = ToolResultStore()
+    context_original = context_compacted = 0
+    total_original = total_compacted = 0
+    for event in events:
+        if event.get("event") == "tool_result":
+            data = event["data"]
+            original = data.get("tool_output", "")
+            output = ToolOutput(
+                content=original,
+                tool_name=data.get("tool_name", ""),
+                raw_input={},
+                raw_output=recorded_output(original),
+            )
+            compacted = compact_output(output, store, threshold).content
+            context_original += count_tokens(original)
+            context_compacted += count_tokens(compacted)
+        elif event.get("event") == "agent_output":
+            total_original += context_original
+            total_compacted += context_compacted
+    return total_original, total_compacted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recordings", nargs="*", help="JSON lines files, one session each")
+    parser.add_argument("--synthetic", action="store_true", help="Use a generated session")
+    parser.add_argument("--threshold", type=int, default=COMPACT_THRESHOLD_CHARS)
+    args = parser.parse_args()
+    if not args.recordings and not args.synthetic:
+        parser.error("give recordings or --synthetic")
+
+    count_tokens = count_tokens_fn()
+    sessions = [(path, load_session(path)) for path in args.recordings]
+    if args.synthetic:
+        sessions.append(("synthetic", synthetic_session()))
+
+    grand_original = grand_compacted = 0
+    print(f"{'session':40} {'original':>12} {'compacted':>12} {'reduction':>10}")
+    for name, events in sessions:
+        original, compacted = measure(events, count_tokens, args.threshold)
+        grand_original += original
+        grand_compacted += compacted
+        reduction = 1 - compacted / original if original else 0.0
+        print(f"{os.path.basename(name)[:40]:40} {original:>12} {compacted:>12} {reduction:>9.1%}")
+    if len(sessions) > 1 and grand_original:
+        print(f"{'total':40} {grand_original:>12} {grand_compacted:>12} {1 - grand_compacted / grand_original:>9.1%}")
+
+
+if __name__ == "__main__":
+    main()
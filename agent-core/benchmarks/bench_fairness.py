@@ -0,0 +1,142 @@
+"""
+Latency of light users while heavy users saturate the LLM and MCP capacity.
+
+Simulates agent runs in process: each run alternates LLM calls and rounds of
+tool calls, with sleeps standing in for both. Heavy users keep several long
+runs going back to back; light users send a short request every now and
+then. The same workload runs twice:
+
+    race   calls go straight to a backend serving `capacity` calls at once,
+           first come first served (what runs did before the scheduler)
+    fair   calls wait for a slot of scheduler.FairScheduler, per user
+
+and reports per user class the run latency percentiles and the runs done.
+
+    python benchmarks/bench_fairness.py
+    python benchmarks/bench_fairness.py --heavy-users 4 --light-users 20 --llm-slots 8 --duration 20
+    python benchmarks/bench_fairness.py --light-weight 2
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scheduler  # noqa: E402
+from scheduler import FairScheduler  # noqa: E402
+
+
+class FifoBackend:
+    """A backend that serves `capacity` calls at once in arrival order"""
+
+    def __init__(self, capacity: int):
+        self.semaphore = asyncio.Semaphore(capacity)
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self.semaphore:
+            yield
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+async def agent_run(args, llm, mcp, steps: int, rng: random.Random):
+    """LLM call, tool round, ..., final LLM call"""
+    for step in range(steps):
+        async with llm.slot():
+            await asyncio.sleep(rng.uniform(0.5, 1.5) * args.llm_time)
+        if step < steps - 1:
+            async def tool_call():
+                async with mcp.slot():
+                    await asyncio.sleep(rng.uniform(0.5, 1.5) * args.tool_time)
+            await asyncio.gather(*(tool_call() for _ in range(args.tools_per_step)))
+
+
+async def user(args, name: str, heavy: bool, llm, mcp, latencies: Dict[str, List[float]], deadline: float, seed: int):
+    rng = random.Random(seed)
+    weight = 1.0 if heavy else args.light_weight
+    scheduler.current_user.set((name, weight))
+    kind = "heavy" if heavy else "light"
+
+    async def one_run():
+        steps = args.heavy_steps if heavy else args.light_steps
+        started = time.monotonic()
+        await agent_run(args, llm, mcp, steps, rng)
+        latencies[kind].append(time.monotonic() - started)
+
+    if heavy:
+        async def worker():
+            while time.monotonic() < deadline:
+                await one_run()
+        await asyncio.gather(*(worker() for _ in range(args.heavy_concurrency)))
+    else:
+        await asyncio.sleep(rng.uniform(0, args.light_interval))
+        while time.monotonic() < deadline:
+            await one_run()
+            await asyncio.sleep(rng.expovariate(1 / args.light_interval))
+
+
+async def simulate(args, mode: str) -> Dict[str, List[float]]:
+    if mode == "fair":
+        llm, mcp = FairScheduler("llm", args.llm_slots), FairScheduler("mcp", args.mcp_slots)
+    else:
+        llm, mcp = FifoBackend(args.llm_slots), FifoBackend(args.mcp_slots)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    deadline = time.monotonic() + args.duration
+    users = [
+        user(args, f"heavy{i}", True, llm, mcp, latencies, deadline, args.seed + i)
+        for i in range(args.heavy_users)
+    ] + [
+        user(args, f"light{i}", False, llm, mcp, latencies, deadline, args.seed + 1000 + i)
+        for i in range(args.light_users)
+    ]
+    await asyncio.gather(*(asyncio.create_task(u) for u in users))
+    return latencies
+
+
+def report(mode: str, latencies: Dict[str, List[float]]):
+    for kind in ("light", "heavy"):
+        values = latencies.get(kind, [])
+        if not values:
+            print(f"{mode:5} {kind:6} no runs")
+            continue
+        print(
+            f"{mode:5} {kind:6} runs {len(values):5d}  p50 {percentile(values, 0.5):6.2f}s  "
+            f"p95 {percentile(values, 0.95):6.2f}s  p99 {percentile(values, 0.99):6.2f}s  max {max(values):6.2f}s"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=15.0, help="Seconds of simulated traffic per mode")
+    parser.add_argument("--llm-slots", type=int, default=4)
+    parser.add_argument("--mcp-slots", type=int, default=8)
+    parser.add_argument("--heavy-users", type=int, default=2)
+    parser.add_argument("--heavy-concurrency", type=int, default=6, help="Runs each heavy user keeps going")
+    parser.add_argument("--heavy-steps", type=int, default=8, help="LLM calls per heavy run")
+    parser.add_argument("--light-users", type=int, default=10)
+    parser.add_argument("--light-steps", type=int, default=2, help="LLM calls per light run")
+    parser.add_argument("--light-interval", type=float, default=2.0, help="Mean seconds between a light user's runs")
+    parser.add_argument("--light-weight", type=float, default=1.0, help="Weight of light users (heavy users have 1)")
+    parser.add_argument("--tools-per-step", type=int, default=2)
+    parser.add_argument("--llm-time", type=float, default=0.2, help="Mean seconds per LLM call")
+    parser.add_argument("--tool-time", type=float, default=0.1, help="Mean seconds per tool call")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for mode in ("race", "fair"):
+        report(mode, asyncio.run(simulate(args, mode)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+"""
+Load generator and end-to-end latency benchmark for the WebSocket protocol.
+
+Opens N simulated clients that each run login -> agent_request -> stream ->
+logout, cancelling a share of their requests midway. Reports connections/sec,
+requests/sec, p50/p95/p99 latency per phase and the server's memory over
+time (from GET /stats, plus RSS when the server was spawned here).
+
+Against a running server:
+
+    python benchmarks/bench_load.py --url ws://127.0.0.1:8765 --clients 50
+
+Or spawn websocket_server.py with a stub LLM route and the stub MCP server
+(benchmarks/stub_mcp_server.py), with configurable latencies:
+
+    python benchmarks/bench_load.py --spawn --clients 100 --requests 5 \\
+        --llm-latency 0.2 --token-delay 0.01 --mcp-latency 0.05 --cancel-ratio 0.2
+
+Phases:
+    connect      TCP + WebSocket handshake
+    login        login -> login_response
+    ack          agent_request -> agent_request_received
+    first_event  agent_request -> first streamed event (fan-out latency)
+    event_gap    time between consecutive streamed events of a task
+    response     agent_request -> agent_response
+    cancel       cancel_request -> task_cancelled (the run is torn down)
+    logout       logout -> logout_response
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import websockets
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+AGENT_DIR = os.path.dirname(BENCH_DIR)
+
+STREAM_EVENTS = {"tool_call", "tool_result", "agent_output", "agent_delta"}
+
+
+class Recorder:
+    """Collects per-phase latencies and counters of all clients"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    def add(self, phase: str, seconds: float):
+        self.latencies[phase].append(seconds)
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] += n
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+class BenchClient:
+    """One simulated client speaking the agent-core protocol"""
+
+    def __init__(self, url: str, recorder: Recorder, capabilities: List[str], timeout: float):
+        self.url = url
+        self.recorder = recorder
+        self.capabilities = capabilities
+        self.timeout = timeout
+        self.websocket = None
+
+    async def send(self, event: str, data: Dict[str, Any]):
+        await self.websocket.send(json.dumps({"event": event, "data": data}))
+
+    async def events(self):
+        """Yield received events, unpacking batched frames"""
+        while True:
+            frame = json.loads(await asyncio.wait_for(self.websocket.recv(), self.timeout))
+            for event in frame if isinstance(frame, list) else [frame]:
+                self.recorder.count(f"event:{event.get('event')}")
+                yield event
+
+    async def wait_for(self, *event_types: str) -> Dict[str, Any]:
+        async for event in self.events():
+            if event.get("event") in event_types:
+                return event
+            if event.get("event") == "error":
+                raise RuntimeError(event.get("data", {}).get("message"))
+
+    async def connect(self):
+        started = time.perf_counter()
+        self.websocket = await websockets.connect(self.url, max_size=None, open_timeout=self.timeout)
+        self.recorder.add("connect", time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await self.send("login", {"capabilities": self.capabilities})
+        await self.wait_for("login_response")
+        self.recorder.add("login", time.perf_counter() - started)
+        self.recorder.count("logins")
+
+    async def request(self, message: str, cancel: bool):
+        started = time.perf_counter()
+        await self.send("agent_request", {"message": message})
+        ack = await self.wait_for("agent_request_received")
+        self.recorder.add("ack", time.perf_counter() - started)
+        task_id = ack["data"]["task_id"]
+
+        last_event = None
+        async for event in self.events():
+            event_type = event.get("event")
+            if event.get("data", {}).get("task_id", task_id) != task_id:
+                continue
+            now = time.perf_counter()
+            if event_type in STREAM_EVENTS:
+                if last_event is None:
+                    self.recorder.add("first_event", now - started)
+                else:
+                    self.recorder.add("event_gap", now - last_event)
+                last_event = now
+                if cancel:
+                    break
+            elif event_type == "agent_response":
+                self.recorder.add("response", now - started)
+                self.recorder.count("responses")
+                return
+            elif event_type in ("error", "task_cancelled"):
+                self.recorder.count(f"request_{event_type}")
+                return
+
+        cancel_started = time.perf_counter()
+        await self.send("cancel_request", {"task_id": task_id})
+        async for event in self.events():
+            if event.get("data", {}).get("task_id") != task_id:
+                continue
+            if event["event"] == "agent_response":
+                # Finished before the cancellation arrived
+                self.recorder.count("responses")
+                return
+            if event["event"] == "task_cancelled":
+                # Sent once the run has been torn down
+                self.recorder.add("cancel", time.perf_counter() - cancel_started)
+                self.recorder.count("cancels")
+                return
+
+    async def logout(self):
+        started = time.perf_counter()
+        await self.send("logout", {})
+        await self.wait_for("logout_response")
+        self.recorder.add("logout", time.perf_counter() - started)
+        await self.websocket.close()
+
+
+async def run_client(args, recorder: Recorder, delay: float):
+    await asyncio.sleep(delay)
+    client = BenchClient(args.url, recorder, args.capabilities, args.timeout)
+    try:
+        await client.connect()
+        for _ in range(args.requests):
+            await client.request(args.message, cancel=random.random() < args.cancel_ratio)
+        await client.logout()
+    except Exception as e:
+        recorder.count(f"failed:{type(e).__name__}")
+        if client.websocket is not None:
+            await client.websocket.close()
+
+
+def fetch_stats(stats_url: str) -> Optional[Dict[str, Any]]:
+    try:
+        with urllib.request.urlopen(stats_url, timeout=5) as response:
+            return json.loads(response.read())
+    except Exception:
+        return None
+
+
+def read_rss(pid: Optional[int]) -> Optional[int]:
+    """Resident set size of a process in bytes (Linux only)"""
+    if pid is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+async def sample_memory(stats_url: str, pid: Optional[int], interval: float, samples: List[Dict[str, Any]]):
+    started = time.perf_counter()
+    while True:
+        stats = await asyncio.to_thread(fetch_stats, stats_url) or {}
+        samples.append({
+            "t": time.perf_counter() - started,
+            "rss": read_rss(pid),
+            "sessions": stats.get("session_count"),
+            "active_tasks": stats.get("active_tasks"),
+            "history_bytes": stats.get("history_bytes"),
+        })
+        await asyncio.sleep(interval)
+
+
+def wait_for_port(host: str, port: int, timeout: float, process: subprocess.Popen):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process exited with code {process.returncode} before listening on {port}")
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Nothing listening on {host}:{port} after {timeout}s")
+
+
+def spawn_servers(args) -> List[subprocess.Popen]:
+    """Start the stub MCP server and websocket_server.py with a stub LLM route"""
+    mcp = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "stub_mcp_server.py"),
+         "--port", str(args.mcp_port), "--latency", str(args.mcp_latency)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    wait_for_port("127.0.0.1", args.mcp_port, 30, mcp)
+
+    route = {
+        "name": "stub",
+        "provider": "stub",
+        "options": {
+            "latency": args.llm_latency,
+            "token_delay": args.token_delay,
+            "answer": " ".join(["token"] * args.answer_words),
+            "tool_plan": [{"name": "get_sheet_data", "kwargs": {"spreadsheet_id": "bench", "sheet": "Sheet1"}}],
+        },
+    }
+    env = dict(
+        os.environ,
+        LLM_ROUTES=json.dumps([route]),
+        MCP_SERVER_URL=f"http://127.0.0.1:{args.mcp_port}/sse",
+        WS_HOST="127.0.0.1",
+        WS_PORT=str(args.port),
+    )
+    server = subprocess.Popen(
+        [sys.executable, "websocket_server.py"],
+        cwd=AGENT_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=None if args.server_logs else subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port("127.0.0.1", args.port, 60, server)
+    except Exception:
+        mcp.terminate()
+        raise
+    return [mcp, server]
+
+
+def report(args, recorder: Recorder, wall: float, login_span: float, samples: List[Dict[str, Any]]):
+    counters = recorder.counters
+    print(f"clients={args.clients} requests/client={args.requests} cancel_ratio={args.cancel_ratio} wall={wall:.2f}s")
+    print(f"connections/sec: {counters['logins'] / login_span:.1f}" if login_span else "connections/sec: n/a")
+    finished = counters["responses"] + counters["cancels"]
+    print(f"requests/sec:    {finished / wall:.1f} ({counters['responses']} answered, {counters['cancels']} cancelled)")
+    failures = {k: v for k, v in counters.items() if k.startswith(("failed:", "request_"))}
+    if failures:
+        print(f"failures:        {failures}")
+
+    print()
+    print(f"{'phase':<12} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for phase in ("connect", "login", "ack", "first_event", "event_gap", "response", "cancel", "logout"):
+        values = recorder.latencies.get(phase)
+        if not values:
+            continue
+        print(
+            f"{phase:<12} {len(values):>7} "
+            f"{percentile(values, 0.50) * 1000:>9.1f} {percentile(values, 0.95) * 1000:>9.1f} "
+            f"{percentile(values, 0.99) * 1000:>9.1f} {max(values) * 1000:>9.1f}"
+        )
+
+    if samples:
+        print()
+        print(f"{'t s':>7} {'rss MB':>9} {'sessions':>9} {'tasks':>7} {'history KB':>11}")
+        step = max(1, len(samples) // 20)
+        for sample in samples[::step] + ([samples[-1]] if (len(samples) - 1) % step else []):
+            rss = f"{sample['rss'] / 2 ** 20:.1f}" if sample["rss"] else "-"
+            history = f"{sample['history_bytes'] / 1024:.1f}" if sample["history_bytes"] is not None else "-"
+            print(f"{sample['t']:>7.1f} {rss:>9} {sample['sessions'] if sample['sessions'] is not None else '-':>9} "
+                  f"{sample['active_tasks'] if sample['active_tasks'] is not None else '-':>7} {history:>11}")
+        rss = [s["rss"] for s in samples if s["rss"]]
+        if len(rss) > 1:
+            print(f"rss growth: {(rss[-1] - rss[0]) / 2 ** 20:+.1f} MB")
+
+
+async def bench(args, pid: Optional[int]):
+    recorder = Recorder()
+    samples: List[Dict[str, Any]] = []
+    stats_url = args.url.replace("ws://", "http://").replace("wss://", "https://").rstrip("/") + "/stats"
+    sampler = asyncio.create_task(sample_memory(stats_url, pid, args.sample_interval, samples))
+
+    started = time.perf_counter()
+    clients = [
+        run_client(args, recorder, args.ramp * i / max(1, args.clients - 1))
+        for i in range(args.clients)
+    ]
+    await asyncio.gather(*clients)
+    wall = time.perf_counter() - started
+
+    # Let the server settle, then take a last sample
+    await asyncio.sleep(args.sample_interval)
+    sampler.cancel()
+
+    connect_phase = recorder.latencies["connect"] + recorder.latencies["login"]
+    login_span = args.ramp + max(connect_phase, default=0.0)
+    report(args, recorder, wall, login_span, samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="Server URL (default ws://127.0.0.1:PORT)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=3, help="Agent requests per client")
+    parser.add_argument("--cancel-ratio", type=float, default=0.1, help="Share of requests cancelled after the first event")
+    parser.add_argument("--ramp", type=float, default=1.0, help="Seconds over which clients connect")
+    parser.add_argument("--message", default="Покажи данные из таблицы")
+    parser.add_argument("--capabilities", nargs="*", default=["delta", "batch"])
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--sample-interval", type=float, default=1.0)
+    parser.add_argument("--server-pid", type=int, default=None, help="Sample RSS of an already running server")
+    parser.add_argument("--spawn", action="store_true", help="Start the server and the stub MCP server")
+    parser.add_argument("--mcp-port", type=int, default=8931)
+    parser.add_argument("--llm-latency", type=float, default=0.1)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--answer-words", type=int, default=40)
+    parser.add_argument("--mcp-latency", type=float, default=0.05)
+    parser.add_argument("--server-logs", action="store_true", help="Show the spawned server's log")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    args.url = args.url or f"ws://127.0.0.1:{args.port}"
+    random.seed(args.seed)
+
+    processes = spawn_servers(args) if args.spawn else []
+    pid = processes[-1].pid if processes else args.server_pid
+    try:
+        asyncio.run(bench(args, pid))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+LLM round trips and latency per request, step-wise agent vs plan-then-execute.
+
+Spawns websocket_server.py with a stub LLM route that works through a
+multi-step tool plan (by default reading five ranges and writing a summary,
+"copy these 5 ranges into a summary tab") and the stub MCP server. The
+step-wise agent calls one tool per LLM step, as a model working through
+dependent steps does; in plan mode the stub replies to the planning call with
+the whole plan. Requests are sent one after another in each mode, and the
+LLM calls are counted from GET /metrics.
+
+    python benchmarks/bench_plan.py --requests 10 --llm-latency 0.3 --mcp-latency 0.05
+    python benchmarks/bench_plan.py --reads 10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import List
+
+import websockets
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+AGENT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_load import percentile, wait_for_port  # noqa: E402
+
+LLM_CALLS_RE = re.compile(r'^agent_llm_call_duration_seconds_count\{[^}]*\} (\S+)$', re.MULTILINE)
+
+
+def tool_plan(reads: int) -> List[dict]:
+    plan = [
+        {"name": "get_sheet_data", "kwargs": {"spreadsheet_id": "bench", "sheet": "Sheet1", "range": f"A{i * 10 + 1}:D{i * 10 + 10}"}}
+        for i in range(reads)
+    ]
+    plan.append({"name": "update_cells", "kwargs": {"spreadsheet_id": "bench", "sheet": "Summary", "range": "A1:B1", "data": [["total", reads]]}})
+    return plan
+
+
+def spawn_servers(args) -> List[subprocess.Popen]:
+    mcp = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "stub_mcp_server.py"),
+         "--port", str(args.mcp_port), "--latency", str(args.mcp_latency)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    wait_for_port("127.0.0.1", args.mcp_port, 30, mcp)
+    route = {
+        "name": "stub",
+        "provider": "stub",
+        "options": {
+            "latency": args.llm_latency,
+            "answer": "Copied the ranges into the Summary sheet.",
+            "tool_plan": tool_plan(args.reads),
+            "sequential": True,
+        },
+    }
+    env = dict(
+        os.environ,
+        LLM_ROUTES=json.dumps([route]),
+        MCP_SERVER_URL=f"http://127.0.0.1:{args.mcp_port}/sse",
+        WS_HOST="127.0.0.1",
+        WS_PORT=str(args.port),
+    )
+    server = subprocess.Popen(
+        [sys.executable, "websocket_server.py"],
+        cwd=AGENT_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=None if args.server_logs else subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port("127.0.0.1", args.port, 60, server)
+    except Exception:
+        mcp.terminate()
+        raise
+    return [mcp, server]
+
+
+def llm_calls(port: int) -> float:
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+        text = response.read().decode("utf-8")
+    return sum(float(value) for value in LLM_CALLS_RE.findall(text))
+
+
+async def run_mode(args, mode: str):
+    latencies, tool_results = [], 0
+    calls_before = llm_calls(args.port)
+    async with websockets.connect(f"ws://127.0.0.1:{args.port}", max_size=None) as websocket:
+        await websocket.send(json.dumps({"event": "login", "data": {}}))
+        while json.loads(await websocket.recv()).get("event") != "login_response":
+            pass
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            await websocket.send(json.dumps({"event": "agent_request", "data": {"message": args.message, "mode": mode}}))
+            while True:
+                message = json.loads(await asyncio.wait_for(websocket.recv(), args.timeout))
+                event = message.get("event")
+                if event == "tool_result":
+                    tool_results += 1
+                elif event == "error":
+                    raise RuntimeError(message.get("data", {}).get("message"))
+                elif event == "agent_response":
+                    break
+            latencies.append(time.perf_counter() - started)
+    calls = llm_calls(args.port) - calls_before
+    print(
+        f"{mode:9} LLM calls/request {calls / args.requests:5.1f}  tool calls/request {tool_results / args.requests:5.1f}  "
+        f"latency p50 {percentile(latencies, 0.5) * 1000:7.1f} ms  p95 {percentile(latencies, 0.95) * 1000:7.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5, help="Requests per mode")
+    parser.add_argument("--reads", type=int, default=5, help="Ranges read before the summary is written")
+    parser.add_argument("--message", default="Copy these 5 ranges into a summary tab")
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--mcp-port", type=int, default=8933)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--mcp-latency", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--server-logs", action="store_true", help="Show the spawned server's log")
+    args = parser.parse_args()
+
+    processes = spawn_servers(args)
+    try:
+        for mode in ("stepwise", "plan"):
+            asyncio.run(run_mode(args, mode))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Cold start of websocket_server.py: how long until it accepts connections,
+reports ready and answers the first login.
+
+Spawns the server with a stub LLM route and the stub MCP server
+(benchmarks/stub_mcp_server.py) and measures, from process start:
+
+    import       `import websocket_server` in a fresh interpreter
+    listening    the WebSocket port accepts TCP connections
+    ready        GET /ready answers 200 (LLM routes built, MCP tools fetched)
+    login        a login sent as soon as the port opens gets login_response
+
+With --mcp-delay the MCP server is started that many seconds after the
+agent server, to show that the agent server listens and answers /ready
+(503) while the MCP server is down, and becomes ready once it is up.
+
+    python benchmarks/bench_startup.py --rounds 5
+    python benchmarks/bench_startup.py --rounds 3 --mcp-delay 3
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import websockets
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+AGENT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_load import wait_for_port  # noqa: E402
+
+
+def ready_status(port: int) -> int:
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/ready", timeout=2) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def start_mcp(args) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "stub_mcp_server.py"),
+         "--port", str(args.mcp_port), "--latency", str(args.mcp_latency)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def start_server(args) -> subprocess.Popen:
+    route = {"name": "stub", "provider": "stub", "options": {"latency": 0.0, "answer": "ok"}}
+    env = dict(
+        os.environ,
+        LLM_ROUTES=json.dumps([route]),
+        MCP_SERVER_URL=f"http://127.0.0.1:{args.mcp_port}/sse",
+        WS_HOST="127.0.0.1",
+        WS_PORT=str(args.port),
+        STARTUP_LOGIN_WAIT=str(args.timeout),
+        STARTUP_RETRY_INTERVAL="0.25",
+        STARTUP_MAX_RETRY_INTERVAL="1",
+    )
+    return subprocess.Popen(
+        [sys.executable, "websocket_server.py"],
+        cwd=AGENT_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=None if args.server_logs else subprocess.DEVNULL,
+    )
+
+
+async def first_login(url: str, timeout: float) -> float:
+    """Seconds from sending a login to its login_response"""
+    async with websockets.connect(url, open_timeout=timeout) as websocket:
+        started = time.perf_counter()
+        await websocket.send(json.dumps({"event": "login", "data": {}}))
+        while True:
+            message = json.loads(await asyncio.wait_for(websocket.recv(), timeout))
+            if message.get("event") == "error":
+                raise RuntimeError(message.get("data", {}).get("message"))
+            if message.get("event") == "login_response":
+                return time.perf_counter() - started
+
+
+def measure_import() -> float:
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", "import websocket_server"],
+        cwd=AGENT_DIR, env=dict(os.environ, OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "bench")),
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - started
+
+
+def run_round(args) -> dict:
+    result = {"import": measure_import()}
+    processes = []
+    if args.mcp_delay <= 0:
+        processes.append(start_mcp(args))
+        wait_for_port("127.0.0.1", args.mcp_port, 30, processes[0])
+
+    started = time.perf_counter()
+    server = start_server(args)
+    processes.append(server)
+    try:
+        wait_for_port("127.0.0.1", args.port, args.timeout, server)
+        result["listening"] = time.perf_counter() - started
+        result["ready_before_mcp"] = ready_status(args.port)
+
+        login = asyncio.run(asyncio.wait_for(_login_after(args, started, processes), args.timeout + 30))
+
+        deadline = time.monotonic() + args.timeout
+        while ready_status(args.port) != 200:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Not ready after {args.timeout}s")
+            time.sleep(0.05)
+        result["ready"] = time.perf_counter() - started
+        result["login"] = login
+        return result
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+async def _login_after(args, started: float, processes: list) -> float:
+    """Log in right away, starting the MCP server after --mcp-delay meanwhile"""
+    async def late_mcp():
+        await asyncio.sleep(args.mcp_delay)
+        processes.append(start_mcp(args))
+
+    starter = asyncio.create_task(late_mcp()) if args.mcp_delay > 0 else None
+    await first_login(f"ws://127.0.0.1:{args.port}", args.timeout)
+    if starter is not None:
+        await starter
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--mcp-port", type=int, default=8932)
+    parser.add_argument("--mcp-latency", type=float, default=0.0)
+    parser.add_argument("--mcp-delay", type=float, default=0.0, help="Start the MCP server this long after the agent server")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--server-logs", action="store_true", help="Show the spawned server's log")
+    args = parser.parse_args()
+
+    rounds = []
+    for i in range(args.rounds):
+        rounds.append(run_round(args))
+        r = rounds[-1]
+        print(
+            f"round {i + 1}: import {r['import']:.2f}s  listening {r['listening']:.2f}s  "
+            f"/ready at listen {r['ready_before_mcp']}  ready {r['ready']:.2f}s  first login {r['login']:.2f}s"
+        )
+
+    print()
+    for phase in ("import", "listening", "ready", "login"):
+        values = sorted(r[phase] for r in rounds)
+        print(f"{phase:10} median {values[len(values) // 2]:6.2f}s  min {values[0]:6.2f}s  max {values[-1]:6.2f}s")
+
+
+if __name__ == "__main__":
+    main()
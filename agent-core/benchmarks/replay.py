@@ -0,0 +1,232 @@
+"""
+Replay logged agent sessions offline against recorded LLM and tool responses.
+
+Reads the structured event log written by websocket_server.py (EVENT_LOG_PATH)
+and re-runs every logged session through `handle_login` and
+`process_agent_request`. The LLM answers each call with the response that was
+recorded for the same task, in order. Tools return the recorded outputs. No
+API key, MCP server or network access is needed. The same log always gives
+the same runs, so changes to the request path can be compared
+deterministically on real traffic.
+
+    python benchmarks/replay.py logs/events.jsonl
+    python benchmarks/replay.py logs/events.jsonl --realtime --concurrency 8 --repeat 3
+
+By default recorded LLM and tool latencies are skipped and the replay
+measures the server's own overhead. With --realtime they are slept, so
+end-to-end timings can be compared with the recorded ones. Tool latencies
+include the time a call waited for earlier calls of its turn.
+
+Tool outputs are recorded as the agent saw them, after compaction, and are
+replayed without compacting them again.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from collections import OrderedDict, defaultdict, deque
+from contextvars import ContextVar
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llama_index.core.base.llms.types import ChatMessage, ChatResponse  # noqa: E402
+from llama_index.core.bridge.pydantic import Field, PrivateAttr  # noqa: E402
+from llama_index.core.tools import AsyncBaseTool, ToolMetadata, ToolOutput  # noqa: E402
+
+from event_log import read_event_log  # noqa: E402
+from stub_llm import StubLLM  # noqa: E402
+
+# Task id of the logged run being replayed, seen by the LLM and the tools
+current_task: ContextVar[str] = ContextVar("current_task", default="")
+
+mismatches: Dict[str, int] = defaultdict(int)
+
+
+def load_sessions(records) -> "OrderedDict[str, List[Dict[str, Any]]]":
+    """Group logged runs by session, in log order"""
+    runs: Dict[str, Dict[str, Any]] = {}
+    sessions: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+    for record in records:
+        kind, task = record.get("kind"), record.get("task")
+        if kind == "run_start":
+            run = {"task": task, "message": record["message"], "llm": [], "tools": [], "seconds": None, "status": None}
+            runs[task] = run
+            sessions.setdefault(record.get("session"), []).append(run)
+        elif task in runs:
+            run = runs[task]
+            if kind == "llm_call":
+                run["llm"].append(record)
+            elif kind == "tool_result":
+                run["tools"].append(record)
+            elif kind == "run_end":
+                run["seconds"] = record.get("seconds")
+                run["status"] = record.get("status")
+    return sessions
+
+
+class ReplayLLM(StubLLM):
+    """Answers each LLM call with the next response recorded for the task"""
+
+    realtime: bool = Field(default=False, description="Sleep the recorded LLM latency")
+    _responses: Dict[str, deque] = PrivateAttr(default_factory=dict)
+
+    def load(self, task: str, records: List[Dict[str, Any]]):
+        self._responses[task] = deque(records)
+
+    def _next(self) -> tuple:
+        queue = self._responses.get(current_task.get())
+        if not queue:
+            mismatches["llm"] += 1
+            return ChatMessage(role="assistant", content="[replay: no recorded LLM response]"), 0.0
+        record = queue.popleft()
+        calls = record.get("tool_calls") or []
+        if calls:
+            message = ChatMessage(role="assistant", content=record.get("content") or "", additional_kwargs={"tool_calls": calls})
+        else:
+            message = ChatMessage(role="assistant", content=record.get("content") or "")
+        return message, record.get("seconds") or 0.0
+
+    async def achat(self, messages, **kwargs: Any) -> ChatResponse:
+        message, seconds = self._next()
+        if self.realtime:
+            await asyncio.sleep(seconds)
+        return ChatResponse(message=message)
+
+    async def astream_chat(self, messages, **kwargs: Any):
+        message, seconds = self._next()
+
+        async def gen():
+            if self.realtime:
+                await asyncio.sleep(seconds)
+            yield ChatResponse(message=message, delta=message.content or "")
+
+        return gen()
+
+
+class ReplayTool(AsyncBaseTool):
+    """Returns the outputs recorded for a tool, per task and in order"""
+
+    def __init__(self, name: str, recorded: Dict[tuple, deque], realtime: bool):
+        self.name = name
+        self.recorded = recorded
+        self.realtime = realtime
+
+    @property
+    def metadata(self) -> ToolMetadata:
+        return ToolMetadata(name=self.name, description=f"Replays recorded {self.name} results")
+
+    def call(self, *args: Any, **kwargs: Any) -> ToolOutput:
+        # For callers outside the event loop; the task id context is copied in
+        return asyncio.run(self.acall(*args, **kwargs))
+
+    async def acall(self, *args: Any, **kwargs: Any) -> ToolOutput:
+        queue = self.recorded.get((current_task.get(), self.name))
+        if not queue:
+            mismatches["tool"] += 1
+            content, is_error = f"[replay: no recorded result for {self.name}]", True
+        else:
+            record = queue.popleft()
+            if self.realtime:
+                await asyncio.sleep(record.get("seconds") or 0.0)
+            content, is_error = record.get("output") or "", bool(record.get("is_error"))
+        return ToolOutput(content=content, tool_name=self.name, raw_input=kwargs, raw_output=content, is_error=is_error)
+
+
+class CountingSender:
+    """Stands in for EventSender and only counts the events"""
+
+    def __init__(self):
+        self.capabilities = {"delta"}
+        self.events = 0
+
+    async def send(self, event_type: str, data: Dict[str, Any]):
+        self.events += 1
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] if values else 0.0
+
+
+async def replay(args, server, sessions, llm: ReplayLLM, tools: List[ReplayTool], recorded_tools):
+    await server.start_agent_runtime()
+    for route in server.router.routes:
+        route.llm = llm
+    durations: List[float] = []
+    recorded: List[float] = []
+    events = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def replay_session(runs):
+        nonlocal events
+        async with semaphore:
+            sender = CountingSender()
+            session_id = await server.handle_login(sender, "replay", {})
+            for run in runs:
+                llm.load(run["task"], run["llm"])
+                for record in run["tools"]:
+                    recorded_tools[(run["task"], record["name"])].append(record)
+                token = current_task.set(run["task"])
+                try:
+                    started = time.perf_counter()
+                    await server.process_agent_request(sender, "replay", session_id, run["task"], run["message"])
+                    durations.append(time.perf_counter() - started)
+                    if run["seconds"] is not None:
+                        recorded.append(run["seconds"])
+                finally:
+                    current_task.reset(token)
+            server.end_session(session_id)
+            events += sender.events
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        await asyncio.gather(*(replay_session(runs) for runs in sessions.values()))
+    wall = time.perf_counter() - started
+
+    print(f"sessions={len(sessions)} runs={len(durations)} repeat={args.repeat} realtime={args.realtime} wall={wall:.2f}s")
+    print(f"events sent: {events}, unmatched LLM calls: {mismatches['llm']}, unmatched tool calls: {mismatches['tool']}")
+    print(f"{'':<10} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for name, values in (("replayed", durations), ("recorded", recorded)):
+        if values:
+            print(f"{name:<10} {percentile(values, 0.5) * 1000:>9.1f} {percentile(values, 0.95) * 1000:>9.1f} {max(values) * 1000:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("logs", nargs="+", help="Event log files; rotated backups of a path are included")
+    parser.add_argument("--realtime", action="store_true", help="Sleep recorded LLM and tool latencies")
+    parser.add_argument("--concurrency", type=int, default=1, help="Sessions replayed at the same time")
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    sessions = load_sessions(read_event_log(args.logs))
+    if not sessions:
+        sys.exit("No runs found in the event log")
+
+    # Nothing of the replay goes back into a log, a cache or to the network
+    os.environ.update(
+        EVENT_LOG_PATH="",
+        RESPONSE_CACHE_ENABLED="false",
+        WORKSPACE_PREFETCH="false",
+        LLM_ROUTES=json.dumps([{"name": "replay", "provider": "stub"}]),
+    )
+    import websocket_server as server
+    logging.getLogger().setLevel(logging.WARNING)
+
+    llm = ReplayLLM(model="replay", realtime=args.realtime)
+    recorded_tools: Dict[tuple, deque] = defaultdict(deque)
+    names = sorted({record["name"] for runs in sessions.values() for run in runs for record in run["tools"]})
+    tools = [ReplayTool(name, recorded_tools, args.realtime) for name in names]
+    # Taken as the tool list by the startup, which then asks no MCP server
+    server.agent_tools = tools
+
+    asyncio.run(replay(args, server, sessions, llm, tools, recorded_tools))
+
+
+if __name__ == "__main__":
+    main()
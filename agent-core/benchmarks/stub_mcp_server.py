@@ -0,0 +1,150 @@
+"""
+Stub Google Sheets MCP server for benchmarks.
+
+Exposes a subset of the mcp-google-sheets tools over SSE, backed by an
+in-memory workbook, with a configurable latency per call. No Google
+credentials or network access are needed. GET /stats reports calls made,
+calls in flight and calls cancelled by the client.
+
+    python benchmarks/stub_mcp_server.py --port 8000 --latency 0.05
+"""
+
+import argparse
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from mcp.server.fastmcp import FastMCP
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+LATENCY = 0.0
+ROWS = 200
+
+mcp = FastMCP("Stub Google Spreadsheet")
+
+workbook: Dict[str, Dict[str, List[List[Any]]]] = {}
+call_stats = {"calls": 0, "in_flight": 0, "cancelled": 0}
+
+
+async def simulate_latency():
+    """Sleep for LATENCY, counting calls the client cancels meanwhile"""
+    call_stats["calls"] += 1
+    call_stats["in_flight"] += 1
+    try:
+        await asyncio.sleep(LATENCY)
+    except asyncio.CancelledError:
+        call_stats["cancelled"] += 1
+        raise
+    finally:
+        call_stats["in_flight"] -= 1
+
+
+@mcp.custom_route("/stats", methods=["GET"])
+async def stats(request: Request) -> JSONResponse:
+    return JSONResponse(call_stats)
+
+
+def make_sheet(rows: int) -> List[List[Any]]:
+    header = ["Date", "Item", "Qty", "Price"]
+    return [header] + [[f"2025-05-{i % 28 + 1:02d}", f"item {i}", i % 7, round(i * 1.5, 2)] for i in range(rows)]
+
+
+def get_workbook(spreadsheet_id: str) -> Dict[str, List[List[Any]]]:
+    return workbook.setdefault(spreadsheet_id, {"Sheet1": make_sheet(ROWS)})
+
+
+@mcp.tool()
+async def list_spreadsheets() -> List[Dict[str, str]]:
+    """
+    List all spreadsheets in the configured Google Drive folder.
+
+    Returns:
+        List of spreadsheets with their ID and title
+    """
+    await simulate_latency()
+    return [{"id": f"sheet-{i}", "title": f"Stub spreadsheet {i}"} for i in range(5)]
+
+
+@mcp.tool()
+async def list_sheets(spreadsheet_id: str) -> List[str]:
+    """
+    List all sheets in a Google Spreadsheet.
+
+    Args:
+        spreadsheet_id: The ID of the spreadsheet (found in the URL)
+    """
+    await simulate_latency()
+    return list(get_workbook(spreadsheet_id))
+
+
+@mcp.tool()
+async def get_sheet_data(spreadsheet_id: str, sheet: str, range: Optional[str] = None) -> List[List[Any]]:
+    """
+    Get data from a specific sheet in a Google Spreadsheet.
+
+    Args:
+        spreadsheet_id: The ID of the spreadsheet (found in the URL)
+        sheet: The name of the sheet
+        range: Ignored by the stub, the whole sheet is returned
+    """
+    await simulate_latency()
+    return get_workbook(spreadsheet_id).get(sheet, [])
+
+
+@mcp.tool()
+async def get_multiple_spreadsheet_summary(spreadsheet_ids: List[str], rows_to_fetch: int = 5) -> List[Dict[str, Any]]:
+    """
+    Get a summary of multiple Google Spreadsheets, including sheet names,
+    headers, and the first few rows of data for each sheet.
+
+    Args:
+        spreadsheet_ids: A list of spreadsheet IDs to summarize.
+        rows_to_fetch: The number of rows (including header) to fetch for the summary (default: 5).
+    """
+    await simulate_latency()
+    return [
+        {
+            "spreadsheet_id": spreadsheet_id,
+            "title": f"Stub spreadsheet {spreadsheet_id}",
+            "sheets": [
+                {"title": title, "headers": rows[0] if rows else [], "first_rows": rows[1:max(1, rows_to_fetch)]}
+                for title, rows in get_workbook(spreadsheet_id).items()
+            ],
+        }
+        for spreadsheet_id in spreadsheet_ids
+    ]
+
+
+@mcp.tool()
+async def update_cells(spreadsheet_id: str, sheet: str, range: str, data: List[List[Any]]) -> Dict[str, Any]:
+    """
+    Update cells in a Google Spreadsheet.
+
+    Args:
+        spreadsheet_id: The ID of the spreadsheet (found in the URL)
+        sheet: The name of the sheet
+        range: Cell range in A1 notation, ignored by the stub
+        data: 2D array of values appended to the sheet
+    """
+    await simulate_latency()
+    get_workbook(spreadsheet_id).setdefault(sheet, []).extend(data)
+    return {"updatedCells": sum(len(row) for row in data)}
+
+
+def main():
+    global LATENCY, ROWS
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds each tool call takes")
+    parser.add_argument("--rows", type=int, default=200, help="Rows per stub sheet")
+    args = parser.parse_args()
+
+    LATENCY, ROWS = args.latency, args.rows
+    mcp.settings.host = args.host
+    mcp.settings.port = args.port
+    mcp.run(transport="sse")
+
+
+if __name__ == "__main__":
+    main()
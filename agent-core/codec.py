@@ -0,0 +1,60 @@
+import json
+import os
+from typing import Any, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _fallback(obj: Any) -> str:
+    """Serialize objects the encoders don't know about as strings"""
+    return str(obj)
+
+
+class JsonCodec:
+    """Codec backed by the standard library json module"""
+
+    name = "json"
+
+    def dumps(self, obj: Any) -> str:
+        return json.dumps(obj, default=_fallback, ensure_ascii=False)
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec:
+    """Codec backed by orjson, several times faster on large payloads"""
+
+    name = "orjson"
+
+    def dumps(self, obj: Any) -> str:
+        return orjson.dumps(
+            obj, default=_fallback, option=orjson.OPT_NON_STR_KEYS
+        ).decode()
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+def get_codec(name: Optional[str] = None):
+    """Return a codec by name ("auto", "orjson" or "json").
+
+    "auto" picks orjson when it is installed. orjson.JSONDecodeError
+    subclasses json.JSONDecodeError, so callers can catch the latter for both.
+    """
+    name = (name or os.getenv("WS_JSON_CODEC", "auto")).lower()
+    if name not in ("auto", "orjson", "json"):
+        raise ValueError(f"Unknown JSON codec '{name}' (WS_JSON_CODEC is auto, orjson or json)")
+    if name == "json":
+        return JsonCodec()
+    if name == "orjson" and orjson is None:
+        raise RuntimeError("WS_JSON_CODEC=orjson but orjson is not installed")
+    if orjson is not None:
+        return OrjsonCodec()
+    return JsonCodec()
+
+
+default_codec = get_codec()
@@ -0,0 +1,228 @@
+import json
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from llama_index.core.tools import AsyncBaseTool, FunctionTool, ToolMetadata, ToolOutput
+
+# Payloads rendered longer than this are replaced by a summary and a handle
+COMPACT_THRESHOLD_CHARS = 4000
+SAMPLE_ROWS = 5
+FETCH_TOOL_NAME = "fetch_tool_result"
+# Most rows (or items) one fetch_tool_result call returns
+FETCH_MAX_ITEMS = 50
+
+
+def _maybe_json(text: str) -> Any:
+    try:
+        return json.loads(text)
+    except (TypeError, ValueError):
+        return text
+
+
+def extract_payload(raw_output: Any) -> Any:
+    """Recover the structured result of an MCP tool call.
+
+    MCP returns a CallToolResult whose content is a list of text items, one
+    per JSON-encoded value. Its default str() is a pydantic repr that costs
+    several times more tokens than the data itself.
+    """
+    content = getattr(raw_output, "content", None)
+    if not isinstance(content, list):
+        return raw_output
+    values = [_maybe_json(item.text) for item in content if getattr(item, "text", None) is not None]
+    return values[0] if len(values) == 1 else values
+
+
+def render(payload: Any) -> str:
+    """Render a payload as compact JSON"""
+    if isinstance(payload, str):
+        return payload
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _column_types(rows: List[List[Any]]) -> List[str]:
+    """Guess a type per column from the sampled rows"""
+    width = max((len(row) for row in rows), default=0)
+    types = []
+    for col in range(width):
+        seen = set()
+        for row in rows:
+            if col >= len(row) or row[col] in ("", None):
+                continue
+            value = row[col]
+            if isinstance(value, (int, float)):
+                seen.add("number")
+                continue
+            try:
+                float(str(value).replace(",", ".").replace(" ", ""))
+                seen.add("number")
+            except ValueError:
+                seen.add("text")
+        types.append(seen.pop() if len(seen) == 1 else ("mixed" if seen else "empty"))
+    return types
+
+
+def summarize_table(rows: List[Any]) -> Optional[Dict[str, Any]]:
+    """Describe tabular data by its schema, size and a sample.
+
+    Handles 2D arrays (the first row is taken as the header), lists of
+    records and flat lists of values. Returns None for anything else.
+    """
+    if not rows:
+        return None
+    if all(isinstance(row, list) for row in rows):
+        header, body = rows[0], rows[1:]
+        return {
+            "rows": len(body),
+            "columns": max(len(row) for row in rows),
+            "header": header,
+            "column_types": _column_types(body[:50]),
+            "sample": body[:SAMPLE_ROWS],
+        }
+    if all(isinstance(row, dict) for row in rows):
+        fields: List[str] = []
+        for row in rows:
+            fields.extend(key for key in row if key not in fields)
+        return {"rows": len(rows), "fields": fields, "sample": rows[:SAMPLE_ROWS]}
+    if all(not isinstance(row, (list, dict)) for row in rows):
+        return {"values": len(rows), "sample": rows[:SAMPLE_ROWS * 4]}
+    return None
+
+
+def summarize(payload: Any) -> Optional[Dict[str, Any]]:
+    """Summarize a large payload, or return None if it has no known shape"""
+    if isinstance(payload, list):
+        table = summarize_table(payload)
+        if table is not None:
+            return table
+        # get_multiple_sheet_data: one record per range, each with a 2D 'data'
+        if all(isinstance(item, dict) for item in payload):
+            return {
+                "results": [
+                    {
+                        **{k: v for k, v in item.items() if k != "data"},
+                        **({"data": summarize_table(item["data"])} if isinstance(item.get("data"), list) else {}),
+                    }
+                    for item in payload
+                ]
+            }
+    return None
+
+
+class ToolResultStore:
+    """Keeps full tool payloads that were compacted out of the LLM context.
+
+    Bounded by total rendered size; the least recently used payloads are
+    evicted first.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: "OrderedDict[str, Tuple[str, Any, int]]" = OrderedDict()
+
+    def put(self, tool_name: str, payload: Any, size: int) -> str:
+        handle = f"res_{uuid.uuid4().hex[:12]}"
+        self.entries[handle] = (tool_name, payload, size)
+        self.size += size
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            _, (_, _, evicted) = self.entries.popitem(last=False)
+            self.size -= evicted
+        return handle
+
+    def get(self, handle: str) -> Optional[Any]:
+        entry = self.entries.get(handle)
+        if entry is None:
+            return None
+        self.entries.move_to_end(handle)
+        return entry[1]
+
+
+def compact_output(
+    output: ToolOutput,
+    store: ToolResultStore,
+    threshold: int = COMPACT_THRESHOLD_CHARS,
+) -> ToolOutput:
+    """Re-render a tool output compactly, summarizing it if it is large"""
+    if output.is_error:
+        return output
+    payload = extract_payload(output.raw_output)
+    content = render(payload)
+
+    if len(content) > threshold:
+        summary = summarize(payload)
+        handle = store.put(output.tool_name, payload, len(content))
+        compacted = {
+            "compacted": True,
+            "handle": handle,
+            "total_chars": len(content),
+            "note": f"Large result stored out of context. Call {FETCH_TOOL_NAME} with this handle to read rows.",
+        }
+        if summary is not None:
+            compacted["summary"] = summary
+        else:
+            compacted["head"] = content[:threshold // 2]
+        content = render(compacted)
+
+    return ToolOutput(
+        content=content,
+        tool_name=output.tool_name,
+        raw_input=output.raw_input,
+        raw_output=output.raw_output,
+        is_error=output.is_error,
+    )
+
+
+class CompactingTool(AsyncBaseTool):
+    """Wraps a tool so its output is compacted before the agent sees it"""
+
+    def __init__(self, tool: AsyncBaseTool, store: ToolResultStore, threshold: int = COMPACT_THRESHOLD_CHARS):
+        self.tool = tool
+        self.store = store
+        self.threshold = threshold
+
+    @property
+    def metadata(self) -> ToolMetadata:
+        return self.tool.metadata
+
+    def call(self, *args: Any, **kwargs: Any) -> ToolOutput:
+        return compact_output(self.tool.call(*args, **kwargs), self.store, self.threshold)
+
+    async def acall(self, *args: Any, **kwargs: Any) -> ToolOutput:
+        return compact_output(await self.tool.acall(*args, **kwargs), self.store, self.threshold)
+
+
+def make_fetch_tool(store: ToolResultStore, threshold: int = COMPACT_THRESHOLD_CHARS) -> FunctionTool:
+    """Tool letting the agent page through a compacted result by handle.
+
+    A page holds at most FETCH_MAX_ITEMS rows and renders to at most
+    `threshold` characters, so fetching cannot pull a compacted result
+    back into the context at once.
+    """
+
+    async def fetch_tool_result(handle: str, offset: int = 0, limit: int = FETCH_MAX_ITEMS) -> str:
+        """
+        Read part of a large tool result that was stored out of context.
+
+        Args:
+            handle: The handle returned in a compacted tool result
+            offset: Index of the first row (or item) to return
+            limit: Maximum number of rows (or items) to return, at most 50
+        """
+        payload = store.get(handle)
+        if payload is None:
+            return f"Unknown or expired handle: {handle}"
+        offset = max(offset, 0)
+        limit = max(min(limit, FETCH_MAX_ITEMS), 1)
+        if isinstance(payload, list):
+            items = payload[offset:offset + limit]
+            while True:
+                content = render({"total": len(payload), "offset": offset, "count": len(items), "items": items})
+                if len(content) <= threshold or len(items) <= 1:
+                    return content[:threshold]
+                items = items[:len(items) // 2]
+        text = render(payload)
+        return text[offset:offset + min(limit * 200, threshold)]
+
+    return FunctionTool.from_defaults(async_fn=fetch_tool_result, name=FETCH_TOOL_NAME)
@@ -0,0 +1,59 @@
+import glob
+import logging
+import os
+import re
+import time
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, Iterator, List
+
+from codec import default_codec
+
+
+class EventLog:
+    """Append-only JSON lines log of client events, LLM calls and tool calls.
+
+    One record per line: {"ts": ..., "kind": ..., ...}. The file is rotated
+    once it exceeds `max_bytes`, keeping `backups` old files (path.1 is the
+    most recent). Without a path the log is disabled and `write` is a no-op.
+    """
+
+    def __init__(self, path: str = "", max_bytes: int = 50 * 1024 * 1024, backups: int = 5):
+        self.path = path
+        self.enabled = bool(path)
+        self.handler = None
+        if self.enabled:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8", delay=True)
+
+    def write(self, kind: str, **fields: Any):
+        if not self.enabled:
+            return
+        line = default_codec.dumps({"ts": round(time.time(), 6), "kind": kind, **fields})
+        # RotatingFileHandler takes care of rotation and locking
+        self.handler.emit(logging.makeLogRecord({"msg": line}))
+
+    def close(self):
+        if self.handler is not None:
+            self.handler.close()
+
+
+def log_files(path: str) -> List[str]:
+    """The files of a rotated log, oldest first"""
+    backups = [p for p in glob.glob(f"{glob.escape(path)}.*") if p.rsplit(".", 1)[-1].isdigit()]
+    backups.sort(key=lambda p: int(p.rsplit(".", 1)[-1]), reverse=True)
+    return backups + ([path] if os.path.exists(path) else [])
+
+
+def read_event_log(paths: List[str]) -> Iterator[Dict[str, Any]]:
+    """Read the records of one or more log files, expanding rotated logs"""
+    for path in paths:
+        # A rotated backup (events.jsonl.2) is read on its own
+        files = [path] if re.search(r"\.\d+$", path) else log_files(path)
+        for name in files:
+            with open(name, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        yield default_codec.loads(line)
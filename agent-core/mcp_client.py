@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import uuid
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from typing import Callable, Set
+from urllib.parse import urlparse
+
+import anyio
+import httpx
+from llama_index.tools.mcp import BasicMCPClient
+from mcp import types
+from mcp.client.session import ClientSession
+from mcp.shared.exceptions import McpError
+from mcp.client.sse import sse_client
+from mcp.client.stdio import StdioServerParameters, stdio_client
+from mcp.shared.message import SessionMessage
+
+import scheduler
+from tools import is_write_tool
+
+logger = logging.getLogger(__name__)
+
+# How long a cancelled call may spend telling the server before the session closes
+CANCEL_NOTIFY_TIMEOUT = 2.0
+
+# Argument of the server's write tools that makes a repeated call return the
+# first call's result instead of writing again
+IDEMPOTENCY_KEY = "idempotency_key"
+
+
+def is_transient(error: BaseException) -> bool:
+    """Whether a failed call may succeed when repeated: the server was unreachable or did not answer in time"""
+    if isinstance(error, BaseExceptionGroup):
+        return all(is_transient(e) for e in error.exceptions)
+    if isinstance(error, McpError):
+        return error.error.code == httpx.codes.REQUEST_TIMEOUT
+    return isinstance(error, (httpx.TransportError, OSError))
+
+
+async def notify_cancelled(session: ClientSession, request_id: int, reason: str):
+    """Send notifications/cancelled for a request"""
+    notification = types.ClientNotification(
+        types.CancelledNotification(
+            method="notifications/cancelled",
+            params=types.CancelledNotificationParams(requestId=request_id, reason=reason),
+        )
+    )
+    try:
+        with anyio.fail_after(CANCEL_NOTIFY_TIMEOUT):
+            await session.send_notification(notification)
+    except Exception as e:
+        logger.debug(f"Could not notify the MCP server of cancelled request {request_id}: {str(e)}")
+
+
+class RequestRecorder:
+    """Write stream of a ClientSession that reports the requests sent through it.
+
+    ClientSession numbers its requests itself and does not hand the id
+    out; it is needed to cancel a request.
+    """
+
+    def __init__(self, stream, on_request: Callable[[types.JSONRPCRequest], None]):
+        self.stream = stream
+        self.on_request = on_request
+
+    async def send(self, message: SessionMessage):
+        if isinstance(message.message.root, types.JSONRPCRequest):
+            self.on_request(message.message.root)
+        await self.stream.send(message)
+
+    async def __aenter__(self):
+        await self.stream.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return await self.stream.__aexit__(*exc_info)
+
+
+class CancellableMCPClient(BasicMCPClient):
+    """BasicMCPClient that tells the server when a tool call is abandoned.
+
+    BasicMCPClient just drops the SSE session of a cancelled call, and the
+    server keeps running the tool to completion. Here the session runs in a
+    task of its own, so when the caller is cancelled it can still send
+    `notifications/cancelled` for the in-flight request; the server then
+    cancels the tool and frees its worker. Calls wait for a slot of the
+    shared fair-share scheduler first.
+
+    Calls that fail because the server could not be reached or did not
+    answer in time are repeated up to `retries` times. Each call of a tool
+    taking an `idempotency_key` gets a key of its own, sent again with its
+    repeats, so a write that went through the first time is not applied
+    twice; other writes are not repeated.
+    """
+
+    def __init__(self, *args, retries: int = 2, retry_interval: float = 0.5, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.retries = retries
+        self.retry_interval = retry_interval
+        # Tools taking an idempotency key, learnt from the tool list
+        self.keyed_tools: Set[str] = set()
+
+    async def list_tools(self):
+        result = await super().list_tools()
+        self.keyed_tools = {
+            tool.name for tool in result.tools
+            if IDEMPOTENCY_KEY in (tool.inputSchema or {}).get("properties", {})
+        }
+        return result
+
+    async def call_tool(self, tool_name: str, arguments: dict):
+        if tool_name in self.keyed_tools:
+            # Whatever the LLM filled in, one key per call of the agent
+            arguments = {**arguments, IDEMPOTENCY_KEY: uuid.uuid4().hex}
+        repeatable = not is_write_tool(tool_name) or tool_name in self.keyed_tools
+        attempt = 0
+        while True:
+            try:
+                async with scheduler.tool_calls.slot():
+                    return await self._call_tool(tool_name, arguments)
+            except Exception as e:
+                if not repeatable or attempt >= self.retries or not is_transient(e):
+                    raise
+                attempt += 1
+                logger.warning(f"MCP call {tool_name} failed ({e!r}), retrying ({attempt}/{self.retries})")
+                await asyncio.sleep(self.retry_interval * 2 ** (attempt - 1))
+
+    async def _call_tool(self, tool_name: str, arguments: dict):
+        abandoned = asyncio.Event()
+        call = asyncio.create_task(self._call_tool_in_session(tool_name, arguments, abandoned))
+        try:
+            return await asyncio.shield(call)
+        except asyncio.CancelledError:
+            abandoned.set()
+            await asyncio.wait([call], timeout=CANCEL_NOTIFY_TIMEOUT)
+            if not call.done():
+                call.cancel()
+            raise
+
+    @asynccontextmanager
+    async def _recording_session(self, on_request: Callable[[types.JSONRPCRequest], None]):
+        """A session like BasicMCPClient's, reporting every request it sends"""
+        if urlparse(self.command_or_url).scheme in ("http", "https"):
+            client = sse_client(self.command_or_url)
+        else:
+            client = stdio_client(StdioServerParameters(command=self.command_or_url, args=self.args, env=self.env))
+        async with client as (read_stream, write_stream):
+            async with ClientSession(
+                read_stream,
+                RequestRecorder(write_stream, on_request),
+                read_timeout_seconds=timedelta(seconds=self.timeout)
+            ) as session:
+                await session.initialize()
+                yield session
+
+    async def _call_tool_in_session(self, tool_name: str, arguments: dict, abandoned: asyncio.Event):
+        sent = {}
+
+        def on_request(request: types.JSONRPCRequest):
+            if request.method == "tools/call":
+                sent["id"] = request.id
+
+        async with self._recording_session(on_request) as session:
+            if abandoned.is_set():
+                # Cancelled while the session was opening: a notification sent
+                # right behind the request may reach the server first
+                return None
+            request = asyncio.create_task(session.call_tool(tool_name, arguments))
+            waiter = asyncio.create_task(abandoned.wait())
+            await asyncio.wait([request, waiter], return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            if request.done():
+                return request.result()
+
+            if "id" not in sent:
+                # Abandoned before the request went out
+                request.cancel()
+                return None
+            await notify_cancelled(session, sent["id"], f"{tool_name} cancelled by the agent")
+            # The server answers a cancelled request with an error; waiting for
+            # it also keeps the session open until the notification is posted
+            await asyncio.wait([request], timeout=CANCEL_NOTIFY_TIMEOUT)
+            if not request.done():
+                request.cancel()
+            elif not request.cancelled():
+                request.exception()
+            return None
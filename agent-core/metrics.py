@@ -0,0 +1,169 @@
+import bisect
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from a fast tool call to a long agent run
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Monotonic count, one series per label values"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1.0):
+        self.values[label_values] = self.values.get(label_values, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in self.values.items()]
+
+
+class Gauge(Metric):
+    """Current value, either set directly or read from `fn` at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.fn = fn
+
+    def set(self, value: float, *label_values: str):
+        self.values[label_values] = value
+
+    def samples(self) -> List[str]:
+        if self.fn is not None:
+            return [f"{self.name} {_number(self.fn())}"]
+        return [f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in self.values.items()]
+
+
+class Histogram(Metric):
+    """Distribution of observed values over fixed buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self.series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *label_values: str):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [0.0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for label_values, series in self.series.items():
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, label_values, le)} {_number(cumulative)}")
+            labels = _labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {_number(cumulative)}")
+        return lines
+
+
+class Registry:
+    """Holds metrics and renders them in the Prometheus text format"""
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = (), fn: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labels, fn))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Protocol
+events_received = registry.counter("agent_ws_events_received_total", "Client events received, by type", ["event"])
+events_sent = registry.counter("agent_ws_events_sent_total", "Events sent to clients, by type", ["event"])
+frames_sent = registry.counter("agent_ws_frames_sent_total", "WebSocket frames sent to clients")
+deflate_input_bytes = registry.counter("agent_ws_deflate_input_bytes_total", "Bytes of messages compressed with permessage-deflate")
+deflate_saved_bytes = registry.counter("agent_ws_deflate_saved_bytes_total", "Bytes saved by permessage-deflate")
+deflate_skipped = registry.counter("agent_ws_deflate_skipped_total", "Messages sent uncompressed for being below the threshold")
+
+# Slow consumers
+send_stalls = registry.counter("agent_ws_send_stalls_total", "Sends that waited for a client to read")
+send_stall_duration = registry.histogram("agent_ws_send_stall_seconds", "Time stalled sends waited for the client")
+events_shed = registry.counter(
+    "agent_ws_events_shed_total", "Progress events dropped or summarized for slow clients", ["event", "action"]
+)
+slow_consumer_disconnects = registry.counter(
+    "agent_ws_slow_consumer_disconnects_total", "Connections closed because the client stopped reading"
+)
+
+# Agent runs
+runs = registry.counter("agent_runs_total", "Agent requests finished, by status", ["status"])
+run_duration = registry.histogram("agent_run_duration_seconds", "Duration of agent requests, by status", ["status"])
+tool_duration = registry.histogram("agent_tool_call_duration_seconds", "Tool call latency, by tool", ["tool"])
+tool_errors = registry.counter("agent_tool_errors_total", "Tool calls that returned an error, by tool", ["tool"])
+llm_duration = registry.histogram("agent_llm_call_duration_seconds", "LLM call latency, by route", ["route"])
+llm_tokens = registry.counter("agent_llm_tokens_total", "LLM tokens, by route and kind (prompt, completion, cached)", ["route", "kind"])
+scheduler_wait = registry.histogram(
+    "agent_scheduler_wait_seconds", "Time calls queued for a fair-share slot, by resource (llm, mcp)", ["resource"]
+)
+
+# Voice messages
+audio_bytes_received = registry.counter("agent_ws_audio_bytes_received_total", "Bytes of audio received in binary frames")
+asr_finalize_duration = registry.histogram(
+    "agent_asr_finalize_seconds", "Time from the end of a voice message to its final transcript"
+)
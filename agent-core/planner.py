@@ -0,0 +1,292 @@
+import asyncio
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from llama_index.core.tools import AsyncBaseTool, ToolOutput, ToolSelection
+
+from agent import plan_tool_dependencies
+from compaction import extract_payload, render
+from tools import touched_spreadsheets, without_spreadsheets
+
+# Marks the planning request in the system prompt (the stub LLM looks for it)
+PLAN_REQUEST_TAG = "<tool_plan_request>"
+
+PLAN_INSTRUCTIONS = f"""\
+{PLAN_REQUEST_TAG}
+Plan the tool calls that answer the user's last message before any of them
+runs. Reply with one JSON object and nothing else:
+
+{{"steps": [{{"id": "s1", "tool": "<tool name>", "args": {{...}}}}, ...]}}
+
+- Steps run in parallel unless one uses the result of another or both touch
+  the same spreadsheet; then they run in the order given.
+- An argument may be the result of an earlier step: "$s1" is the whole result,
+  "$s1.key" or "$s1.0" a field or item of it, e.g. copy a range read by s1
+  with {{"tool": "update_cells", "args": {{..., "data": "$s1"}}}}.
+- Prefer one batch tool call (batch_update_cells, batch_structure,
+  get_multiple_sheet_data) over many single ones.
+- If no tool is needed, reply {{"steps": [], "answer": "<your answer>"}}.
+- If what to do depends on data you have not seen yet, reply {{"steps": null}}.
+
+Tools (name, parameters as JSON schema, description):
+"""
+
+SUMMARY_INSTRUCTIONS = """\
+The tool calls planned for the user's last message have run. Their results
+follow. Answer the user based on them; do not plan or call tools again.
+"""
+
+STEP_ID_RE = re.compile(r"^[A-Za-z][A-Za-z0-9_]*$")
+REFERENCE_RE = re.compile(r"^\$([A-Za-z][A-Za-z0-9_]*)((?:\.[^.]+)*)$")
+
+
+class PlanError(ValueError):
+    """The LLM's reply is not a valid plan"""
+
+
+class PlanDeclined(Exception):
+    """The LLM asked to work step by step instead"""
+
+
+@dataclass
+class PlanStep:
+    id: str
+    tool: str
+    args: Dict[str, Any]
+    # Steps whose results the arguments use
+    references: List[str] = field(default_factory=list)
+
+
+@dataclass
+class Plan:
+    steps: List[PlanStep]
+    answer: Optional[str] = None
+
+
+@dataclass
+class StepResult:
+    step: PlanStep
+    kwargs: Dict[str, Any]
+    output: ToolOutput
+    seconds: float
+
+
+def describe_tools(tools: Sequence[AsyncBaseTool]) -> str:
+    """One line per tool for the planning prompt, in the tools' (canonical) order"""
+    lines = []
+    for tool in tools:
+        parameters = render(tool.metadata.get_parameters_dict())
+        description = " ".join(tool.metadata.description.split())
+        lines.append(f"- {tool.metadata.name} {parameters}: {description}")
+    return "\n".join(lines)
+
+
+def _json_object(text: str) -> Any:
+    """The JSON object of a reply, allowing a code fence or text around it"""
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        raise PlanError("Reply contains no JSON object")
+    try:
+        return json.loads(text[start:end + 1])
+    except ValueError as e:
+        raise PlanError(f"Reply is not valid JSON: {e}")
+
+
+def _references(value: Any) -> List[str]:
+    if isinstance(value, str):
+        match = REFERENCE_RE.match(value)
+        return [match.group(1)] if match else []
+    if isinstance(value, dict):
+        return [ref for item in value.values() for ref in _references(item)]
+    if isinstance(value, list):
+        return [ref for item in value for ref in _references(item)]
+    return []
+
+
+def _dependency_kwargs(step: PlanStep) -> Dict[str, Any]:
+    """Arguments of a step as far as known before it runs.
+
+    A spreadsheet given as a result reference ("$s1.0.id") is only known
+    once the referenced step is done, so the step's spreadsheets count as
+    unknown and the step serializes against every other call.
+    """
+    if any(REFERENCE_RE.match(value) for value in touched_spreadsheets(step.tool, step.args)):
+        return without_spreadsheets(step.args)
+    return step.args
+
+
+def parse_plan(text: str, tools: Sequence[AsyncBaseTool], max_steps: int) -> Plan:
+    """Parse and validate the LLM's plan against the available tools"""
+    data = _json_object(text)
+    if not isinstance(data, dict) or "steps" not in data:
+        raise PlanError("Reply has no 'steps'")
+    if data["steps"] is None:
+        raise PlanDeclined()
+    if not isinstance(data["steps"], list):
+        raise PlanError("'steps' is not a list")
+    if not data["steps"]:
+        answer = data.get("answer")
+        if not isinstance(answer, str) or not answer.strip():
+            raise PlanError("Plan has neither steps nor an answer")
+        return Plan(steps=[], answer=answer)
+    if len(data["steps"]) > max_steps:
+        raise PlanError(f"Plan has {len(data['steps'])} steps, at most {max_steps} are allowed")
+
+    tools_by_name = {tool.metadata.name: tool for tool in tools}
+    steps: List[PlanStep] = []
+    seen = set()
+    for i, raw in enumerate(data["steps"]):
+        if not isinstance(raw, dict):
+            raise PlanError(f"Step {i + 1} is not an object")
+        step_id = str(raw.get("id") or f"s{i + 1}")
+        if not STEP_ID_RE.match(step_id) or step_id in seen:
+            raise PlanError(f"Step {i + 1} has an invalid or duplicate id '{step_id}'")
+        tool = tools_by_name.get(raw.get("tool"))
+        if tool is None:
+            raise PlanError(f"Step {step_id} uses unknown tool '{raw.get('tool')}'")
+        args = raw.get("args") or {}
+        if not isinstance(args, dict):
+            raise PlanError(f"Step {step_id} args are not an object")
+
+        schema = tool.metadata.get_parameters_dict()
+        properties = schema.get("properties") or {}
+        missing = [name for name in schema.get("required", []) if name not in args]
+        unknown = [name for name in args if properties and name not in properties]
+        if missing or unknown:
+            raise PlanError(f"Step {step_id} ({tool.metadata.name}): missing {missing}, unknown {unknown}")
+
+        references = list(dict.fromkeys(_references(args)))
+        undefined = [ref for ref in references if ref not in seen]
+        if undefined:
+            raise PlanError(f"Step {step_id} uses results of {undefined}, which are not earlier steps")
+        steps.append(PlanStep(id=step_id, tool=tool.metadata.name, args=args, references=references))
+        seen.add(step_id)
+    return Plan(steps=steps)
+
+
+def _lookup(payload: Any, path: str, reference: str) -> Any:
+    for key in filter(None, path.split(".")):
+        if isinstance(payload, list) and key.lstrip("-").isdigit():
+            try:
+                payload = payload[int(key)]
+                continue
+            except IndexError:
+                pass
+        elif isinstance(payload, dict) and key in payload:
+            payload = payload[key]
+            continue
+        raise PlanError(f"{reference} does not exist in the step's result")
+    return payload
+
+
+def resolve(value: Any, payloads: Dict[str, Any]) -> Any:
+    """Replace result references in step arguments with the results"""
+    if isinstance(value, str):
+        match = REFERENCE_RE.match(value)
+        if match is None or match.group(1) not in payloads:
+            return value
+        return _lookup(payloads[match.group(1)], match.group(2), value)
+    if isinstance(value, dict):
+        return {key: resolve(item, payloads) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve(item, payloads) for item in value]
+    return value
+
+
+class StepFailed(Exception):
+    """A step of a plan failed; `results` are those of the steps that succeeded"""
+
+    def __init__(self, step: PlanStep, message: str):
+        super().__init__(f"Step {step.id} ({step.tool}) failed: {message}")
+        self.step = step
+        self.results: List[StepResult] = []
+
+
+async def execute_plan(
+    plan: Plan,
+    tools: Sequence[AsyncBaseTool],
+    workers: int,
+    on_result: Callable[[StepResult], Awaitable[None]],
+) -> List[StepResult]:
+    """Run the steps of a plan, each once its dependencies are done.
+
+    Independent steps run concurrently, up to `workers` at a time; steps
+    touching the same spreadsheet keep their order as in a parallel turn of
+    the agent (agent.plan_tool_dependencies). `on_result` gets the results
+    in plan order. On the first failed step no further steps start and
+    StepFailed carries the results of the steps that succeeded.
+    """
+    tools_by_name = {tool.metadata.name: tool for tool in tools}
+    dependencies = plan_tool_dependencies([
+        ToolSelection(tool_id=step.id, tool_name=step.tool, tool_kwargs=_dependency_kwargs(step))
+        for step in plan.steps
+    ])
+    finished = {step.id: asyncio.Event() for step in plan.steps}
+    payloads: Dict[str, Any] = {}
+    results: Dict[str, StepResult] = {}
+    failures: List[StepFailed] = []
+    slots = asyncio.Semaphore(max(workers, 1))
+    loop = asyncio.get_running_loop()
+
+    async def run_step(step: PlanStep):
+        try:
+            for step_id in set(dependencies[step.id]) | set(step.references):
+                await finished[step_id].wait()
+            if failures:
+                return
+            async with slots:
+                started = loop.time()
+                kwargs = resolve(step.args, payloads)
+                try:
+                    output = await tools_by_name[step.tool].acall(**kwargs)
+                except Exception as e:
+                    output = ToolOutput(content=str(e), tool_name=step.tool, raw_input=kwargs, raw_output=None, is_error=True)
+            results[step.id] = StepResult(step, kwargs, output, loop.time() - started)
+            if output.is_error:
+                failures.append(StepFailed(step, output.content))
+            else:
+                payloads[step.id] = extract_payload(output.raw_output)
+        except PlanError as e:
+            failures.append(StepFailed(step, str(e)))
+        finally:
+            finished[step.id].set()
+
+    tasks = [asyncio.create_task(run_step(step)) for step in plan.steps]
+    try:
+        # Release results in plan order as the prefix completes
+        for step, task in zip(plan.steps, tasks):
+            await task
+            if step.id in results:
+                await on_result(results[step.id])
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    ok = [results[step.id] for step in plan.steps if step.id in payloads]
+    if failures:
+        failure = failures[0]
+        failure.results = ok
+        raise failure
+    return ok
+
+
+def summary_prompt(results: List[StepResult]) -> str:
+    """The tool results of a plan, as the LLM sees them in the summary call"""
+    lines = [SUMMARY_INSTRUCTIONS]
+    for result in results:
+        lines.append(f"[{result.step.id}] {result.step.tool} {render(result.kwargs)}\n{result.output.content}")
+    return "\n\n".join(lines)
+
+
+def partial_progress(failure: StepFailed) -> str:
+    """Note on what a failed plan already did, for the step-wise run that takes over"""
+    lines = [
+        "An attempt to answer the next message with a planned batch of tool calls stopped at a failed step. "
+        "These calls already ran and need not be repeated:"
+    ]
+    for result in failure.results:
+        lines.append(f"- {result.step.tool} {render(result.kwargs)} -> {result.output.content}")
+    lines.append(f"Failed: {failure}")
+    return "\n".join(lines)
@@ -0,0 +1,47 @@
+import hashlib
+import json
+from typing import Any, Dict, List
+
+
+def canonical_tools(tools: List[Any]) -> List[Any]:
+    """Order tools by name so every session sends the same tool list.
+
+    MCP servers may list tools in any order. Provider-side prompt caching
+    only matches an identical prefix, and the tool schemas are part of it.
+    """
+    return sorted(tools, key=lambda tool: tool.metadata.name)
+
+
+def prefix_fingerprint(system_prompt: str, tools: List[Any]) -> str:
+    """Hash the system prompt and tool schemas exactly as they are sent"""
+    specs = [tool.metadata.to_openai_tool(skip_length_check=True) for tool in tools]
+    payload = json.dumps({"system": system_prompt, "tools": specs}, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class PrefixCacheStats:
+    """Share of prompt tokens the provider served from its prompt cache"""
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def record(self, prompt_tokens: int, cached_tokens: int):
+        if not prompt_tokens:
+            return
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.cached_tokens += cached_tokens
+
+    @property
+    def ratio(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "llm_calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cached_ratio": round(self.ratio, 4),
+        }
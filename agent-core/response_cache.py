@@ -0,0 +1,221 @@
+import hashlib
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Optional, Set
+
+import numpy as np
+
+
+def normalize_message(text: str) -> str:
+    """Lowercase, strip punctuation and collapse whitespace"""
+    text = unicodedata.normalize("NFKC", text).lower().replace("ё", "е")
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def conversation_key(messages: Iterable[Any]) -> str:
+    """Key of the turns a message follows up on, "" for the first turn.
+
+    System messages (the workspace index, compaction notes) are left out, so
+    the first question of every session shares the empty key.
+    """
+    turns = [
+        (str(getattr(m.role, "value", m.role)), str(m.content or ""))
+        for m in messages
+        if getattr(m.role, "value", m.role) != "system"
+    ]
+    if not turns:
+        return ""
+    digest = hashlib.blake2b(repr(turns).encode(), digest_size=16)
+    return digest.hexdigest()
+
+
+class HashingEmbedder:
+    """Local embedding of character trigrams hashed into a fixed-size vector.
+
+    Needs no model or network and is good at matching rephrasings that share
+    most of their wording ("сколько строк в таблице продаж?" vs "Сколько
+    строк в таблице продаж"). Any callable returning a 1-D vector, e.g. a
+    llama-index embedding model's `get_text_embedding`, can be used instead.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def __call__(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in text.split():
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                digest = hashlib.blake2b(padded[i:i + 3].encode(), digest_size=4).digest()
+                vector[int.from_bytes(digest, "little") % self.dim] += 1.0
+        return vector
+
+
+class LSHIndex:
+    """Approximate nearest-neighbour index using random hyperplane hashing.
+
+    Each vector is bucketed by the signs of its projections on `n_planes`
+    random hyperplanes. Lookups probe the query's bucket and all buckets one
+    bit away, so near-duplicates are found without scanning every entry.
+    """
+
+    def __init__(self, dim: int, n_planes: int = 12, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((n_planes, dim)).astype(np.float32)
+        self.weights = 1 << np.arange(n_planes, dtype=np.int64)
+        self.buckets: Dict[int, Set[str]] = {}
+        self.keys: Dict[str, int] = {}
+
+    def _hash(self, vector: np.ndarray) -> int:
+        bits = (self.planes @ vector) > 0
+        return int(bits.astype(np.int64) @ self.weights)
+
+    def add(self, key: str, vector: np.ndarray):
+        bucket = self._hash(vector)
+        self.keys[key] = bucket
+        self.buckets.setdefault(bucket, set()).add(key)
+
+    def remove(self, key: str):
+        bucket = self.keys.pop(key, None)
+        if bucket is not None:
+            self.buckets[bucket].discard(key)
+            if not self.buckets[bucket]:
+                del self.buckets[bucket]
+
+    def candidates(self, vector: np.ndarray) -> Iterable[str]:
+        bucket = self._hash(vector)
+        for probe in [bucket] + [bucket ^ (1 << i) for i in range(len(self.planes))]:
+            yield from self.buckets.get(probe, ())
+
+
+@dataclass
+class CacheEntry:
+    message: str
+    vector: np.ndarray
+    response: str
+    # Version of every spreadsheet the answering run touched
+    versions: Dict[str, int] = field(default_factory=dict)
+    created_at: float = field(default_factory=time.monotonic)
+    # conversation_key() of the turns the message followed
+    context: str = ""
+
+
+class ResponseCache:
+    """LRU cache of agent responses with similarity lookup.
+
+    An entry is only served while every spreadsheet its run touched is still
+    at the version recorded when it was stored. Write tool calls bump the
+    version of the spreadsheets they target, which invalidates dependent
+    entries; entries also expire after `ttl` seconds to cover edits made
+    outside the agent. Follow-up questions ("and in the second sheet?")
+    depend on the turns before them: entries are only matched within the
+    same conversation context, so only first-turn questions are shared
+    across sessions.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl: float = 300.0,
+        threshold: float = 0.92,
+        embed_fn: Optional[Callable[[str], np.ndarray]] = None,
+        dim: int = 512,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.embed_fn = embed_fn or HashingEmbedder(dim)
+        self.entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.index: Optional[LSHIndex] = None
+        self.versions: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _embed(self, message: str) -> np.ndarray:
+        vector = np.asarray(self.embed_fn(message), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _is_fresh(self, entry: CacheEntry) -> bool:
+        if time.monotonic() - entry.created_at > self.ttl:
+            return False
+        return all(
+            self.versions.get(spreadsheet_id, 0) == version
+            for spreadsheet_id, version in entry.versions.items()
+        )
+
+    def _evict(self, key: str):
+        self.entries.pop(key, None)
+        if self.index is not None:
+            self.index.remove(key)
+
+    @staticmethod
+    def _key(normalized: str, context: str) -> str:
+        return f"{context}\x00{normalized}" if context else normalized
+
+    def lookup(self, message: str, context: str = "") -> Optional[str]:
+        """Return a cached response for a message or a near-identical one in the same context"""
+        normalized = normalize_message(message)
+        if not normalized:
+            return None
+
+        key = self._key(normalized, context)
+        if key not in self.entries and self.index is not None:
+            vector = self._embed(normalized)
+            best_score = self.threshold
+            key = None
+            for candidate in set(self.index.candidates(vector)):
+                if self.entries[candidate].context != context:
+                    continue
+                score = float(self.entries[candidate].vector @ vector)
+                if score >= best_score:
+                    best_score, key = score, candidate
+
+        entry = self.entries.get(key) if key else None
+        if entry is None:
+            self.misses += 1
+            return None
+        if not self._is_fresh(entry):
+            self._evict(key)
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry.response
+
+    def store(self, message: str, response: str, spreadsheet_ids: Iterable[str], context: str = ""):
+        """Cache the response of a read-only agent run"""
+        normalized = normalize_message(message)
+        if not normalized or not response:
+            return
+
+        vector = self._embed(normalized)
+        if self.index is None:
+            self.index = LSHIndex(len(vector))
+        key = self._key(normalized, context)
+        self._evict(key)
+        self.entries[key] = CacheEntry(
+            message=normalized,
+            vector=vector,
+            response=response,
+            versions={sid: self.versions.get(sid, 0) for sid in spreadsheet_ids},
+            context=context,
+        )
+        self.index.add(key, vector)
+
+        while len(self.entries) > self.max_entries:
+            oldest = next(iter(self.entries))
+            self._evict(oldest)
+
+    def invalidate(self, spreadsheet_ids: Iterable[str]):
+        """Mark spreadsheets as changed; dependent entries become stale"""
+        for spreadsheet_id in spreadsheet_ids:
+            self.versions[spreadsheet_id] = self.versions.get(spreadsheet_id, 0) + 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
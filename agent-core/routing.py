@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+import re
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Words that signal a request edits spreadsheets or chains several steps
+_COMPLEX_PATTERNS = [
+    r"\b(созда\w*|обнов\w*|измен\w*|скопир\w*|перенес\w*|добав\w*|удал\w*|переимен\w*|заполн\w*|подели\w*|сравн\w*|посчита\w*|сведи|свод\w*)",
+    r"\b(create|update|change|copy|move|add|insert|delete|remove|rename|fill|share|compare|calculate|summari[sz]e|merge)\b",
+    r"\b(затем|потом|после этого|а также|then|after that|and also)\b",
+]
+_COMPLEX_RE = re.compile("|".join(_COMPLEX_PATTERNS), re.IGNORECASE)
+
+
+def classify_request(message: str, max_simple_words: int = 25) -> str:
+    """Classify a request as "simple" (a lookup) or "complex" (edits, multi-step).
+
+    A cheap local heuristic: long messages, edit verbs and sequencing words
+    mark a request as complex.
+    """
+    if len(message.split()) > max_simple_words or _COMPLEX_RE.search(message):
+        return "complex"
+    return "simple"
+
+
+@dataclass
+class Route:
+    """A configured LLM backend, ordered from cheapest to strongest"""
+    name: str
+    llm: Any
+    # USD per million tokens, for cost logging
+    input_cost: float = 0.0
+    output_cost: float = 0.0
+    runs: int = 0
+    failures: int = 0
+    escalations: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+    latencies: deque = field(default_factory=lambda: deque(maxlen=1024))
+
+    def run_cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        return (prompt_tokens * self.input_cost + completion_tokens * self.output_cost) / 1_000_000
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3)
+
+        return {
+            "runs": self.runs,
+            "failures": self.failures,
+            "escalations": self.escalations,
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost_usd": round(self.cost, 6),
+        }
+
+
+class ModelRouter:
+    """Picks an LLM backend per request and escalates to stronger ones.
+
+    Simple requests go to the first (cheapest) route, complex ones to the
+    last. A run escalates one route up when it needs more than
+    `escalate_after_tool_steps` tool calls, or retries there when it fails.
+    """
+
+    def __init__(self, routes: List[Route], escalate_after_tool_steps: int = 4):
+        if not routes:
+            raise ValueError("At least one LLM route must be configured")
+        self.routes = routes
+        self.escalate_after_tool_steps = escalate_after_tool_steps
+
+    @property
+    def default(self) -> Route:
+        return self.routes[0]
+
+    def route_for(self, message: str) -> Route:
+        if classify_request(message) == "complex":
+            return self.routes[-1]
+        return self.routes[0]
+
+    def escalation_for(self, route: Route) -> Optional[Route]:
+        index = self.routes.index(route)
+        return self.routes[index + 1] if index + 1 < len(self.routes) else None
+
+    def record(self, route: Route, seconds: float, prompt_tokens: int, completion_tokens: int, ok: bool):
+        """Account a finished run on a route and log its latency and cost"""
+        cost = route.run_cost(prompt_tokens, completion_tokens)
+        route.runs += 1
+        route.failures += 0 if ok else 1
+        route.prompt_tokens += prompt_tokens
+        route.completion_tokens += completion_tokens
+        route.cost += cost
+        route.latencies.append(seconds)
+        logger.info(
+            f"Route '{route.name}' run {'ok' if ok else 'failed'} in {seconds:.2f}s, "
+            f"{prompt_tokens}+{completion_tokens} tokens, ${cost:.5f}"
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {route.name: route.stats() for route in self.routes}
+
+
+def create_llm(config: Dict[str, Any], api_key: Optional[str] = None):
+    """Create the LLM of a route from its config"""
+    provider = config.get("provider", "openai")
+    options = config.get("options", {})
+    if provider == "openai":
+        from llama_index.llms.openai import OpenAI
+
+        return OpenAI(
+            model=config["model"],
+            api_key=api_key,
+            # Report token usage on the last streamed chunk
+            additional_kwargs={"stream_options": {"include_usage": True}},
+            **options,
+        )
+    if provider == "stub":
+        from stub_llm import StubLLM
+
+        return StubLLM(model=config.get("model", "stub"), **options)
+    raise ValueError(f"Unknown LLM provider: {provider}")
+
+
+def build_router(api_key: Optional[str] = None) -> ModelRouter:
+    """Build the router from LLM_ROUTES, a JSON list ordered cheap to strong.
+
+    Example:
+        [{"name": "fast", "model": "gpt-4o-mini", "input_cost": 0.15, "output_cost": 0.6},
+         {"name": "strong", "model": "gpt-4o", "input_cost": 2.5, "output_cost": 10}]
+
+    Each route may set "provider" ("openai" or "stub") and "options" passed
+    to the LLM constructor.
+    """
+    configs = json.loads(os.getenv("LLM_ROUTES") or "[]") or [
+        {"name": "default", "model": "gpt-4o-mini", "input_cost": 0.15, "output_cost": 0.6}
+    ]
+    routes = [
+        Route(
+            name=config.get("name", config.get("model", f"route{i}")),
+            llm=create_llm(config, api_key),
+            input_cost=float(config.get("input_cost", 0.0)),
+            output_cost=float(config.get("output_cost", 0.0)),
+        )
+        for i, config in enumerate(configs)
+    ]
+    return ModelRouter(routes, int(os.getenv("ROUTER_ESCALATE_TOOL_STEPS", "4")))
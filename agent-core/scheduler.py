@@ -0,0 +1,145 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Optional, Tuple
+
+import metrics
+
+# (user key, weight) of the agent run the current task works for. Set per
+# request task and inherited by the workflow and tool tasks it starts.
+current_user: ContextVar[Optional[Tuple[str, float]]] = ContextVar("current_user", default=None)
+
+# Calls made outside of an agent run, e.g. the workspace prefetch
+SERVER_USER = ("_server", 1.0)
+
+
+class FairScheduler:
+    """Weighted fair queueing of calls to a shared resource (LLM, MCP server).
+
+    At most `capacity` calls hold a slot at a time. When calls have to wait,
+    the next slot goes to the waiting user with the least service received so
+    far, counted in seconds of slot time divided by the user's weight. A call
+    is charged an estimate of its duration when it starts and corrected with
+    the real one when it ends, so a user with several calls running is
+    already behind. Users returning after a pause start at the current
+    virtual time instead of cashing in the time they were away, so a light
+    user gets the next free slot ahead of a user with a long backlog, but
+    cannot lock others out either. A capacity of 0 means no limit.
+    """
+
+    def __init__(self, name: str, capacity: int = 0):
+        self.name = name
+        self.capacity = capacity
+        self.active = 0
+        # Service received by each user, in weighted seconds
+        self.passes: Dict[str, float] = {}
+        self.running: Dict[str, int] = {}
+        self.waiting: Dict[str, Deque[Tuple[asyncio.Future, float]]] = {}
+        self.virtual_time = 0.0
+        # Moving average of slot time, the charge of a call when it starts
+        self.estimate = 1.0
+        self.granted = 0
+        self.queued = 0
+
+    @property
+    def waiting_count(self) -> int:
+        return sum(len(q) for q in self.waiting.values())
+
+    @asynccontextmanager
+    async def slot(self, user: Optional[Tuple[str, float]] = None):
+        """Hold a slot for the duration of the block, on behalf of `user` or the current one"""
+        key, weight = user or current_user.get() or SERVER_USER
+        weight = max(weight, 1e-3)
+        charged = await self._acquire(key, weight)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(key, weight, charged, time.monotonic() - started)
+
+    async def _acquire(self, key: str, weight: float) -> float:
+        if key not in self.running and key not in self.waiting:
+            self.passes[key] = max(self.passes.get(key, 0.0), self.virtual_time)
+        if self.capacity <= 0 or (self.active < self.capacity and not self.waiting):
+            return self._grant(key, weight)
+
+        self.queued += 1
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiting.setdefault(key, deque()).append((waiter, weight))
+        started = time.monotonic()
+        try:
+            charged = await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as the caller was cancelled: give the slot back
+                self._release(key, weight, waiter.result(), 0.0)
+            else:
+                self._forget(key, waiter)
+            raise
+        metrics.scheduler_wait.observe(time.monotonic() - started, self.name)
+        return charged
+
+    def _grant(self, key: str, weight: float) -> float:
+        self.virtual_time = max(self.virtual_time, self.passes[key])
+        charged = self.estimate / weight
+        self.passes[key] += charged
+        self.running[key] = self.running.get(key, 0) + 1
+        self.active += 1
+        self.granted += 1
+        return charged
+
+    def _release(self, key: str, weight: float, charged: float, seconds: float):
+        self.active -= 1
+        self.running[key] -= 1
+        if not self.running[key]:
+            del self.running[key]
+        self.passes[key] += seconds / weight - charged
+        if seconds > 0:
+            self.estimate += (seconds - self.estimate) * 0.1
+        self._dispatch()
+        self._prune()
+
+    def _forget(self, key: str, waiter: asyncio.Future):
+        queue = self.waiting.get(key)
+        if queue is None:
+            return
+        for entry in queue:
+            if entry[0] is waiter:
+                queue.remove(entry)
+                break
+        if not queue:
+            del self.waiting[key]
+
+    def _dispatch(self):
+        while self.waiting and (self.capacity <= 0 or self.active < self.capacity):
+            key = min(self.waiting, key=lambda k: self.passes[k])
+            queue = self.waiting[key]
+            waiter, weight = queue.popleft()
+            if not queue:
+                del self.waiting[key]
+            if waiter.done():
+                continue
+            waiter.set_result(self._grant(key, weight))
+
+    def _prune(self):
+        # Idle users at or below the virtual time would restart from it anyway
+        for key in [k for k, p in self.passes.items() if p <= self.virtual_time]:
+            if key not in self.running and key not in self.waiting:
+                del self.passes[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "active": self.active,
+            "waiting": self.waiting_count,
+            "granted": self.granted,
+            "queued": self.queued,
+            "users": len(self.passes),
+        }
+
+
+# Shared by every session; websocket_server sets the capacities
+llm_calls = FairScheduler("llm")
+tool_calls = FairScheduler("mcp")
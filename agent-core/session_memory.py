@@ -0,0 +1,66 @@
+import json
+from typing import List
+
+from llama_index.core.llms import ChatMessage
+from llama_index.core.memory import BaseMemory, ChatMemoryBuffer
+
+
+def create_memory(token_limit: int) -> ChatMemoryBuffer:
+    """Create the chat history buffer of a session.
+
+    `token_limit` bounds what is sent to the LLM on each step; the stored
+    history itself is bounded separately by `trim_history`.
+    """
+    return ChatMemoryBuffer.from_defaults(token_limit=token_limit)
+
+
+def window_messages(messages: List[ChatMessage], max_messages: int) -> List[ChatMessage]:
+    """Keep the last `max_messages` messages, starting on a user turn.
+
+    Cutting in the middle of a turn would leave assistant tool calls without
+    their results (or results without their call), which the LLM API rejects.
+    System messages at the start of the history (such as the workspace index)
+    are always kept. A last turn longer than the window (a long chain of
+    tool calls) is kept whole, from its user message on.
+    """
+    if len(messages) <= max_messages:
+        return messages
+    pinned = 0
+    while pinned < len(messages) and messages[pinned].role == "system":
+        pinned += 1
+    window = messages[-max(1, max_messages - pinned):]
+    for i, message in enumerate(window):
+        if message.role == "user":
+            return messages[:pinned] + window[i:]
+    for start in range(len(messages) - len(window) - 1, pinned - 1, -1):
+        if messages[start].role == "user":
+            return messages[:pinned] + messages[start:]
+    return messages
+
+
+async def trim_history(memory: BaseMemory, max_messages: int) -> int:
+    """Drop the oldest turns beyond `max_messages`, return how many were dropped"""
+    messages = await memory.aget_all()
+    window = window_messages(messages, max_messages)
+    if len(window) == len(messages):
+        return 0
+    await memory.aset(window)
+    return len(messages) - len(window)
+
+
+def message_bytes(message: ChatMessage) -> int:
+    """Approximate the memory held by a chat message.
+
+    Counts the UTF-8 size of its text and of its extra kwargs (tool calls,
+    tool call ids). Python object overhead is ignored, so this is a lower
+    bound that still tracks growth well.
+    """
+    size = len(str(message.content or "").encode("utf-8"))
+    if message.additional_kwargs:
+        size += len(json.dumps(message.additional_kwargs, default=str).encode("utf-8"))
+    return size
+
+
+def estimate_memory_bytes(memory: BaseMemory) -> int:
+    """Approximate the bytes held by a session's chat history"""
+    return sum(message_bytes(message) for message in memory.get_all())
@@ -0,0 +1,70 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Readiness:
+    """Progress of the startup stages that run after the server is listening.
+
+    Each stage is pending, running, ok or failed; the server is ready once
+    every stage is ok. A stage that can fail while a dependency is still
+    coming up (the MCP server) is retried with backoff until it succeeds.
+    """
+
+    def __init__(self, stages: List[str]):
+        self.started = time.monotonic()
+        self.ready_after: Optional[float] = None
+        self.stages: Dict[str, Dict[str, Any]] = {name: {"status": "pending"} for name in stages}
+        self._ready = asyncio.Event()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for readiness"""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.ready
+
+    async def run_stage(
+        self,
+        name: str,
+        stage: Callable[[], Awaitable[Any]],
+        retry_interval: float = 1.0,
+        max_retry_interval: float = 30.0,
+    ):
+        """Run a stage until it succeeds, backing off between attempts"""
+        state = self.stages[name]
+        state["status"] = "running"
+        started = time.monotonic()
+        interval = retry_interval
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                await stage()
+                break
+            except Exception as e:
+                state.update({"status": "failed", "error": str(e), "attempts": attempts})
+                logger.warning(f"Startup stage '{name}' failed ({str(e)}), retrying in {interval:.0f}s")
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, max_retry_interval)
+        state.clear()
+        state.update({"status": "ok", "seconds": round(time.monotonic() - started, 3), "attempts": attempts})
+        logger.info(f"Startup stage '{name}' done in {state['seconds']}s")
+        if all(s["status"] == "ok" for s in self.stages.values()):
+            self.ready_after = time.monotonic() - self.started
+            self._ready.set()
+            logger.info(f"Ready {self.ready_after:.2f}s after start")
+
+    def to_json(self) -> Dict[str, Any]:
+        result = {"ready": self.ready, "uptime": round(time.monotonic() - self.started, 3), "stages": self.stages}
+        if self.ready_after is not None:
+            result["ready_after"] = round(self.ready_after, 3)
+        return result
@@ -0,0 +1,50 @@
+import time
+from typing import List, Optional
+
+
+class DeltaCoalescer:
+    """Accumulates LLM token deltas and releases them at a bounded rate.
+
+    The first delta of a step is released immediately so the client sees
+    text as soon as the model starts producing it. Later deltas are joined
+    until `interval` seconds have passed or `max_chars` are buffered.
+    """
+
+    def __init__(self, interval: float, max_chars: int = 2048):
+        self.interval = interval
+        self.max_chars = max_chars
+        self._buffer: List[str] = []
+        self._size = 0
+        self._last_release: Optional[float] = None
+
+    def add(self, delta: str) -> Optional[str]:
+        """Buffer a delta, returning the coalesced text if it is due"""
+        if not delta:
+            return None
+        self._buffer.append(delta)
+        self._size += len(delta)
+
+        now = time.monotonic()
+        if (
+            self._last_release is None
+            or now - self._last_release >= self.interval
+            or self._size >= self.max_chars
+        ):
+            return self.drain()
+        return None
+
+    def drain(self) -> Optional[str]:
+        """Release whatever is buffered"""
+        if not self._buffer:
+            return None
+        text = "".join(self._buffer)
+        self._buffer = []
+        self._size = 0
+        self._last_release = time.monotonic()
+        return text
+
+    def reset(self):
+        """Start a new LLM step: the next delta is released immediately"""
+        self._buffer = []
+        self._size = 0
+        self._last_release = None
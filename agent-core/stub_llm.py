@@ -0,0 +1,145 @@
+import asyncio
+import json
+import uuid
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    LLMMetadata,
+    MessageRole,
+)
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.llms.function_calling import FunctionCallingLLM
+from llama_index.core.tools import ToolSelection
+
+
+class StubLLM(FunctionCallingLLM):
+    """Local function-calling LLM with configurable latency, for tests and benchmarks.
+
+    On a fresh user turn it calls each tool of `tool_plan` that the agent
+    offers (all in one step, or one per step when `sequential`), and once
+    tool results are in it answers with `answer`. Asked for a plan (see
+    planner.py) it replies with `tool_plan` as one. No network access or API
+    key is needed.
+    """
+
+    model: str = Field(default="stub", description="Name reported in metadata")
+    answer: str = Field(default="Done.", description="Final answer text")
+    tool_plan: List[Dict[str, Any]] = Field(
+        default_factory=list,
+        description="Tool calls made on a user turn: [{'name': ..., 'kwargs': {...}}]",
+    )
+    sequential: bool = Field(default=False, description="Call the tools of tool_plan one per LLM step")
+    preamble: str = Field(default="", description="Text streamed before tool calls")
+    latency: float = Field(default=0.0, description="Seconds before the first token")
+    token_delay: float = Field(default=0.0, description="Seconds between streamed tokens")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "StubLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name=self.model, is_chat_model=True, is_function_calling_model=True)
+
+    def _prepare_chat_with_tools(
+        self,
+        tools: Sequence[Any],
+        user_msg: Optional[Union[str, ChatMessage]] = None,
+        chat_history: Optional[List[ChatMessage]] = None,
+        verbose: bool = False,
+        allow_parallel_tool_calls: bool = False,
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        messages = list(chat_history or [])
+        if user_msg is not None:
+            messages.append(user_msg if isinstance(user_msg, ChatMessage) else ChatMessage(role="user", content=user_msg))
+        return {"messages": messages, "tools": [tool.metadata.name for tool in tools], **kwargs}
+
+    def get_tool_calls_from_response(
+        self, response: ChatResponse, error_on_no_tool_call: bool = True, **kwargs: Any
+    ) -> List[ToolSelection]:
+        calls = response.message.additional_kwargs.get("tool_calls", [])
+        if not calls and error_on_no_tool_call:
+            raise ValueError("Expected at least one tool call")
+        return [ToolSelection(tool_id=c["id"], tool_name=c["name"], tool_kwargs=c["kwargs"]) for c in calls]
+
+    def _reply(self, messages: Sequence[ChatMessage], tools: Sequence[str]) -> ChatMessage:
+        if messages and messages[0].role == MessageRole.SYSTEM and "<tool_plan_request>" in (messages[0].content or ""):
+            steps = [
+                {"id": f"s{i + 1}", "tool": c["name"], "args": c.get("kwargs", {})}
+                for i, c in enumerate(self.tool_plan)
+            ]
+            return ChatMessage(role="assistant", content=json.dumps({"steps": steps} if steps else {"steps": [], "answer": self.answer}))
+
+        last = messages[-1] if messages else None
+        planned = [c for c in self.tool_plan if c["name"] in tools]
+        if self.sequential and last is not None and last.role in (MessageRole.USER, MessageRole.TOOL):
+            # Tool results since the user's message tell how far along the plan is
+            done = 0
+            for message in reversed(messages):
+                if message.role == MessageRole.USER:
+                    break
+                done += message.role == MessageRole.TOOL
+            planned = planned[done:done + 1]
+        elif last is None or last.role != MessageRole.USER:
+            planned = []
+        calls = [
+            {"id": f"call_{uuid.uuid4().hex[:8]}", "name": c["name"], "kwargs": c.get("kwargs", {})}
+            for c in planned
+        ]
+        if calls:
+            return ChatMessage(role="assistant", content=self.preamble, additional_kwargs={"tool_calls": calls})
+        return ChatMessage(role="assistant", content=self.answer)
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        return ChatResponse(message=self._reply(messages, kwargs.get("tools", [])))
+
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseGen:
+        yield self.chat(messages, **kwargs)
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return CompletionResponse(text=self.answer)
+
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        yield self.complete(prompt)
+
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        await asyncio.sleep(self.latency)
+        return self.chat(messages, **kwargs)
+
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseAsyncGen:
+        message = self._reply(messages, kwargs.get("tools", []))
+
+        async def gen() -> ChatResponseAsyncGen:
+            await asyncio.sleep(self.latency)
+            if message.additional_kwargs.get("tool_calls"):
+                for token in (message.content or "").split():
+                    yield ChatResponse(message=message, delta=token + " ")
+                    await asyncio.sleep(self.token_delay)
+                yield ChatResponse(message=message, delta="")
+                return
+            content = ""
+            for token in message.content.split(" "):
+                delta = token if not content else " " + token
+                content += delta
+                yield ChatResponse(message=ChatMessage(role="assistant", content=content), delta=delta)
+                await asyncio.sleep(self.token_delay)
+
+        return gen()
+
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        await asyncio.sleep(self.latency)
+        return self.complete(prompt)
+
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseAsyncGen:
+        async def gen() -> CompletionResponseAsyncGen:
+            yield await self.acomplete(prompt)
+
+        return gen()
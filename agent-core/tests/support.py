@@ -0,0 +1,132 @@
+"""
+Runs websocket_server's request handling in-process for the tests: stub LLM
+routes, tools given by the test instead of the MCP server's, and no event
+log, response cache or workspace prefetch unless a test sets them up.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import ClassVar
+
+AGENT_CORE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, AGENT_CORE_DIR)
+
+os.environ.update(
+    LLM_ROUTES=json.dumps([{"name": "stub", "provider": "stub"}]),
+    MCP_SERVER_URL="http://127.0.0.1:9/sse",
+    EVENT_LOG_PATH="",
+    RESPONSE_CACHE_ENABLED="false",
+    WORKSPACE_PREFETCH="false",
+)
+
+import websocket_server as server  # noqa: E402
+from stub_llm import StubLLM  # noqa: E402
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+class CountingStubLLM(StubLLM):
+    """StubLLM counting the response streams it opened and has open"""
+
+    calls: ClassVar[int] = 0
+    in_flight: ClassVar[int] = 0
+
+    async def astream_chat(self, messages, **kwargs):
+        inner = await super().astream_chat(messages, **kwargs)
+        CountingStubLLM.calls += 1
+
+        async def gen():
+            CountingStubLLM.in_flight += 1
+            try:
+                async for chunk in inner:
+                    yield chunk
+            finally:
+                CountingStubLLM.in_flight -= 1
+
+        return gen()
+
+
+class RecordingSender:
+    """Stands in for EventSender, keeping the events sent to the client"""
+
+    def __init__(self):
+        self.capabilities = {"delta"}
+        self.events = []
+
+    async def send(self, event_type, data):
+        self.events.append((event_type, data))
+
+    def sent(self, event_type, task_id) -> bool:
+        return any(t == event_type and d.get("task_id") == task_id for t, d in self.events)
+
+    def last(self, *event_types):
+        for event_type, data in reversed(self.events):
+            if event_type in event_types:
+                return event_type, data
+        return None
+
+
+async def start_runtime(tools=(), **llm_options) -> CountingStubLLM:
+    """Start the server's runtime with `tools` and return the LLM of its only route"""
+    server.agent_tools = list(tools)
+    await server.start_agent_runtime()
+    CountingStubLLM.calls = 0
+    CountingStubLLM.in_flight = 0
+    llm = CountingStubLLM(**llm_options)
+    server.router.default.llm = llm
+    return llm
+
+
+async def login(sender: RecordingSender) -> str:
+    session_id = await server.handle_login(sender, "test", {})
+    assert session_id in server.active_sessions, sender.events
+    return session_id
+
+
+async def ask(sender: RecordingSender, session_id: str, task_id: str, message: str):
+    """Run a request to the end and return its agent_response or error event"""
+    await server.process_agent_request(sender, "test", session_id, task_id, message)
+    return sender.last("agent_response", "error", "task_cancelled")
+
+
+async def wait_until(predicate, timeout: float) -> bool:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        if loop.time() > deadline:
+            return False
+        await asyncio.sleep(0.01)
+    return True
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_stub_mcp_server(port: int, latency: float) -> subprocess.Popen:
+    """Spawn benchmarks/stub_mcp_server.py and wait until it listens"""
+    server_script = os.path.join(AGENT_CORE_DIR, "benchmarks", "stub_mcp_server.py")
+    process = subprocess.Popen(
+        [sys.executable, server_script, "--port", str(port), "--latency", str(latency)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"Stub MCP server exited with code {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return process
+        except OSError:
+            if time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError("Stub MCP server not listening after 30s")
+            time.sleep(0.1)
@@ -0,0 +1,39 @@
+import unittest
+
+import support  # noqa: F401 -- puts agent-core on the path
+
+from llama_index.core.tools import ToolSelection
+
+from agent import plan_tool_dependencies
+
+
+def call(tool_id, name, **kwargs):
+    return ToolSelection(tool_id=tool_id, tool_name=name, tool_kwargs=kwargs)
+
+
+class PlanToolDependenciesTest(unittest.TestCase):
+    def test_reads_run_in_parallel_and_writes_keep_order_per_spreadsheet(self):
+        dependencies = plan_tool_dependencies([
+            call("r1", "get_sheet_data", spreadsheet_id="a", sheet="S"),
+            call("r2", "get_sheet_data", spreadsheet_id="b", sheet="S"),
+            call("w1", "update_cells", spreadsheet_id="a", sheet="S"),
+            call("r3", "get_sheet_data", spreadsheet_id="a", sheet="S"),
+            call("r4", "get_sheet_data", spreadsheet_id="b", sheet="S"),
+        ])
+        self.assertEqual(dependencies, {"r1": [], "r2": [], "w1": ["r1"], "r3": ["w1"], "r4": []})
+
+    def test_write_on_an_unknown_spreadsheet_serializes_against_everything(self):
+        dependencies = plan_tool_dependencies([
+            call("r1", "get_sheet_data", spreadsheet_id="a", sheet="S"),
+            call("w1", "update_cells", spreadsheet_id="b", sheet="S"),
+            call("x", "some_new_tool"),
+            call("r2", "get_sheet_data", spreadsheet_id="c", sheet="S"),
+            call("l", "list_spreadsheets"),
+        ])
+        self.assertEqual(dependencies["x"], ["r1", "w1"])
+        self.assertEqual(dependencies["r2"], ["x"])
+        self.assertEqual(dependencies["l"], ["x"])
+
+
+if __name__ == "__main__":
+    unittest.main()
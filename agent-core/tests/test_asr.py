@@ -0,0 +1,71 @@
+import asyncio
+import os
+import stat
+import sys
+import tempfile
+import textwrap
+import unittest
+
+import support  # noqa: F401 -- puts agent-core on the path
+
+from asr import AsrError, AudioTranscription, FfmpegDecoder, Recognizer
+
+
+def fake_ffmpeg(directory: str, script: str) -> str:
+    """An executable standing in for ffmpeg"""
+    path = os.path.join(directory, "ffmpeg")
+    with open(path, "w") as f:
+        f.write(f"#!{sys.executable}\n" + textwrap.dedent(script))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return path
+
+
+class StuckRecognizer(Recognizer):
+    """Never produces a final result"""
+
+    async def start(self, sample_rate: int):
+        pass
+
+    async def feed(self, pcm: bytes):
+        pass
+
+    async def finish(self) -> str:
+        await asyncio.Event().wait()
+
+
+class FfmpegDecoderTest(unittest.IsolatedAsyncioTestCase):
+    async def test_error_output_larger_than_the_pipe_does_not_block_ffmpeg(self):
+        with tempfile.TemporaryDirectory() as directory:
+            binary = fake_ffmpeg(directory, """
+                import sys
+                sys.stderr.write("Invalid data found when processing input\\n" * 20000)
+                sys.stderr.flush()
+                sys.stdin.buffer.read()
+                sys.exit(1)
+            """)
+
+            async def on_pcm(pcm: bytes):
+                pass
+
+            decoder = FfmpegDecoder(16000, on_pcm, binary)
+            await decoder.start()
+            try:
+                await decoder.feed(b"not audio")
+                with self.assertRaisesRegex(AsrError, "Invalid data"):
+                    await asyncio.wait_for(decoder.finish(), 10)
+            finally:
+                await decoder.close()
+
+
+class AudioTranscriptionTest(unittest.IsolatedAsyncioTestCase):
+    async def test_finalization_times_out(self):
+        audio = AudioTranscription("t1", StuckRecognizer(), final_timeout=0.2)
+        run = asyncio.create_task(audio.run())
+        await audio.put(b"\0" * 3200)
+        await audio.end()
+        with self.assertRaisesRegex(AsrError, "No final transcript"):
+            await asyncio.wait_for(run, 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,198 @@
+import asyncio
+import json
+import time
+import unittest
+import urllib.request
+
+from support import (
+    CountingStubLLM, RecordingSender, ask, free_port, login, server, start_runtime,
+    start_stub_mcp_server, wait_until,
+)
+
+from llama_index.core.llms import ChatMessage
+from llama_index.core.tools import FunctionTool
+
+from mcp_client import CancellableMCPClient
+
+# Slow enough that nothing in a test finishes by itself
+SLOW = 30.0
+# Upper bound on cancelling a run and tearing down its LLM and tool calls
+FREED_WITHIN = 2.0
+
+
+class SlowTool:
+    """A read tool that takes SLOW seconds, counting the calls still running"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.cancelled = 0
+
+    async def get_sheet_data(self, spreadsheet_id: str, sheet: str) -> str:
+        """Read a sheet"""
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(SLOW)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.in_flight -= 1
+        return "[]"
+
+    def tool(self) -> FunctionTool:
+        return FunctionTool.from_defaults(async_fn=self.get_sheet_data, name="get_sheet_data")
+
+
+class CancelRunTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.slow = SlowTool()
+        self.llm = await start_runtime([self.slow.tool()])
+        self.sender = RecordingSender()
+        self.session_id = await login(self.sender)
+        self.session = server.active_sessions[self.session_id]
+        self.llm.answer = "Ready."
+        await ask(self.sender, self.session_id, "warmup", "hello")
+        self.history = list(await self.session.memory.aget_all())
+
+    async def asyncTearDown(self):
+        for session_id in list(server.active_sessions):
+            server.end_session(session_id)
+
+    def start(self, task_id: str, message: str) -> asyncio.Task:
+        task = asyncio.create_task(server.process_agent_request(self.sender, "test", self.session_id, task_id, message))
+        self.session.add_task(task_id, task)
+        return task
+
+    async def cancel(self, task_id: str, task: asyncio.Task) -> float:
+        """Cancel like cancel_request does, return the seconds until the task is done"""
+        cancelled_at = time.monotonic()
+        task.cancel()
+        self.session.remove_task(task_id)
+        await asyncio.wait_for(task, FREED_WITHIN)
+        return time.monotonic() - cancelled_at
+
+    async def assert_follow_up_completes(self):
+        self.llm.tool_plan = []
+        self.llm.answer = "Done."
+        event_type, data = await asyncio.wait_for(ask(self.sender, self.session_id, "follow-up", "again"), FREED_WITHIN)
+        self.assertEqual((event_type, data["response"]), ("agent_response", "Done."))
+
+    async def test_cancel_while_streaming_the_answer(self):
+        self.llm.answer = " ".join(["token"] * 200)
+        self.llm.token_delay = 0.05
+        task = self.start("t1", "go")
+        self.assertTrue(await wait_until(lambda: self.sender.sent("agent_delta", "t1"), FREED_WITHIN))
+
+        self.assertLess(await self.cancel("t1", task), FREED_WITHIN)
+        self.assertTrue(await wait_until(lambda: CountingStubLLM.in_flight == 0, FREED_WITHIN))
+        self.assertEqual(self.sender.last("task_cancelled", "agent_response")[0], "task_cancelled")
+        self.assertEqual(await self.session.memory.aget_all(), self.history)
+        await self.assert_follow_up_completes()
+
+    async def test_cancel_during_a_slow_tool_call(self):
+        self.llm.tool_plan = [{"name": "get_sheet_data", "kwargs": {"spreadsheet_id": "a", "sheet": "Sheet1"}}]
+        task = self.start("t1", "go")
+        self.assertTrue(await wait_until(lambda: self.slow.in_flight == 1, FREED_WITHIN))
+
+        self.assertLess(await self.cancel("t1", task), FREED_WITHIN)
+        self.assertTrue(await wait_until(lambda: self.slow.in_flight == 0, FREED_WITHIN))
+        self.assertEqual(self.slow.cancelled, 1)
+        self.assertEqual(await self.session.memory.aget_all(), self.history)
+        await self.assert_follow_up_completes()
+
+    async def test_cancel_leaves_the_history_of_a_concurrent_run(self):
+        self.llm.tool_plan = [{"name": "get_sheet_data", "kwargs": {"spreadsheet_id": "a", "sheet": "Sheet1"}}]
+        first = self.start("t1", "first")
+        second = self.start("t2", "second")
+        self.assertTrue(await wait_until(lambda: self.slow.in_flight == 2, FREED_WITHIN))
+
+        await self.cancel("t2", second)
+        self.assertTrue(await wait_until(lambda: self.slow.in_flight == 1, FREED_WITHIN))
+        contents = [m.content for m in await self.session.memory.aget_all()]
+        self.assertIn("first", contents)
+
+        await self.cancel("t1", first)
+        self.assertEqual(self.slow.in_flight, 0)
+
+
+class RollbackTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await start_runtime()
+        self.session = server.active_sessions[await login(RecordingSender())]
+        await self.session.memory.aput(ChatMessage(role="user", content="before"))
+        self.snapshot = await self.session.snapshot()
+        await self.session.memory.aput(ChatMessage(role="user", content="interrupted"))
+
+    async def asyncTearDown(self):
+        for session_id in list(server.active_sessions):
+            server.end_session(session_id)
+
+    async def contents(self):
+        return [m.content for m in await self.session.memory.aget_all()]
+
+    async def test_restores_the_snapshot_of_the_only_run(self):
+        self.assertTrue(await self.session.rollback("t1", self.snapshot))
+        self.assertEqual(await self.contents(), ["before"])
+
+    async def test_keeps_the_history_while_another_run_is_active(self):
+        other = asyncio.create_task(asyncio.sleep(SLOW))
+        self.session.add_task("t2", other)
+        try:
+            self.assertFalse(await self.session.rollback("t1", self.snapshot))
+            self.assertEqual(await self.contents(), ["before", "interrupted"])
+        finally:
+            other.cancel()
+
+    async def test_keeps_the_history_when_another_run_completed_since(self):
+        self.session.completed_turns += 1
+        self.assertFalse(await self.session.rollback("t1", self.snapshot))
+        self.assertEqual(await self.contents(), ["before", "interrupted"])
+
+
+class CancellableMCPClientTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.port = free_port()
+        self.mcp = start_stub_mcp_server(self.port, SLOW)
+
+    def tearDown(self):
+        self.mcp.terminate()
+        self.mcp.wait()
+
+    def stats(self):
+        with urllib.request.urlopen(f"http://127.0.0.1:{self.port}/stats", timeout=5) as response:
+            return json.loads(response.read())
+
+    async def test_cancelled_call_is_cancelled_on_the_server(self):
+        client = CancellableMCPClient(f"http://127.0.0.1:{self.port}/sse")
+        call = asyncio.create_task(client.call_tool("get_sheet_data", {"spreadsheet_id": "a", "sheet": "Sheet1"}))
+
+        async def in_flight(count):
+            return await wait_until_async(lambda: asyncio.to_thread(self.stats), lambda s: s["in_flight"] == count)
+
+        self.assertTrue(await in_flight(1))
+        call.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await call
+        self.assertTrue(await in_flight(0))
+        self.assertEqual((await asyncio.to_thread(self.stats))["cancelled"], 1)
+
+    async def test_call_cancelled_while_the_session_opens_is_not_sent(self):
+        client = CancellableMCPClient(f"http://127.0.0.1:{self.port}/sse")
+        abandoned = asyncio.Event()
+        abandoned.set()
+
+        self.assertIsNone(await client._call_tool_in_session("get_sheet_data", {"spreadsheet_id": "a"}, abandoned))
+        self.assertEqual((await asyncio.to_thread(self.stats))["calls"], 0)
+
+
+async def wait_until_async(fetch, predicate, timeout: float = 10.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate(await fetch()):
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,20 @@
+import unittest
+
+import support  # noqa: F401 -- puts agent-core on the path
+
+from codec import JsonCodec, get_codec
+
+
+class GetCodecTest(unittest.TestCase):
+    def test_known_names(self):
+        self.assertIsInstance(get_codec("json"), JsonCodec)
+        self.assertIn(get_codec("auto").name, ("orjson", "json"))
+
+    def test_unknown_name_is_rejected(self):
+        for name in ("ujson", "jsno"):
+            with self.assertRaises(ValueError):
+                get_codec(name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import json
+import unittest
+
+import support  # noqa: F401 -- puts agent-core on the path
+
+from compaction import FETCH_MAX_ITEMS, ToolResultStore, make_fetch_tool, render
+
+
+class FetchToolResultTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.store = ToolResultStore()
+        self.fetch = make_fetch_tool(self.store, threshold=1000)
+
+    async def fetch_content(self, **kwargs) -> str:
+        return (await self.fetch.acall(**kwargs)).content
+
+    async def test_large_limit_is_clamped_to_a_page(self):
+        rows = [[i, f"name {i}"] for i in range(1000)]
+        handle = self.store.put("get_sheet_data", rows, len(render(rows)))
+
+        content = await self.fetch_content(handle=handle, offset=10, limit=100000)
+        self.assertLessEqual(len(content), 1000)
+        page = json.loads(content)
+        self.assertEqual(page["total"], 1000)
+        self.assertLessEqual(page["count"], FETCH_MAX_ITEMS)
+        self.assertEqual(page["items"], rows[10:10 + page["count"]])
+
+    async def test_large_limit_on_text_is_truncated_to_the_threshold(self):
+        text = "x" * 100000
+        handle = self.store.put("get_sheet_formulas", text, len(text))
+
+        self.assertEqual(len(await self.fetch_content(handle=handle, limit=100000)), 1000)
+
+
+if __name__ == "__main__":
+    unittest.main()
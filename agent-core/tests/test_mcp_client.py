@@ -0,0 +1,74 @@
+import unittest
+
+import support  # noqa: F401 -- puts agent-core on the path
+
+import httpx
+from mcp import types
+from mcp.shared.exceptions import McpError
+
+from mcp_client import IDEMPOTENCY_KEY, CancellableMCPClient, is_transient
+
+
+class FlakyClient(CancellableMCPClient):
+    """Fails the first `failures` attempts of every call as if the server were unreachable"""
+
+    def __init__(self, failures: int, **kwargs):
+        super().__init__("http://127.0.0.1:9/sse", retry_interval=0.0, **kwargs)
+        self.failures = failures
+        self.attempts = []
+
+    async def _call_tool(self, tool_name: str, arguments: dict):
+        self.attempts.append((tool_name, arguments))
+        if len(self.attempts) <= self.failures:
+            raise BaseExceptionGroup("unhandled errors in a TaskGroup", [httpx.ConnectError("All connection attempts failed")])
+        return arguments
+
+
+class CallToolRetryTest(unittest.IsolatedAsyncioTestCase):
+    async def test_write_is_repeated_with_the_key_of_its_first_attempt(self):
+        client = FlakyClient(failures=2)
+        client.keyed_tools = {"add_rows"}
+        result = await client.call_tool("add_rows", {"spreadsheet_id": "a", "sheet": "S", "count": 1, IDEMPOTENCY_KEY: "x"})
+
+        keys = [arguments[IDEMPOTENCY_KEY] for _, arguments in client.attempts]
+        self.assertEqual(len(keys), 3)
+        self.assertEqual(len(set(keys)), 1)
+        self.assertNotEqual(keys[0], "x")
+        self.assertEqual(result[IDEMPOTENCY_KEY], keys[0])
+
+    async def test_each_call_gets_its_own_key(self):
+        client = FlakyClient(failures=0)
+        client.keyed_tools = {"add_rows"}
+        first = await client.call_tool("add_rows", {"spreadsheet_id": "a", "sheet": "S", "count": 1})
+        second = await client.call_tool("add_rows", {"spreadsheet_id": "a", "sheet": "S", "count": 1})
+        self.assertNotEqual(first[IDEMPOTENCY_KEY], second[IDEMPOTENCY_KEY])
+
+    async def test_write_without_a_key_is_not_repeated(self):
+        client = FlakyClient(failures=1)
+        with self.assertRaises(BaseExceptionGroup):
+            await client.call_tool("add_rows", {"spreadsheet_id": "a", "sheet": "S", "count": 1})
+        self.assertEqual(len(client.attempts), 1)
+        self.assertNotIn(IDEMPOTENCY_KEY, client.attempts[0][1])
+
+    async def test_read_is_repeated_up_to_retries(self):
+        client = FlakyClient(failures=5, retries=2)
+        with self.assertRaises(BaseExceptionGroup):
+            await client.call_tool("get_sheet_data", {"spreadsheet_id": "a", "sheet": "S"})
+        self.assertEqual(len(client.attempts), 3)
+
+
+class IsTransientTest(unittest.TestCase):
+    def test_timeouts_and_connection_errors_are_transient(self):
+        timeout = McpError(types.ErrorData(code=httpx.codes.REQUEST_TIMEOUT, message="Timed out"))
+        self.assertTrue(is_transient(timeout))
+        self.assertTrue(is_transient(httpx.ConnectError("refused")))
+        self.assertTrue(is_transient(ConnectionResetError()))
+
+    def test_protocol_errors_are_not(self):
+        self.assertFalse(is_transient(McpError(types.ErrorData(code=types.INVALID_PARAMS, message="Invalid"))))
+        self.assertFalse(is_transient(ValueError("bad")))
+        self.assertFalse(is_transient(BaseExceptionGroup("mixed", [httpx.ConnectError("refused"), ValueError("bad")])))
+
+
+if __name__ == "__main__":
+    unittest.main()
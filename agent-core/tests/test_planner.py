@@ -0,0 +1,47 @@
+import asyncio
+import unittest
+
+import support  # noqa: F401 -- puts agent-core on the path
+
+from llama_index.core.tools import FunctionTool
+
+from planner import Plan, PlanStep, execute_plan
+
+
+class ExecutePlanTest(unittest.IsolatedAsyncioTestCase):
+    async def test_write_to_a_referenced_spreadsheet_waits_for_other_writes(self):
+        running, overlaps, order = set(), [], []
+
+        async def list_spreadsheets():
+            return [{"id": "abc", "title": "Budget"}]
+
+        async def update_cells(spreadsheet_id: str, data: str):
+            if running:
+                overlaps.append((data, set(running)))
+            running.add(data)
+            await asyncio.sleep(0.05)
+            running.discard(data)
+            order.append((spreadsheet_id, data))
+            return "ok"
+
+        tools = [
+            FunctionTool.from_defaults(async_fn=list_spreadsheets, name="list_spreadsheets"),
+            FunctionTool.from_defaults(async_fn=update_cells, name="update_cells"),
+        ]
+        plan = Plan(steps=[
+            PlanStep("s1", "list_spreadsheets", {}),
+            PlanStep("s2", "update_cells", {"spreadsheet_id": "$s1.0.id", "data": "first"}, references=["s1"]),
+            PlanStep("s3", "update_cells", {"spreadsheet_id": "abc", "data": "second"}),
+        ])
+
+        async def on_result(result):
+            pass
+
+        results = await execute_plan(plan, tools, workers=4, on_result=on_result)
+        self.assertEqual([result.step.id for result in results], ["s1", "s2", "s3"])
+        self.assertEqual(overlaps, [])
+        self.assertEqual(order, [("abc", "first"), ("abc", "second")])
+
+
+if __name__ == "__main__":
+    unittest.main()
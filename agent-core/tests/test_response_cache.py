@@ -0,0 +1,78 @@
+import unittest
+
+from support import CountingStubLLM, RecordingSender, ask, login, server, start_runtime
+
+from llama_index.core.llms import ChatMessage
+from response_cache import ResponseCache, conversation_key
+
+
+class ConversationKeyTest(unittest.TestCase):
+    def test_first_turn_has_empty_key(self):
+        self.assertEqual(conversation_key([]), "")
+        self.assertEqual(conversation_key([ChatMessage(role="system", content="Workspace: Sales")]), "")
+
+    def test_key_follows_earlier_turns(self):
+        sales = [ChatMessage(role="user", content="Open Sales"), ChatMessage(role="assistant", content="Opened.")]
+        budget = [ChatMessage(role="user", content="Open Budget"), ChatMessage(role="assistant", content="Opened.")]
+        self.assertNotEqual(conversation_key(sales), "")
+        self.assertEqual(conversation_key(sales), conversation_key(list(sales)))
+        self.assertNotEqual(conversation_key(sales), conversation_key(budget))
+
+
+class ResponseCacheContextTest(unittest.TestCase):
+    def test_lookup_matches_within_context_only(self):
+        cache = ResponseCache()
+        cache.store("How many rows?", "42", ["sales"], context="a")
+        self.assertEqual(cache.lookup("how many rows", context="a"), "42")
+        self.assertIsNone(cache.lookup("how many rows", context="b"))
+        self.assertIsNone(cache.lookup("how many rows"))
+
+
+class ProcessAgentRequestCacheTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.llm = await start_runtime()
+        server.response_cache = ResponseCache()
+
+    async def asyncTearDown(self):
+        server.response_cache = None
+        for session_id in list(server.active_sessions):
+            server.end_session(session_id)
+
+    async def test_first_turn_is_shared_across_sessions(self):
+        self.llm.answer = "Sales has 42 rows."
+        first = RecordingSender()
+        event_type, data = await ask(first, await login(first), "t1", "How many rows are in Sales?")
+        self.assertEqual((event_type, data["response"]), ("agent_response", "Sales has 42 rows."))
+        calls = CountingStubLLM.calls
+
+        second = RecordingSender()
+        event_type, data = await ask(second, await login(second), "t2", "how many rows are in sales")
+        self.assertEqual(event_type, "agent_response")
+        self.assertTrue(data.get("cached"))
+        self.assertEqual(data["response"], "Sales has 42 rows.")
+        self.assertEqual(CountingStubLLM.calls, calls)
+
+    async def test_follow_up_is_not_shared_across_conversations(self):
+        sales = RecordingSender()
+        sales_session = await login(sales)
+        self.llm.answer = "Opened Sales."
+        await ask(sales, sales_session, "t1", "Open the Sales spreadsheet")
+        self.llm.answer = "It has 42 rows."
+        event_type, data = await ask(sales, sales_session, "t2", "How many rows does it have?")
+        self.assertEqual(data["response"], "It has 42 rows.")
+
+        budget = RecordingSender()
+        budget_session = await login(budget)
+        self.llm.answer = "Opened Budget."
+        await ask(budget, budget_session, "t3", "Open the Budget spreadsheet")
+        self.llm.answer = "It has 17 rows."
+        calls = CountingStubLLM.calls
+        event_type, data = await ask(budget, budget_session, "t4", "How many rows does it have?")
+        self.assertEqual(event_type, "agent_response")
+        self.assertFalse(data.get("cached"))
+        self.assertEqual(data["response"], "It has 17 rows.")
+        self.assertGreater(CountingStubLLM.calls, calls)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+import support  # noqa: F401 -- puts agent-core on the path
+
+from llama_index.core.llms import ChatMessage
+from session_memory import window_messages
+
+
+def messages(*roles):
+    return [ChatMessage(role=role, content=f"{role} {i}") for i, role in enumerate(roles)]
+
+
+class WindowMessagesTest(unittest.TestCase):
+    def test_starts_on_a_user_turn(self):
+        history = messages("system", "user", "assistant", "user", "assistant", "tool", "assistant")
+        window = window_messages(history, 5)
+        self.assertEqual([m.content for m in window], ["system 0", "user 3", "assistant 4", "tool 5", "assistant 6"])
+
+    def test_keeps_a_last_turn_longer_than_the_window(self):
+        history = messages("system", "user", "assistant", "user", *["assistant", "tool"] * 4)
+        window = window_messages(history, 4)
+        self.assertEqual(window[0].content, "system 0")
+        self.assertEqual(window[1].content, "user 3")
+        self.assertEqual(window[1:], history[3:])
+
+    def test_keeps_a_history_without_user_messages(self):
+        history = messages("system", "assistant", "tool", "assistant", "tool")
+        self.assertEqual(window_messages(history, 2), history)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+from unittest import mock
+
+from support import RecordingSender, login, server, start_runtime
+
+from llama_index.core.tools import FunctionTool
+
+from routing import Route
+from stub_llm import StubLLM
+
+
+class AgentRunTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await start_runtime()
+
+    async def asyncTearDown(self):
+        for session_id in list(server.active_sessions):
+            server.end_session(session_id)
+
+    async def test_run_on_a_route_leaves_the_session_agent_alone(self):
+        sender = RecordingSender()
+        session = server.active_sessions[await login(sender)]
+        shared_llm = session.agent.llm
+        route = Route("strong", StubLLM(answer="From the strong route."))
+
+        response = await server.stream_agent_run(sender, session, "t1", "hello", server.AgentRun(route))
+        self.assertEqual(str(response), "From the strong route.")
+        self.assertIs(session.agent.llm, shared_llm)
+
+    async def test_deltas_of_each_llm_step_are_numbered(self):
+        llm = await start_runtime([FunctionTool.from_defaults(async_fn=get_sheet_data, name="get_sheet_data")])
+        llm.preamble = "Let me check the sheet."
+        llm.tool_plan = [{"name": "get_sheet_data", "kwargs": {"spreadsheet_id": "a", "sheet": "Sheet1"}}]
+        llm.answer = "The sheet is empty."
+        sender = RecordingSender()
+        session_id = await login(sender)
+
+        await server.process_agent_request(sender, "test", session_id, "t1", "what is in the sheet?")
+        steps = {}
+        for event_type, data in sender.events:
+            if event_type == "agent_delta":
+                steps[data["step"]] = steps.get(data["step"], "") + data["delta"]
+        self.assertEqual(len(steps), 2)
+        first, last = sorted(steps)
+        self.assertEqual(steps[first].strip(), "Let me check the sheet.")
+        self.assertEqual(steps[last], "The sheet is empty.")
+
+
+async def get_sheet_data(spreadsheet_id: str, sheet: str) -> str:
+    """Read a sheet"""
+    return "[]"
+
+
+class LoginUserTest(unittest.TestCase):
+    def test_weight_comes_from_the_server_not_the_client(self):
+        with mock.patch.dict(server.SCHED_USER_WEIGHTS, {"42": 3.0}, clear=True):
+            self.assertEqual(server.login_user("s1", {"user_id": "42", "priority": 100}), ("user:42", 3.0))
+            self.assertEqual(server.login_user("s1", {"user_id": 7, "priority": 100}), ("user:7", 1.0))
+            self.assertEqual(server.login_user("s1", {"priority": 100}), ("s1", 1.0))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+from typing import Any, Dict, List
+
+# MCP tools that change spreadsheet contents, structure or sharing
+WRITE_TOOLS = {
+    "update_cells",
+    "batch_update_cells",
+    "add_rows",
+    "add_columns",
+    "copy_sheet",
+    "rename_sheet",
+    "create_spreadsheet",
+    "create_sheet",
+    "batch_structure",
+    "share_spreadsheet",
+}
+
+# Read-only tools that may run concurrently with each other
+PARALLEL_SAFE_TOOLS = {
+    "get_sheet_data",
+    "get_sheet_formulas",
+    "list_sheets",
+    "get_multiple_sheet_data",
+    "get_multiple_spreadsheet_summary",
+    "list_spreadsheets",
+    "search_cells",
+    "fetch_tool_result",
+}
+
+# Pseudo spreadsheet id standing for "the set of spreadsheets in the folder".
+# Listing tools read it, tools that create spreadsheets change it.
+WORKSPACE = "*"
+
+WORKSPACE_READ_TOOLS = {"list_spreadsheets", "search_cells"}
+WORKSPACE_WRITE_TOOLS = {"create_spreadsheet"}
+
+_SPREADSHEET_ARGS = ("spreadsheet_id", "spreadsheet", "src_spreadsheet", "dst_spreadsheet")
+
+
+def is_write_tool(tool_name: str) -> bool:
+    """Check if a tool may modify Google Drive state"""
+    return tool_name in WRITE_TOOLS
+
+
+def is_parallel_safe(tool_name: str) -> bool:
+    """Check if a tool is read-only and may overlap with other reads"""
+    return tool_name in PARALLEL_SAFE_TOOLS
+
+
+def touched_spreadsheets(tool_name: str, tool_kwargs: Dict[str, Any]) -> List[str]:
+    """Return the spreadsheet ids a tool call reads or writes"""
+    ids = []
+    for arg in _SPREADSHEET_ARGS:
+        value = tool_kwargs.get(arg)
+        if isinstance(value, str) and value:
+            ids.append(value)
+    for value in tool_kwargs.get("spreadsheet_ids") or []:
+        if isinstance(value, str):
+            ids.append(value)
+    for query in tool_kwargs.get("queries") or []:
+        if isinstance(query, dict) and query.get("spreadsheet_id"):
+            ids.append(query["spreadsheet_id"])
+    if tool_name in WORKSPACE_READ_TOOLS or tool_name in WORKSPACE_WRITE_TOOLS:
+        ids.append(WORKSPACE)
+    return ids
+
+
+def without_spreadsheets(tool_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of a tool call's arguments without those naming spreadsheets"""
+    return {
+        key: value for key, value in tool_kwargs.items()
+        if key not in _SPREADSHEET_ARGS and key not in ("spreadsheet_ids", "queries")
+    }
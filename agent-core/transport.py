@@ -0,0 +1,292 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Sequence, Set, Tuple
+
+from websockets.extensions.base import Extension
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+from websockets.frames import CTRL_OPCODES, OP_CONT
+
+import metrics
+from codec import default_codec
+
+logger = logging.getLogger(__name__)
+
+# Events that may be held back for a few milliseconds and coalesced into one
+# array frame. Everything else (responses, errors, cancellations) flushes the
+# pending batch immediately so ordering and latency are preserved.
+BATCHABLE_EVENTS = {"tool_call", "tool_result", "agent_output", "agent_delta"}
+
+# Progress events a client that cannot keep up may lose. The final answer,
+# errors and cancellations are always delivered.
+SHEDDABLE_EVENTS = {"tool_call", "tool_result", "agent_output", "agent_delta", "transcript_partial"}
+# Events that are summarized rather than dropped under the "summarize" policy
+SUMMARIZABLE_EVENTS = {"tool_call", "tool_result"}
+SLOW_CONSUMER_POLICIES = ("summarize", "drop", "wait")
+# Strings longer than this are cut when an event is summarized
+SUMMARY_CHARS = 200
+# A send taking longer than this waited for the client to read
+STALL_SECONDS = 0.05
+
+
+def summarize_value(value: Any, codec, limit: int = SUMMARY_CHARS) -> Any:
+    """Cut a long string, or a large structure rendered as a string"""
+    if not isinstance(value, str):
+        if not isinstance(value, (dict, list)):
+            return value
+        rendered = codec.dumps(value)
+        if len(rendered) <= limit:
+            return value
+        value = rendered
+    if len(value) <= limit:
+        return value
+    return f"{value[:limit]}... [{len(value) - limit} more characters]"
+
+
+class ThresholdDeflate(Extension):
+    """permessage-deflate that leaves messages below `threshold` bytes as is.
+
+    Token deltas and acks are a few dozen bytes: compressing them costs CPU
+    and saves nothing. A message that is not compressed simply goes out
+    without the RSV1 bit, which the extension allows.
+    """
+
+    def __init__(self, inner: Extension, threshold: int):
+        self.inner = inner
+        self.name = inner.name
+        self.threshold = threshold
+        self._skipping = False
+
+    def decode(self, frame, *, max_size: Optional[int] = None):
+        return self.inner.decode(frame, max_size=max_size)
+
+    def encode(self, frame):
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+        # Continuation frames follow the decision made for the first frame
+        if frame.opcode is not OP_CONT:
+            self._skipping = len(frame.data) < self.threshold
+        if self._skipping:
+            metrics.deflate_skipped.inc()
+            return frame
+        encoded = self.inner.encode(frame)
+        metrics.deflate_input_bytes.inc(amount=len(frame.data))
+        metrics.deflate_saved_bytes.inc(amount=len(frame.data) - len(encoded.data))
+        return encoded
+
+    def __repr__(self) -> str:
+        return f"ThresholdDeflate({self.inner!r}, threshold={self.threshold})"
+
+
+class ThresholdDeflateFactory(ServerPerMessageDeflateFactory):
+    """Negotiates permessage-deflate with the settings `websockets` uses by default"""
+
+    def __init__(self, threshold: int):
+        super().__init__(server_max_window_bits=12, client_max_window_bits=12, compress_settings={"memLevel": 5})
+        self.threshold = threshold
+
+    def process_request_params(self, params: Sequence, accepted_extensions: Sequence[Extension]):
+        response, extension = super().process_request_params(params, accepted_extensions)
+        return response, ThresholdDeflate(extension, self.threshold)
+
+
+class EventSender:
+    """Serializes events and sends them to a single WebSocket client.
+
+    Without batching every event goes out as its own frame, exactly as before.
+    Once a client negotiates the "batch" capability, batchable events are
+    buffered for `window` seconds and sent as a single JSON array frame.
+
+    With `max_buffered_bytes` set, frames go through an outbox written by a
+    background task. Progress events never wait for the client: while more
+    than `max_buffered_bytes` are queued for it they are summarized or
+    dropped (`slow_consumer_policy`). Other events wait until they are
+    written, as before. A frame the client does not take within
+    `send_timeout` seconds gets it disconnected.
+    """
+
+    def __init__(
+        self,
+        websocket,
+        codec=None,
+        max_buffered_bytes: Optional[int] = None,
+        send_timeout: Optional[float] = None,
+        slow_consumer_policy: str = "summarize",
+    ):
+        if slow_consumer_policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy '{slow_consumer_policy}'")
+        self.websocket = websocket
+        self.codec = codec or default_codec
+        self.max_buffered_bytes = max_buffered_bytes
+        self.send_timeout = send_timeout
+        self.slow_consumer_policy = slow_consumer_policy
+        # Set once the client was disconnected for not reading
+        self.closed = False
+        # Optional protocol features negotiated on login
+        self.capabilities: Set[str] = set()
+        self.batch_window: Optional[float] = None
+        self.max_batch = 0
+        self._pending: List[Dict[str, Any]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._send_lock = asyncio.Lock()
+        # Frames waiting for the writer, with a future for those whose sender waits
+        self._outbox: Deque[Tuple[str, Optional[asyncio.Future]]] = deque()
+        self._outbox_bytes = 0
+        self._writer: Optional[asyncio.Task] = None
+        self._error: Optional[BaseException] = None
+
+    @property
+    def batching(self) -> bool:
+        return self.batch_window is not None
+
+    @property
+    def pending_events(self) -> int:
+        """Events held back for the next batch frame or in the outbox"""
+        return len(self._pending) + len(self._outbox)
+
+    def buffered_bytes(self) -> int:
+        """Bytes queued for the client and not yet written to the network"""
+        transport = getattr(self.websocket, "transport", None)
+        return self._outbox_bytes + (transport.get_write_buffer_size() if transport is not None else 0)
+
+    def congested(self) -> bool:
+        """Whether the client is behind by more than `max_buffered_bytes`"""
+        if self.max_buffered_bytes is None:
+            return False
+        return self.buffered_bytes() > self.max_buffered_bytes
+
+    def enable_batching(self, window_ms: float, max_batch: int = 64):
+        """Coalesce batchable events arriving within `window_ms` milliseconds"""
+        self.batch_window = window_ms / 1000.0
+        self.max_batch = max_batch
+
+    async def send(self, event_type: str, data: Dict[str, Any]):
+        """Send an event, possibly coalescing it with its neighbours"""
+        if self.closed:
+            return
+        if event_type in SHEDDABLE_EVENTS and self.slow_consumer_policy != "wait" and self.congested():
+            data = self._shed(event_type, data)
+            if data is None:
+                return
+        event = {"event": event_type, "data": data}
+        metrics.events_sent.inc(event_type)
+        if not self.batching:
+            await self._send_frame(self.codec.dumps(event), wait=event_type not in SHEDDABLE_EVENTS)
+            return
+
+        self._pending.append(event)
+        if event_type not in BATCHABLE_EVENTS or len(self._pending) >= self.max_batch:
+            await self.flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def flush(self):
+        """Send all pending events as one frame"""
+        if self._flush_task is not None and self._flush_task is not asyncio.current_task():
+            self._flush_task.cancel()
+        self._flush_task = None
+
+        events, self._pending = self._pending, []
+        if not events:
+            return
+        payload = events[0] if len(events) == 1 else events
+        wait = any(event["event"] not in SHEDDABLE_EVENTS for event in events)
+        await self._send_frame(self.codec.dumps(payload), wait=wait)
+
+    def _shed(self, event_type: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Summarize or drop a progress event for a client that is behind"""
+        if self.slow_consumer_policy == "summarize" and event_type in SUMMARIZABLE_EVENTS:
+            metrics.events_shed.inc(event_type, "summarized")
+            return {key: summarize_value(value, self.codec) for key, value in data.items()}
+        metrics.events_shed.inc(event_type, "dropped")
+        return None
+
+    async def close(self):
+        """Flush what is left; the socket may already be gone"""
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.debug(f"Dropped pending events on close: {str(e)}")
+        if self._writer is not None and not self._writer.done():
+            self._writer.cancel()
+        self._drop_outbox()
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.batch_window)
+        except asyncio.CancelledError:
+            return
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Error flushing event batch: {str(e)}")
+
+    async def _send_frame(self, frame: str, wait: bool = True):
+        if self.max_buffered_bytes is None:
+            async with self._send_lock:
+                await self.websocket.send(frame)
+            metrics.frames_sent.inc()
+            return
+
+        if self.closed:
+            return
+        if self._error is not None:
+            raise self._error
+        done = asyncio.get_running_loop().create_future() if wait else None
+        self._outbox.append((frame, done))
+        self._outbox_bytes += len(frame)
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_outbox())
+        if done is not None:
+            await done
+
+    async def _write_outbox(self):
+        """Write queued frames in order, one at a time"""
+        while self._outbox:
+            frame, done = self._outbox[0]
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(self.websocket.send(frame), self.send_timeout)
+            except asyncio.TimeoutError:
+                self._record_stall(time.monotonic() - started)
+                self._disconnect_slow_consumer()
+                return
+            except Exception as e:
+                # The connection is gone: waiting senders get the error
+                self._error = e
+                self._drop_outbox(e)
+                return
+            self._outbox.popleft()
+            self._outbox_bytes -= len(frame)
+            metrics.frames_sent.inc()
+            stalled = time.monotonic() - started
+            if stalled > STALL_SECONDS:
+                self._record_stall(stalled)
+            if done is not None and not done.done():
+                done.set_result(None)
+
+    def _record_stall(self, seconds: float):
+        metrics.send_stalls.inc()
+        metrics.send_stall_duration.observe(seconds)
+
+    def _drop_outbox(self, error: Optional[BaseException] = None):
+        for _, done in self._outbox:
+            if done is not None and not done.done():
+                if error is None:
+                    done.set_result(None)
+                else:
+                    done.set_exception(error)
+        self._outbox.clear()
+        self._outbox_bytes = 0
+
+    def _disconnect_slow_consumer(self):
+        """Give up on a client that stopped reading"""
+        logger.warning(f"Closing a connection with {self.buffered_bytes()} unsent bytes: client too slow")
+        self.closed = True
+        self._pending = []
+        # Waiting senders return as if their events went out
+        self._drop_outbox()
+        metrics.slow_consumer_disconnects.inc()
+        # 1008 (policy violation); fail_connection does not wait for the buffer
+        self.websocket.fail_connection(1008, "Client too slow")
@@ -0,0 +1,21 @@
+from typing import Any, Dict
+
+
+def extract_usage(raw: Any) -> Dict[str, int]:
+    """Read token usage from the raw response attached to an AgentOutput.
+
+    OpenAI only reports usage on streamed responses when the request sets
+    stream_options.include_usage; without it, or for other providers, all
+    counts are zero.
+    """
+    usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+    if not usage:
+        return {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+    if not isinstance(usage, dict):
+        usage = usage.model_dump() if hasattr(usage, "model_dump") else vars(usage)
+    details = usage.get("prompt_tokens_details") or {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens") or 0,
+        "completion_tokens": usage.get("completion_tokens") or 0,
+        "cached_tokens": details.get("cached_tokens") or 0,
+    }
@@ -1,22 +1,31 @@
 import asyncio
 import json
 import logging
+import time
 import uuid
 import websockets
 from dotenv import load_dotenv
 import os
-from typing import Dict, Any, Set, Optional
+from http import HTTPStatus
+from typing import Dict, Any, List, Set, Optional, Tuple
 from websockets.server import serve
-from llama_index.core.workflow import Context
-from llama_index.llms.openai import OpenAI
-from llama_index.tools.mcp import BasicMCPClient, McpToolSpec
-from llama_index.core.agent.workflow import (
-    AgentOutput,
-    ToolCall,
-    ToolCallResult,
-    FunctionAgent
-)
-from llama_index.core import Settings
+
+# llama-index and the modules built on it take seconds to import; they are
+# imported by init_agent_runtime() and in the functions using them, once the
+# server is already accepting connections.
+import metrics
+from asr import AudioTranscription, LocalVoskRecognizer, VoskServerRecognizer
+from codec import default_codec
+from event_log import EventLog
+from prefix import PrefixCacheStats, canonical_tools, prefix_fingerprint
+from response_cache import ResponseCache, conversation_key
+from routing import Route, build_router
+import scheduler
+from startup import Readiness
+from streaming import DeltaCoalescer
+from tools import is_write_tool, touched_spreadsheets
+from transport import EventSender, ThresholdDeflateFactory
+from usage import extract_usage
 
 
 load_dotenv()
@@ -32,19 +41,73 @@ logger = logging.getLogger(__name__)
 
 
 # WebSocket server settings
-WS_HOST = "0.0.0.0"
-WS_PORT = 8765
+WS_HOST = os.getenv("WS_HOST", "0.0.0.0")
+WS_PORT = int(os.getenv("WS_PORT", "8765"))
 
-llm = OpenAI(
-    model="gpt-4o-mini",
-    api_key=OPENAI_API_KEY
-)
-Settings.llm = llm
+# Compression: permessage-deflate, negotiated with clients that offer it, for
+# messages of at least WS_COMPRESSION_THRESHOLD bytes. "none" disables it.
+WS_COMPRESSION = os.getenv("WS_COMPRESSION", "deflate").lower()
+WS_COMPRESSION_THRESHOLD = int(os.getenv("WS_COMPRESSION_THRESHOLD", "1024"))
+# Keepalive: a ping every WS_PING_INTERVAL seconds, closing connections whose
+# pong takes longer than WS_PING_TIMEOUT (catches half-open sockets)
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "20"))
+WS_PING_TIMEOUT = float(os.getenv("WS_PING_TIMEOUT", "20"))
+# Slow consumers: once more than WS_MAX_BUFFERED_BYTES are queued for a
+# client, progress events are summarized or dropped according to
+# WS_SLOW_CONSUMER_POLICY ("summarize", "drop" or "wait") instead of blocking
+# the agent run, and a client that does not take a frame within
+# WS_SEND_TIMEOUT seconds is disconnected.
+WS_MAX_BUFFERED_BYTES = int(os.getenv("WS_MAX_BUFFERED_BYTES", str(1024 * 1024)))
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "summarize").lower()
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "30"))
+
+# Event batching: clients that advertise the "batch" capability on login get
+# batchable events coalesced into array frames within this window. 0 disables.
+WS_BATCH_WINDOW_MS = float(os.getenv("WS_BATCH_WINDOW_MS", "5"))
+WS_BATCH_MAX_EVENTS = int(os.getenv("WS_BATCH_MAX_EVENTS", "64"))
+# Token streaming: clients with the "delta" capability receive `agent_delta`
+# events, coalesced so that at most one goes out per interval per task.
+WS_DELTA_INTERVAL_MS = float(os.getenv("WS_DELTA_INTERVAL_MS", "100"))
+SERVER_CAPABILITIES = {"delta"}
+if WS_BATCH_WINDOW_MS > 0:
+    SERVER_CAPABILITIES.add("batch")
+
+# Voice messages: `audio_request` is followed by binary frames of audio that
+# are streamed to Vosk while they arrive. ASR_BACKEND is "vosk_server" (the
+# WebSocket server at VOSK_SERVER_URL), "vosk" (in process, VOSK_MODEL_PATH)
+# or "none". Audio other than raw PCM is decoded through an ffmpeg pipe.
+ASR_BACKEND = os.getenv("ASR_BACKEND", "vosk_server").lower()
+VOSK_SERVER_URL = os.getenv("VOSK_SERVER_URL", "ws://vosk:2700")
+VOSK_MODEL_PATH = os.getenv("VOSK_MODEL_PATH", "model")
+ASR_SAMPLE_RATE = int(os.getenv("ASR_SAMPLE_RATE", "16000"))
+ASR_MAX_AUDIO_BYTES = int(os.getenv("ASR_MAX_AUDIO_BYTES", str(20 * 1024 * 1024)))
+ASR_FINAL_TIMEOUT = float(os.getenv("ASR_FINAL_TIMEOUT", "15"))
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+if ASR_BACKEND != "none":
+    SERVER_CAPABILITIES.add("audio")
 
-mcp_client = BasicMCPClient("http://host.docker.internal:8000/sse")
-mcp_tools = McpToolSpec(client=mcp_client)
+# LLM backends, configured through LLM_ROUTES (see routing.py). Without it a
+# single gpt-4o-mini route is used, as before. Built by init_agent_runtime().
+router = None
+llm = None
 
-logger.debug(mcp_tools.to_tool_list())
+MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "http://host.docker.internal:8000/sse")
+# Tool calls the MCP server did not answer are repeated up to MCP_TOOL_RETRIES
+# times, MCP_TOOL_RETRY_INTERVAL seconds apart (doubling); writes only with
+# the idempotency key of their first attempt (see mcp_client.py).
+MCP_TOOL_RETRIES = int(os.getenv("MCP_TOOL_RETRIES", "2"))
+MCP_TOOL_RETRY_INTERVAL = float(os.getenv("MCP_TOOL_RETRY_INTERVAL", "0.5"))
+mcp_client = None
+mcp_tools = None
+
+# Startup: the server listens right away while llama-index is imported, the
+# LLM routes are built and the MCP tool list is fetched (retried with backoff
+# until the MCP server answers). GET /ready answers 200 once all of it is
+# done; a login arriving before waits up to STARTUP_LOGIN_WAIT seconds.
+STARTUP_LOGIN_WAIT = float(os.getenv("STARTUP_LOGIN_WAIT", "30"))
+STARTUP_RETRY_INTERVAL = float(os.getenv("STARTUP_RETRY_INTERVAL", "1"))
+STARTUP_MAX_RETRY_INTERVAL = float(os.getenv("STARTUP_MAX_RETRY_INTERVAL", "30"))
+readiness = Readiness(["runtime", "mcp_tools"])
 
 SYSTEM_PROMPT = """\
 You are an AI assistant for Tool Calling.
@@ -52,28 +115,160 @@ You are an AI assistant for Tool Calling.
 Before you help a user, you need to work with tools to interact with Google Sheets
 """
 
+# Session lifetime: idle sessions (no running task) are closed after
+# SESSION_IDLE_TIMEOUT seconds, tasks running longer than SESSION_TASK_TIMEOUT
+# are treated as stuck and cancelled. The reaper runs every SESSION_REAP_INTERVAL.
+SESSION_IDLE_TIMEOUT = float(os.getenv("SESSION_IDLE_TIMEOUT", "1800"))
+SESSION_TASK_TIMEOUT = float(os.getenv("SESSION_TASK_TIMEOUT", "900"))
+SESSION_REAP_INTERVAL = float(os.getenv("SESSION_REAP_INTERVAL", "60"))
+# How long a cancelled agent run may take to tear down its LLM and MCP calls
+AGENT_CANCEL_TIMEOUT = float(os.getenv("AGENT_CANCEL_TIMEOUT", "5"))
+# Chat history bounds: the LLM sees at most CHAT_HISTORY_TOKEN_LIMIT tokens and
+# at most CHAT_HISTORY_MAX_MESSAGES messages are kept per session.
+CHAT_HISTORY_TOKEN_LIMIT = int(os.getenv("CHAT_HISTORY_TOKEN_LIMIT", "16000"))
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "40"))
+
+# Tool results rendered longer than TOOL_RESULT_COMPACT_CHARS are summarized
+# before they reach the LLM and the client; the full payload stays in a shared
+# store (bounded by TOOL_RESULT_STORE_BYTES) the agent can page through.
+TOOL_RESULT_COMPACTION = os.getenv("TOOL_RESULT_COMPACTION", "true").lower() == "true"
+TOOL_RESULT_COMPACT_CHARS = int(os.getenv("TOOL_RESULT_COMPACT_CHARS", "4000"))
+TOOL_RESULT_STORE_BYTES = int(os.getenv("TOOL_RESULT_STORE_BYTES", str(64 * 1024 * 1024)))
+tool_result_store = None
+
+# The tool list is fetched once and shared by all sessions, sorted by name,
+# so every LLM call starts with the same system prompt and tool schemas and
+# the provider's prompt cache can serve that prefix.
+agent_tools = None
+agent_tools_lock = asyncio.Lock()
+prefix_cache_stats = PrefixCacheStats()
+
+# Workspace prefetch: on login, the spreadsheet titles, sheet names and headers
+# of the folder are fetched in the background and added to the chat history
+# before the first turn, so the agent can skip its discovery tool calls.
+WORKSPACE_PREFETCH = os.getenv("WORKSPACE_PREFETCH", "false").lower() == "true"
+WORKSPACE_PREFETCH_MAX_SPREADSHEETS = int(os.getenv("WORKSPACE_PREFETCH_MAX_SPREADSHEETS", "20"))
+WORKSPACE_PREFETCH_TTL = float(os.getenv("WORKSPACE_PREFETCH_TTL", "300"))
+# How long the first request waits for a prefetch that is still running
+WORKSPACE_PREFETCH_WAIT = float(os.getenv("WORKSPACE_PREFETCH_WAIT", "3"))
+workspace_index = None
+
+# Structured log of client events, LLM calls and tool calls (JSON lines),
+# rotated by size; replay it offline with benchmarks/replay.py. Empty disables.
+EVENT_LOG_PATH = os.getenv("EVENT_LOG_PATH", "")
+EVENT_LOG_MAX_BYTES = int(os.getenv("EVENT_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+EVENT_LOG_BACKUPS = int(os.getenv("EVENT_LOG_BACKUPS", "5"))
+event_log = EventLog(EVENT_LOG_PATH, EVENT_LOG_MAX_BYTES, EVENT_LOG_BACKUPS)
+
+# Client events handle_client accepts; the others are counted as "unknown"
+CLIENT_EVENTS = {"login", "agent_request", "audio_request", "audio_end", "cancel_request", "logout", "stats"}
+
 # Store connected clients and their agents
 connected_clients = set()
 active_sessions = {}  # Maps session_id to {agent, context, tasks}
 
+# Plan-then-execute: in "plan" mode the LLM plans every tool call of a request
+# in one call, the plan runs in parallel where it can and a second call writes
+# the answer. A plan that is declined, invalid or fails midway hands over to
+# the step-wise agent. A request can pick its mode with "mode" in the
+# agent_request data; AGENT_EXECUTION_MODE is the default.
+AGENT_EXECUTION_MODE = os.getenv("AGENT_EXECUTION_MODE", "stepwise")
+PLAN_MAX_STEPS = int(os.getenv("PLAN_MAX_STEPS", "20"))
+
+# Fair-share scheduling: at most SCHED_MAX_LLM_CALLS LLM calls and
+# SCHED_MAX_TOOL_CALLS MCP tool calls run at once across all sessions (0: no
+# limit). Waiting calls are served by weighted fair queueing per user: the
+# `user_id` sent with login (the session otherwise). Weights are server
+# configuration, a JSON object of user_id -> weight in SCHED_USER_WEIGHTS;
+# users not in it, and sessions without a user_id, have weight 1.
+SCHED_MAX_LLM_CALLS = int(os.getenv("SCHED_MAX_LLM_CALLS", "16"))
+SCHED_MAX_TOOL_CALLS = int(os.getenv("SCHED_MAX_TOOL_CALLS", "32"))
+SCHED_USER_WEIGHTS = {
+    str(user_id): float(weight)
+    for user_id, weight in json.loads(os.getenv("SCHED_USER_WEIGHTS") or "{}").items()
+}
+if not all(weight > 0 for weight in SCHED_USER_WEIGHTS.values()):
+    raise ValueError("SCHED_USER_WEIGHTS: weights must be positive")
+scheduler.llm_calls.capacity = SCHED_MAX_LLM_CALLS
+scheduler.tool_calls.capacity = SCHED_MAX_TOOL_CALLS
+
+# Opt-in cache of answers to repeated read-only questions, shared by all sessions
+# (follow-ups only match within the same conversation, see response_cache.py)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "300")),
+    threshold=float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.92")),
+) if RESPONSE_CACHE_ENABLED else None
+
 class AgentSession:
     """Class to manage agent sessions"""
     
-    def __init__(self, session_id: str, agent, context):
+    def __init__(self, session_id: str, agent, memory, sender: Optional[EventSender] = None):
         self.session_id = session_id
         self.agent = agent
-        self.context = context
+        self.memory = memory
+        self.sender = sender
         self.active_tasks = {}  # Maps task_id to asyncio tasks
+        self.task_started = {}  # Maps task_id to monotonic start time
+        self.last_activity = time.monotonic()
+        self.workspace_prefetch = None  # Task fetching the workspace index
+        self.user = (session_id, 1.0)  # Fair-share key and weight of the session's runs
+        self.completed_turns = 0
+        
+    def touch(self):
+        """Record client activity on the session"""
+        self.last_activity = time.monotonic()
+        
+    def idle_seconds(self) -> float:
+        """Seconds since the last client activity"""
+        return time.monotonic() - self.last_activity
         
     def add_task(self, task_id: str, task: asyncio.Task):
         """Add a task to the session"""
         self.active_tasks[task_id] = task
+        self.task_started[task_id] = time.monotonic()
         
     def remove_task(self, task_id: str):
         """Remove a task from the session"""
         if task_id in self.active_tasks:
             del self.active_tasks[task_id]
+        self.task_started.pop(task_id, None)
+        
+    def stuck_tasks(self, timeout: float):
+        """Return ids of tasks running for longer than `timeout` seconds"""
+        now = time.monotonic()
+        return [task_id for task_id, started in self.task_started.items() if now - started > timeout]
+        
+    async def snapshot(self):
+        """The chat history to roll back to if the run about to start fails"""
+        # A copy: the chat store hands out its live message list
+        return self.completed_turns, list(await self.memory.aget_all())
+        
+    async def rollback(self, task_id: str, snapshot) -> bool:
+        """Restore the chat history of a snapshot after a cancelled or failed run.
+
+        Other runs of the session add to the same history, so it is left as
+        it is while one is still running or if one completed since the
+        snapshot. Returns whether the history was restored.
+        """
+        if snapshot is None:
+            return False
+        turns, history = snapshot
+        others = [other for other, task in self.active_tasks.items() if other != task_id and not task.done()]
+        if others or turns != self.completed_turns:
+            logger.info(f"Not rolling back the history of session {self.session_id} for task {task_id}, other runs used it")
+            return False
+        await self.memory.aset(history)
+        return True
+        
+    def cancel_tasks(self):
+        """Cancel all running tasks of the session"""
+        for task_id, task in list(self.active_tasks.items()):
+            if not task.done():
+                task.cancel()
             
+
     def has_active_tasks(self) -> bool:
         """Check if the session has any active tasks"""
         return len(self.active_tasks) > 0
@@ -82,61 +277,109 @@ async def handle_client(websocket):
     """Handle WebSocket client connection"""
     client_id = str(uuid.uuid4())
     connected_clients.add(websocket)
+    sender = EventSender(
+        websocket,
+        max_buffered_bytes=WS_MAX_BUFFERED_BYTES,
+        send_timeout=WS_SEND_TIMEOUT,
+        slow_consumer_policy=WS_SLOW_CONSUMER_POLICY
+    )
     session_id = None
+    audio = None  # Voice message receiving binary frames
     
     logger.info(f"Client {client_id} connected. Total clients: {len(connected_clients)}")
     
     try:
         async for message in websocket:
+            if isinstance(message, bytes):
+                # Binary frames carry the audio of the current audio_request
+                metrics.audio_bytes_received.inc(amount=len(message))
+                if audio is None:
+                    await sender.send("error", {"message": "Binary frame without an audio_request"})
+                else:
+                    await audio.put(message)
+                continue
             try:
                 # Parse incoming message
-                data = json.loads(message)
+                data = default_codec.loads(message)
                 event_type = data.get("event")
                 event_data = data.get("data", {})
                 
                 logger.info(f"Received event '{event_type}' from client {client_id}")
+                # Any name a client sends would otherwise become a metric label
+                metrics.events_received.inc(event_type if isinstance(event_type, str) and event_type in CLIENT_EVENTS else "unknown")
+                event_log.write("inbound", client=client_id, session=session_id, event=event_type, data=event_data)
+                if session_id in active_sessions:
+                    active_sessions[session_id].touch()
                 
                 # Process the event
                 if event_type == "login":
                     # Handle login request
-                    session_id = await handle_login(websocket, client_id, event_data)
-                    await websocket.send(json.dumps({
-                        "event": "login_response",
-                        "data": {"session_id": session_id, "status": "success"}
-                    }))
+                    session_id = await handle_login(sender, client_id, event_data)
+                    capabilities = negotiate_capabilities(event_data)
+                    sender.capabilities = capabilities
+                    await sender.send("login_response", {
+                        "session_id": session_id,
+                        "status": "success",
+                        "capabilities": sorted(capabilities)
+                    })
+                    if "batch" in capabilities:
+                        sender.enable_batching(WS_BATCH_WINDOW_MS, WS_BATCH_MAX_EVENTS)
                     
                 elif event_type == "agent_request":
                     # Check if client is logged in
                     print(session_id)
                     if not session_id or session_id not in active_sessions:
-                        await websocket.send(json.dumps({
-                            "event": "error",
-                            "data": {"message": "Not logged in or session expired"}
-                        }))
+                        await sender.send("error", {"message": "Not logged in or session expired"})
                         continue
                         
                     # Process agent request
                     message_content = event_data.get("message", "")
+                    mode = event_data.get("mode")
                     task_id = str(uuid.uuid4())
                     
                     # Start processing in a separate task
                     session = active_sessions[session_id]
                     task = asyncio.create_task(
                         process_agent_request(
-                            websocket, 
+                            sender, 
                             client_id, 
                             session_id, 
                             task_id, 
-                            message_content
+                            message_content,
+                            mode
                         )
                     )
                     session.add_task(task_id, task)
                     
                     # Respond that request is being processed
-                    await websocket.send(json.dumps({
-                        "event": "agent_request_received",
-                        "data": {"task_id": task_id}
-                    }))
+                    await sender.send("agent_request_received", {"task_id": task_id})
+                    
+                elif event_type == "audio_request":
+                    if not session_id or session_id not in active_sessions:
+                        await sender.send("error", {"message": "Not logged in or session expired"})
+                        continue
+                    if ASR_BACKEND == "none":
+                        await sender.send("error", {"message": "Speech recognition is disabled"})
+                        continue
+                    if audio is not None and not audio.closed and audio.ended_at is None:
+                        await sender.send("error", {"message": f"Audio request {audio.task_id} is still receiving audio"})
+                        continue
+                    
+                    task_id = str(uuid.uuid4())
+                    audio = create_audio_transcription(sender, task_id, event_data)
+                    session = active_sessions[session_id]
+                    task = asyncio.create_task(
+                        process_audio_request(sender, client_id, session_id, task_id, audio)
+                    )
+                    session.add_task(task_id, task)
+                    await sender.send("agent_request_received", {"task_id": task_id})
+                    
+                elif event_type == "audio_end":
+                    if audio is None:
+                        await sender.send("error", {"message": "No audio request in progress"})
+                        continue
+                    await audio.end()
+                    audio = None
                     
                 elif event_type == "cancel_request":
                     # Cancel a specific task
@@ -146,54 +389,31 @@ async def handle_client(websocket):
                         if task_id in session.active_tasks:
                             session.active_tasks[task_id].cancel()
                             session.remove_task(task_id)
-                            await websocket.send(json.dumps({
-                                "event": "request_cancelled",
-                                "data": {"task_id": task_id}
-                            }))
+                            await sender.send("request_cancelled", {"task_id": task_id})
                         else:
-                            await websocket.send(json.dumps({
-                                "event": "error",
-                                "data": {"message": f"Task {task_id} not found"}
-                            }))
+                            await sender.send("error", {"message": f"Task {task_id} not found"})
                     else:
-                        await websocket.send(json.dumps({
-                            "event": "error",
-                            "data": {"message": "Not logged in or session expired"}
-                        }))
+                        await sender.send("error", {"message": "Not logged in or session expired"})
                         
                 elif event_type == "logout":
                     # Handle logout request
                     if session_id and session_id in active_sessions:
-                        # Cancel all tasks
-                        session = active_sessions[session_id]
-                        for task_id, task in list(session.active_tasks.items()):
-                            task.cancel()
-                        # Remove session
-                        del active_sessions[session_id]
+                        end_session(session_id)
                         session_id = None
-                        await websocket.send(json.dumps({
-                            "event": "logout_response",
-                            "data": {"status": "success"}
-                        }))
+                        await sender.send("logout_response", {"status": "success"})
                     else:
-                        await websocket.send(json.dumps({
-                            "event": "error",
-                            "data": {"message": "Not logged in or session expired"}
-                        }))
+                        await sender.send("error", {"message": "Not logged in or session expired"})
+                        
+                elif event_type == "stats":
+                    await sender.send("stats_response", collect_stats())
                         
                 else:
                     # Handle unknown event type
-                    await websocket.send(json.dumps({
-                        "event": "error",
-                        "data": {"message": f"Unknown event type: {event_type}"}
-                    }))
+                    await sender.send("error", {"message": f"Unknown event type: {event_type}"})
                     
             except json.JSONDecodeError:
                 logger.error(f"Invalid JSON received from client {client_id}")
-                await websocket.send(json.dumps({
-                    "event": "error",
-                    "data": {"message": "Invalid JSON format"}
-                }))
+                await sender.send("error", {"message": "Invalid JSON format"})
                 
     except asyncio.CancelledError:
         logger.info(f"Connection with client {client_id} was cancelled")
@@ -201,29 +421,47 @@ async def handle_client(websocket):
         logger.error(f"Error handling client {client_id}: {str(e)}")
     finally:
         # Clean up on disconnect
+        await sender.close()
         connected_clients.remove(websocket)
         if session_id and session_id in active_sessions:
-            # Cancel all tasks
-            session = active_sessions[session_id]
-            for task_id, task in list(session.active_tasks.items()):
-                if not task.done():
-                    task.cancel()
-            # Remove session
-            del active_sessions[session_id]
+            end_session(session_id)
         logger.info(f"Client {client_id} disconnected. Remaining clients: {len(connected_clients)}")
 
-async def get_agent(tools: McpToolSpec):
-    tools = await tools.to_tool_list_async()
-    agent = FunctionAgent(
+def negotiate_capabilities(data: Dict[str, Any]) -> Set[str]:
+    """Return the optional protocol features both sides support.
+
+    Clients that send no "capabilities" list keep the original protocol:
+    one JSON object per frame.
+    """
+    requested = data.get("capabilities") or []
+    return SERVER_CAPABILITIES.intersection(requested)
+
+async def get_agent_tools(tool_spec):
+    """Return the shared, canonically ordered agent tool list"""
+    from compaction import CompactingTool, make_fetch_tool
+    global agent_tools
+    async with agent_tools_lock:
+        if agent_tools is None:
+            tools = await tool_spec.to_tool_list_async()
+            if TOOL_RESULT_COMPACTION:
+                tools = [CompactingTool(tool, tool_result_store, TOOL_RESULT_COMPACT_CHARS) for tool in tools]
+                tools.append(make_fetch_tool(tool_result_store, TOOL_RESULT_COMPACT_CHARS))
+            agent_tools = canonical_tools(tools)
+            logger.info(f"Loaded {len(agent_tools)} tools, prompt prefix {prefix_fingerprint(SYSTEM_PROMPT, agent_tools)}")
+    return agent_tools
+
+async def get_agent(tools):
+    from agent import ParallelFunctionAgent
+    agent = ParallelFunctionAgent(
         name="Agent",
         description="An agent that can work with Google Sheets.",
-        tools=tools,
+        tools=await get_agent_tools(tools),
         llm=llm,
         system_prompt=SYSTEM_PROMPT,
     )
     return agent
 
-async def handle_login(websocket, client_id: str, data: Dict[str, Any]) -> str:
+async def handle_login(sender: EventSender, client_id: str, data: Dict[str, Any]) -> str:
     """Handle login request and create agent instance"""
     # In a real application, you would validate credentials here
     # For this example, we'll create a new agent session for each login
@@ -232,129 +470,693 @@ async def handle_login(websocket, client_id: str, data: Dict[str, Any]) -> str:
     session_id = str(uuid.uuid4())
     
     try:
+        if not await readiness.wait(STARTUP_LOGIN_WAIT):
+            raise RuntimeError("Server is still starting up, try again shortly")
+        from session_memory import create_memory
+        
         # Create agent
         agent = await get_agent(mcp_tools)
         
-        # Create context
-        context = Context(agent)
+        # Create the bounded chat history its runs will use
+        memory = create_memory(CHAT_HISTORY_TOKEN_LIMIT)
         
         # Store the session
-        active_sessions[session_id] = AgentSession(session_id, agent, context)
+        session = AgentSession(session_id, agent, memory, sender)
+        session.user = login_user(session_id, data)
+        if workspace_index is not None:
+            session.workspace_prefetch = asyncio.create_task(workspace_index.get())
+        active_sessions[session_id] = session
         
         logger.info(f"Created new agent session {session_id} for client {client_id}")
         return session_id
         
     except Exception as e:
         logger.error(f"Error creating agent session: {str(e)}")
-        await websocket.send(json.dumps({
-            "event": "error",
-            "data": {"message": f"Failed to create agent session: {str(e)}"}
-        }))
+        await sender.send("error", {"message": f"Failed to create agent session: {str(e)}"})
         # Return a dummy session ID - client will receive error anyway
         return str(uuid.uuid4())
 
+def login_user(session_id: str, data: Dict[str, Any]) -> Tuple[str, float]:
+    """Fair-share key and weight of a login; the weight comes from SCHED_USER_WEIGHTS, not the client"""
+    user_id = data.get("user_id")
+    if not user_id:
+        return session_id, 1.0
+    return f"user:{user_id}", SCHED_USER_WEIGHTS.get(str(user_id), 1.0)
+
+def serialize_agent_event(event, task_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """Convert a workflow event to an (event_type, data) pair, or None to skip it"""
+    from llama_index.core.agent.workflow import AgentOutput, ToolCall, ToolCallResult
+    event_data = {"task_id": task_id}
+    
+    # ToolCallResult subclasses ToolCall, so it has to be checked first
+    if isinstance(event, ToolCallResult):
+        event_type = "tool_result"
+        # Convert tool output to string if possible
+        try:
+            tool_output = str(event.tool_output)
+        except Exception:
+            tool_output = "Non-serializable tool output"
+        event_data.update({
+            "tool_name": event.tool_name,
+            "tool_output": tool_output
+        })
+    elif isinstance(event, ToolCall):
+        event_type = "tool_call"
+        event_data.update({
+            "tool_name": event.tool_name,
+            "tool_kwargs": event.tool_kwargs
+        })
+    elif isinstance(event, AgentOutput):
+        event_type = "agent_output"
+        event_data.update({
+            "output": event.raw
+        })
+    else:
+        # Skip unknown event types
+        return None
+    
+    return event_type, event_data
+
+class AgentRun:
+    """Bookkeeping of a single agent run"""
+    
+    def __init__(self, route: Route, llm_steps: int = 0):
+        self.route = route
+        # LLM calls started for the task, including those of runs it retried
+        self.llm_steps = llm_steps
+        self.started = time.monotonic()
+        self.touched = set()  # Spreadsheets read or written during the run
+        self.wrote = False
+        self.tool_steps = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+async def send_delta(sender: EventSender, task_id: str, run: AgentRun, text: str):
+    """Send streamed text of the run's current LLM call.
+
+    `step` numbers the LLM calls of the task; text of a new step replaces
+    that of the previous one, e.g. a preamble to tool calls.
+    """
+    await sender.send("agent_delta", {"task_id": task_id, "step": run.llm_steps, "delta": text})
+
+def account_llm_call(
+    session: AgentSession,
+    task_id: str,
+    run: AgentRun,
+    seconds: float,
+    raw: Any,
+    content: Optional[str],
+    tool_calls: List[Dict[str, Any]]
+):
+    """Record the usage, latency and event log entry of an LLM call"""
+    usage = extract_usage(raw)
+    run.prompt_tokens += usage["prompt_tokens"]
+    run.completion_tokens += usage["completion_tokens"]
+    prefix_cache_stats.record(usage["prompt_tokens"], usage["cached_tokens"])
+    metrics.llm_duration.observe(seconds, run.route.name)
+    for kind in ("prompt", "completion", "cached"):
+        metrics.llm_tokens.inc(run.route.name, kind, amount=usage[f"{kind}_tokens"])
+    event_log.write(
+        "llm_call",
+        session=session.session_id,
+        task=task_id,
+        route=run.route.name,
+        seconds=round(seconds, 4),
+        usage=usage,
+        content=content,
+        tool_calls=tool_calls
+    )
+
+def note_tool_call(run: AgentRun, tool_name: str, tool_kwargs: Dict[str, Any]):
+    """Track the spreadsheets a run touches and drop caches its writes make stale"""
+    spreadsheet_ids = touched_spreadsheets(tool_name, tool_kwargs)
+    run.touched.update(spreadsheet_ids)
+    if is_write_tool(tool_name):
+        run.wrote = True
+        if workspace_index is not None:
+            workspace_index.invalidate()
+        if response_cache is not None:
+            # Bumped on both the call and its result so that an
+            # answer stored while the write was running goes stale
+            response_cache.invalidate(spreadsheet_ids)
+
+def account_tool_result(
+    session: AgentSession,
+    task_id: str,
+    run: AgentRun,
+    tool_id: str,
+    tool_name: str,
+    seconds: float,
+    output: Any
+):
+    """Record the latency, errors and event log entry of a tool call"""
+    metrics.tool_duration.observe(seconds, tool_name)
+    if output.is_error:
+        metrics.tool_errors.inc(tool_name)
+    event_log.write(
+        "tool_result",
+        session=session.session_id,
+        task=task_id,
+        id=tool_id,
+        name=tool_name,
+        seconds=round(seconds, 4),
+        is_error=output.is_error,
+        output=output.content
+    )
+    run.tool_steps += 1
+
+async def stream_agent_run(
+    sender: EventSender,
+    session: AgentSession,
+    task_id: str,
+    message_content: str,
+    run: AgentRun
+):
+    """Run the agent once, streaming its events to the client"""
+    from llama_index.core.agent.workflow import AgentInput, AgentOutput, AgentStream, ToolCall, ToolCallResult
+    from llama_index.core.workflow import Context
+    # A copy of the session's agent on the run's route: other runs of the
+    # session keep theirs. FunctionAgent reads `llm` on every step, which is
+    # also what lets the run escalate midway.
+    agent = session.agent.model_copy(update={"llm": run.route.llm})
+    
+    # Create custom event handler to stream events to the client
+    # The workflow context is the run's own: runs of a session may overlap,
+    # and a cancelled one leaves its scratchpad and queued events behind.
+    # What carries over between turns is the chat history in the memory.
+    handler = agent.run(message_content, ctx=Context(agent), memory=session.memory)
+    deltas = DeltaCoalescer(WS_DELTA_INTERVAL_MS / 1000.0) if "delta" in sender.capabilities else None
+    llm_started = time.monotonic()
+    tools_started = {}
+    
+    # Stream events to the client
+    try:
+        async for event in handler.stream_events():
+            if isinstance(event, AgentInput):
+                llm_started = time.monotonic()
+                run.llm_steps += 1
+                continue
+            if isinstance(event, AgentStream):
+                if deltas is not None:
+                    text = deltas.add(event.delta)
+                    if text:
+                        await send_delta(sender, task_id, run, text)
+                continue
+            if isinstance(event, AgentOutput):
+                account_llm_call(
+                    session, task_id, run, time.monotonic() - llm_started, event.raw, event.response.content,
+                    [{"id": call.tool_id, "name": call.tool_name, "kwargs": call.tool_kwargs} for call in event.tool_calls]
+                )
+                if deltas is not None:
+                    # End of an LLM step: release the tail before the step output
+                    text = deltas.drain()
+                    if text:
+                        await send_delta(sender, task_id, run, text)
+                    deltas.reset()
+            
+            if isinstance(event, ToolCall) and not isinstance(event, ToolCallResult):
+                tools_started[event.tool_id] = time.monotonic()
+                event_log.write("tool_call", session=session.session_id, task=task_id, id=event.tool_id, name=event.tool_name, kwargs=event.tool_kwargs)
+                
+            if isinstance(event, ToolCall):
+                note_tool_call(run, event.tool_name, event.tool_kwargs)
+                    
+            if isinstance(event, ToolCallResult):
+                # Includes the time spent waiting on earlier calls of the turn
+                seconds = time.monotonic() - tools_started.pop(event.tool_id, time.monotonic())
+                account_tool_result(session, task_id, run, event.tool_id, event.tool_name, seconds, event.tool_output)
+                stronger = router.escalation_for(run.route)
+                if stronger is not None and run.tool_steps > router.escalate_after_tool_steps:
+                    logger.info(f"Task {task_id} escalated from '{run.route.name}' to '{stronger.name}' after {run.tool_steps} tool steps")
+                    run.route.escalations += 1
+                    run.route = stronger
+                    agent.llm = stronger.llm
+            
+            serialized = serialize_agent_event(event, task_id)
+            if serialized is None:
+                continue
+            
+            # Send event to client
+            await sender.send(*serialized)
+    except BaseException:
+        # Cancelled or failed on our side: the workflow runs in tasks of its
+        # own and would otherwise keep calling the LLM and tools
+        await stop_agent_run(handler)
+        raise
+        
+    # Get final response
+    return await handler
+
+async def planned_llm_call(
+    sender: EventSender,
+    session: AgentSession,
+    task_id: str,
+    run: AgentRun,
+    messages: List[Any],
+    stream: bool = False
+) -> str:
+    """One LLM call of a planned run, streamed to the client as agent_delta if `stream`"""
+    deltas = DeltaCoalescer(WS_DELTA_INTERVAL_MS / 1000.0) if stream and "delta" in sender.capabilities else None
+    started = time.monotonic()
+    response = None
+    run.llm_steps += 1
+    async with scheduler.llm_calls.slot():
+        async for response in await run.route.llm.astream_chat(messages):
+            text = deltas.add(response.delta or "") if deltas is not None else None
+            if text:
+                await send_delta(sender, task_id, run, text)
+    if deltas is not None:
+        text = deltas.drain()
+        if text:
+            await send_delta(sender, task_id, run, text)
+    content = (response.message.content if response is not None else None) or ""
+    account_llm_call(session, task_id, run, time.monotonic() - started, getattr(response, "raw", None), content, [])
+    return content
+
+async def run_planned(
+    sender: EventSender,
+    session: AgentSession,
+    task_id: str,
+    message_content: str,
+    run: AgentRun
+) -> Optional[str]:
+    """Answer with a planning and a summary LLM call, or return None for the step-wise agent to take over"""
+    import planner
+    from agent import PARALLEL_TOOL_WORKERS
+    from llama_index.core.llms import ChatMessage
+    
+    tools = await get_agent_tools(mcp_tools)
+    history = await session.memory.aget()
+    request = ChatMessage(role="user", content=message_content)
+    
+    async def on_result(result):
+        event_log.write("tool_call", session=session.session_id, task=task_id, id=result.step.id, name=result.step.tool, kwargs=result.kwargs)
+        note_tool_call(run, result.step.tool, result.kwargs)
+        account_tool_result(session, task_id, run, result.step.id, result.step.tool, result.seconds, result.output)
+        await sender.send("tool_call", {"task_id": task_id, "tool_name": result.step.tool, "tool_kwargs": result.kwargs})
+        await sender.send("tool_result", {"task_id": task_id, "tool_name": result.step.tool, "tool_output": str(result.output)})
+    
+    try:
+        # The system prompt and tool list come first and stay the same, so the
+        # provider's prompt cache serves them as it does for the agent
+        reply = await planned_llm_call(sender, session, task_id, run, [
+            ChatMessage(role="system", content=f"{SYSTEM_PROMPT}\n{planner.PLAN_INSTRUCTIONS}{planner.describe_tools(tools)}"),
+            *history,
+            request
+        ])
+        plan = planner.parse_plan(reply, tools, PLAN_MAX_STEPS)
+        if plan.answer is not None:
+            answer = plan.answer
+        else:
+            for step in plan.steps:
+                note_tool_call(run, step.tool, step.args)
+            results = await planner.execute_plan(plan, tools, PARALLEL_TOOL_WORKERS, on_result)
+            logger.info(f"Task {task_id} ran a plan of {len(plan.steps)} tool calls")
+            answer = await planned_llm_call(sender, session, task_id, run, [
+                ChatMessage(role="system", content=SYSTEM_PROMPT),
+                *history,
+                request,
+                ChatMessage(role="system", content=planner.summary_prompt(results))
+            ], stream=True)
+    except planner.PlanDeclined:
+        logger.info(f"Task {task_id}: the LLM asked to work step by step")
+        return None
+    except planner.StepFailed as e:
+        logger.warning(f"Task {task_id}: {str(e)}, continuing step by step")
+        # Tell the agent what already ran so it does not repeat writes
+        await session.memory.aput(ChatMessage(role="system", content=planner.partial_progress(e)))
+        return None
+    except Exception as e:
+        if run.wrote:
+            raise
+        logger.warning(f"Task {task_id}: planning failed ({str(e)}), continuing step by step")
+        return None
+    
+    await session.memory.aput_messages([request, ChatMessage(role="assistant", content=answer)])
+    return answer
+
+async def stop_agent_run(handler):
+    """Cancel a workflow run and wait until its steps are torn down.
+
+    Cancelling the step tasks aborts the streamed LLM response and the MCP
+    calls they are awaiting.
+    """
+    if handler.done():
+        return
+    await handler.cancel_run()
+    await asyncio.wait([handler], timeout=AGENT_CANCEL_TIMEOUT)
+    if not handler.done():
+        logger.warning(f"Agent run did not stop within {AGENT_CANCEL_TIMEOUT}s")
+    elif not handler.cancelled():
+        handler.exception()  # Mark the expected WorkflowCancelledByUser as retrieved
+
+async def inject_workspace_index(session: AgentSession):
+    """Add the prefetched workspace index to the history before the first turn"""
+    prefetch = session.workspace_prefetch
+    if prefetch is None:
+        return
+    session.workspace_prefetch = None
+    
+    if not prefetch.done():
+        await asyncio.wait([prefetch], timeout=WORKSPACE_PREFETCH_WAIT)
+    if not prefetch.done():
+        logger.info(f"Workspace prefetch for session {session.session_id} still running, skipping it")
+        return
+    if prefetch.cancelled() or prefetch.exception() is not None:
+        logger.warning(f"Workspace prefetch for session {session.session_id} failed: {prefetch.exception() if not prefetch.cancelled() else 'cancelled'}")
+        return
+    
+    index = prefetch.result()
+    if index:
+        from llama_index.core.llms import ChatMessage
+        await session.memory.aput(ChatMessage(role="system", content=index))
+
+def create_audio_transcription(sender: EventSender, task_id: str, data: Dict[str, Any]) -> AudioTranscription:
+    """Set up speech recognition of a voice message announced by audio_request"""
+    async def on_update(text: str):
+        await sender.send("transcript_partial", {"task_id": task_id, "text": text})
+    
+    if ASR_BACKEND == "vosk":
+        recognizer = LocalVoskRecognizer(VOSK_MODEL_PATH, on_update)
+    else:
+        recognizer = VoskServerRecognizer(VOSK_SERVER_URL, on_update, ASR_FINAL_TIMEOUT)
+    audio_format = str(data.get("format", "pcm")).lower()
+    # Raw PCM is recognized at the client's sample rate, anything else is
+    # resampled by ffmpeg
+    sample_rate = int(data.get("sample_rate") or ASR_SAMPLE_RATE) if audio_format == "pcm" else ASR_SAMPLE_RATE
+    return AudioTranscription(
+        task_id,
+        recognizer,
+        audio_format=audio_format,
+        sample_rate=sample_rate,
+        max_bytes=ASR_MAX_AUDIO_BYTES,
+        ffmpeg=FFMPEG_BINARY,
+        final_timeout=ASR_FINAL_TIMEOUT,
+    )
+
+async def process_audio_request(
+    sender: EventSender,
+    client_id: str,
+    session_id: str,
+    task_id: str,
+    audio: AudioTranscription
+):
+    """Transcribe a voice message as it is uploaded, then run the agent on it.
+
+    Recognition overlaps the upload, so once `audio_end` arrives only the
+    last utterance is left to finalize before the agent starts. The agent
+    does not start on a partial transcript (see README_WEBSOCKET.md).
+    """
+    transcript = None
+    try:
+        transcript = (await audio.run()).strip()
+        metrics.asr_finalize_duration.observe(audio.finalize_seconds)
+        logger.info(f"Transcribed task {task_id} in {audio.finalize_seconds:.3f}s after the end of the audio")
+        if not transcript:
+            await sender.send("error", {"task_id": task_id, "message": "No speech recognized"})
+    except asyncio.CancelledError:
+        logger.info(f"Audio task {task_id} cancelled for client {client_id}")
+        await sender.send("task_cancelled", {"task_id": task_id})
+    except Exception as e:
+        logger.error(f"Speech recognition failed for task {task_id}: {str(e)}")
+        await sender.send("error", {
+            "task_id": task_id,
+            "message": f"Speech recognition failed: {str(e)}"
+        })
+    
+    if not transcript:
+        if session_id in active_sessions:
+            active_sessions[session_id].remove_task(task_id)
+        return
+    
+    await sender.send("transcript", {"task_id": task_id, "text": transcript})
+    await process_agent_request(sender, client_id, session_id, task_id, transcript)
+
 async def process_agent_request(
-    websocket,
+    sender: EventSender,
     client_id: str,
     session_id: str,
     task_id: str,
-    message_content: str
+    message_content: str,
+    mode: Optional[str] = None
 ):
     """Process an agent request in a separate task"""
+    snapshot = None
+    started = time.monotonic()
+    status = "error"
+    response_text = None
+    event_log.write("run_start", session=session_id, task=task_id, message=message_content)
     try:
         if session_id not in active_sessions:
-            await websocket.send(json.dumps({
-                "event": "error",
-                "data": {
-                    "task_id": task_id,
-                    "message": "Session expired"
-                }
-            }))
+            await sender.send("error", {
+                "task_id": task_id,
+                "message": "Session expired"
+            })
             return
             
         session = active_sessions[session_id]
-        agent = session.agent
-        context = session.context
+        # LLM and tool calls of this run are scheduled on behalf of the session's user
+        scheduler.current_user.set(session.user)
         
-        # Create custom event handler to stream events to the client
-        handler = agent.run(message_content, ctx=context)
-        
-        # Stream events to the client
-        async for event in handler.stream_events():
-            # Convert event to JSON-serializable format
-            event_data = {"task_id": task_id}
-            
-            if isinstance(event, ToolCall):
-                event_type = "tool_call"
-                event_data.update({
-                    "tool_name": event.tool_name,
-                    "tool_kwargs": event.tool_kwargs
-                })
-            elif isinstance(event, ToolCallResult):
-                event_type = "tool_result"
-                # Convert tool output to string if possible
-                try:
-                    tool_output = str(event.tool_output)
-                except:
-                    tool_output = "Non-serializable tool output"
-                event_data.update({
-                    "tool_name": event.tool_name,
-                    "tool_output": tool_output
-                })
-            elif isinstance(event, AgentOutput):
-                event_type = "agent_output"
-                event_data.update({
-                    "output": event.raw
+        # Answers to follow-up questions depend on the session's earlier turns
+        context = conversation_key(await session.memory.aget_all()) if response_cache is not None else ""
+        if response_cache is not None:
+            cached = response_cache.lookup(message_content, context)
+            if cached is not None:
+                from llama_index.core.llms import ChatMessage
+                logger.info(f"Serving task {task_id} from the response cache")
+                status, response_text = "cached", cached
+                await session.memory.aput_messages([
+                    ChatMessage(role="user", content=message_content),
+                    ChatMessage(role="assistant", content=cached)
+                ])
+                session.completed_turns += 1
+                await sender.send("agent_response", {
+                    "task_id": task_id,
+                    "response": cached,
+                    "cached": True
                 })
-            else:
-                # Skip unknown event types
-                continue
-                
-            # Send event to client
-            await websocket.send(json.dumps({
-                "event": event_type,
-                "data": event_data
-            }))
-            
-        # Get final response
-        response = await handler
+                return
+        
+        await inject_workspace_index(session)
+        
+        snapshot = await session.snapshot()
+        run = AgentRun(router.route_for(message_content))
+        response = None
+        if (mode or AGENT_EXECUTION_MODE) == "plan":
+            response = await run_planned(sender, session, task_id, message_content, run)
+            if response is not None:
+                router.record(run.route, time.monotonic() - run.started, run.prompt_tokens, run.completion_tokens, ok=True)
+        while response is None:
+            try:
+                response = await stream_agent_run(sender, session, task_id, message_content, run)
+                router.record(run.route, time.monotonic() - run.started, run.prompt_tokens, run.completion_tokens, ok=True)
+            except Exception as e:
+                router.record(run.route, time.monotonic() - run.started, run.prompt_tokens, run.completion_tokens, ok=False)
+                stronger = router.escalation_for(run.route)
+                # Only retry runs that changed nothing, on a clean history
+                if stronger is None or run.wrote or not await session.rollback(task_id, snapshot):
+                    raise
+                logger.warning(f"Task {task_id} failed on '{run.route.name}' ({str(e)}), retrying on '{stronger.name}'")
+                run.route.escalations += 1
+                run = AgentRun(stronger, run.llm_steps)
+        
+        session.completed_turns += 1
+        from session_memory import trim_history
+        dropped = await trim_history(session.memory, CHAT_HISTORY_MAX_MESSAGES)
+        if dropped:
+            logger.debug(f"Dropped {dropped} old messages from session {session_id}")
+        
+        if response_cache is not None and not run.wrote:
+            response_cache.store(message_content, str(response), run.touched, context)
+        
+        status, response_text = "ok", str(response)
         
         # Send final response to client
-        await websocket.send(json.dumps({
-            "event": "agent_response",
-            "data": {
-                "task_id": task_id,
-                "response": str(response)
-            }
-        }))
+        await sender.send("agent_response", {
+            "task_id": task_id,
+            "response": str(response)
+        })
         
     except asyncio.CancelledError:
         # Task was cancelled
         logger.info(f"Task {task_id} cancelled for client {client_id}")
-        await websocket.send(json.dumps({
-            "event": "task_cancelled",
-            "data": {"task_id": task_id}
-        }))
+        status = "cancelled"
+        if session_id in active_sessions:
+            await active_sessions[session_id].rollback(task_id, snapshot)
+        await sender.send("task_cancelled", {"task_id": task_id})
     except Exception as e:
         # Handle any errors
         logger.error(f"Error processing request {task_id} for client {client_id}: {str(e)}")
-        await websocket.send(json.dumps({
-            "event": "error",
-            "data": {
-                "task_id": task_id,
-                "message": f"Error processing request: {str(e)}"
-            }
-        }))
+        if session_id in active_sessions:
+            await active_sessions[session_id].rollback(task_id, snapshot)
+        await sender.send("error", {
+            "task_id": task_id,
+            "message": f"Error processing request: {str(e)}"
+        })
     finally:
+        seconds = time.monotonic() - started
+        metrics.runs.inc(status)
+        metrics.run_duration.observe(seconds, status)
+        event_log.write(
+            "run_end",
+            session=session_id,
+            task=task_id,
+            status=status,
+            seconds=round(seconds, 4),
+            response=response_text
+        )
         # Remove task from active tasks
         if session_id in active_sessions:
             active_sessions[session_id].remove_task(task_id)
 
+def end_session(session_id: str):
+    """Cancel the tasks of a session and forget it"""
+    session = active_sessions.pop(session_id, None)
+    if session is not None:
+        session.cancel_tasks()
+
+def collect_stats() -> Dict[str, Any]:
+    """Report sessions and the memory held by their chat histories"""
+    sessions = []
+    if active_sessions:
+        from session_memory import estimate_memory_bytes
+    for session in active_sessions.values():
+        sessions.append({
+            "session_id": session.session_id,
+            "active_tasks": len(session.active_tasks),
+            "idle_seconds": round(session.idle_seconds(), 1),
+            "history_messages": len(session.memory.get_all()),
+            "history_bytes": estimate_memory_bytes(session.memory)
+        })
+    return {
+        "connected_clients": len(connected_clients),
+        "session_count": len(sessions),
+        "active_tasks": sum(s["active_tasks"] for s in sessions),
+        "history_bytes": sum(s["history_bytes"] for s in sessions),
+        "sessions": sessions,
+        "routes": router.stats() if router is not None else {},
+        "prompt_cache": prefix_cache_stats.stats(),
+        "scheduler": {"llm": scheduler.llm_calls.stats(), "mcp": scheduler.tool_calls.stats()},
+        "startup": readiness.to_json()
+    }
+
+async def reap_sessions():
+    """Periodically close idle sessions and cancel stuck tasks.
+
+    Catches half-open connections and hung tasks that would otherwise keep
+    an agent and its chat history alive until the socket finally errors out.
+    """
+    while True:
+        await asyncio.sleep(SESSION_REAP_INTERVAL)
+        for session_id, session in list(active_sessions.items()):
+            for task_id in session.stuck_tasks(SESSION_TASK_TIMEOUT):
+                logger.warning(f"Cancelling task {task_id} of session {session_id}: running for over {SESSION_TASK_TIMEOUT}s")
+                session.active_tasks[task_id].cancel()
+                session.remove_task(task_id)
+                
+            if session.has_active_tasks() or session.idle_seconds() < SESSION_IDLE_TIMEOUT:
+                continue
+                
+            logger.info(f"Closing session {session_id}: idle for {session.idle_seconds():.0f}s")
+            end_session(session_id)
+            if session.sender is not None:
+                try:
+                    await session.sender.websocket.close(code=1001, reason="Session idle timeout")
+                except Exception as e:
+                    logger.debug(f"Error closing idle connection: {str(e)}")
+
+# Server state sampled when /metrics is scraped
+metrics.registry.gauge("agent_connected_clients", "Open WebSocket connections", fn=lambda: len(connected_clients))
+metrics.registry.gauge("agent_active_sessions", "Logged in sessions", fn=lambda: len(active_sessions))
+metrics.registry.gauge(
+    "agent_active_tasks", "Agent requests in progress",
+    fn=lambda: sum(len(s.active_tasks) for s in active_sessions.values())
+)
+metrics.registry.gauge(
+    "agent_ws_pending_events", "Events waiting for a batch frame or in outboxes",
+    fn=lambda: sum(s.sender.pending_events for s in active_sessions.values() if s.sender is not None)
+)
+metrics.registry.gauge(
+    "agent_ws_buffered_bytes", "Bytes queued for clients, in outboxes and socket buffers",
+    fn=lambda: sum(s.sender.buffered_bytes() for s in active_sessions.values() if s.sender is not None)
+)
+metrics.registry.gauge("agent_llm_calls_active", "LLM calls holding a scheduler slot", fn=lambda: scheduler.llm_calls.active)
+metrics.registry.gauge("agent_llm_calls_waiting", "LLM calls queued for a scheduler slot", fn=lambda: scheduler.llm_calls.waiting_count)
+metrics.registry.gauge("agent_mcp_calls_active", "MCP tool calls holding a scheduler slot", fn=lambda: scheduler.tool_calls.active)
+metrics.registry.gauge("agent_mcp_calls_waiting", "MCP tool calls queued for a scheduler slot", fn=lambda: scheduler.tool_calls.waiting_count)
+metrics.registry.gauge("agent_tool_result_store_bytes", "Bytes held by compacted tool results", fn=lambda: tool_result_store.size if tool_result_store is not None else 0)
+
+async def process_http_request(path: str, request_headers):
+    """Serve plain HTTP endpoints next to the WebSocket on the same port"""
+    if path == "/stats":
+        body = default_codec.dumps(collect_stats()).encode("utf-8")
+        return HTTPStatus.OK, [("Content-Type", "application/json")], body
+    if path == "/metrics":
+        body = metrics.registry.render().encode("utf-8")
+        return HTTPStatus.OK, [("Content-Type", "text/plain; version=0.0.4; charset=utf-8")], body
+    if path == "/ready":
+        status = HTTPStatus.OK if readiness.ready else HTTPStatus.SERVICE_UNAVAILABLE
+        body = default_codec.dumps(readiness.to_json()).encode("utf-8")
+        return status, [("Content-Type", "application/json")], body
+    return None
+
+def init_agent_runtime():
+    """Import llama-index and build the LLM routes and MCP client (blocking)"""
+    global router, llm, mcp_client, mcp_tools, tool_result_store, workspace_index
+    from llama_index.core import Settings
+    from llama_index.tools.mcp import McpToolSpec
+    from agent import ParallelFunctionAgent  # noqa: F401 -- warm the import for the first login
+    from compaction import ToolResultStore
+    from mcp_client import CancellableMCPClient
+    from workspace import WorkspaceIndex
+    
+    router = build_router(OPENAI_API_KEY)
+    llm = router.default.llm
+    Settings.llm = llm
+    mcp_client = CancellableMCPClient(MCP_SERVER_URL, retries=MCP_TOOL_RETRIES, retry_interval=MCP_TOOL_RETRY_INTERVAL)
+    mcp_tools = McpToolSpec(client=mcp_client)
+    tool_result_store = ToolResultStore(TOOL_RESULT_STORE_BYTES)
+    workspace_index = WorkspaceIndex(
+        mcp_client,
+        max_spreadsheets=WORKSPACE_PREFETCH_MAX_SPREADSHEETS,
+        ttl=WORKSPACE_PREFETCH_TTL,
+    ) if WORKSPACE_PREFETCH else None
+
+async def start_agent_runtime():
+    """Run the startup stages in the background of a listening server"""
+    async def runtime():
+        await asyncio.to_thread(init_agent_runtime)
+    
+    async def tools():
+        # Fetches and caches the shared tool list, so the first login does not
+        await get_agent_tools(mcp_tools)
+    
+    await readiness.run_stage("runtime", runtime, STARTUP_RETRY_INTERVAL, STARTUP_MAX_RETRY_INTERVAL)
+    await readiness.run_stage("mcp_tools", tools, STARTUP_RETRY_INTERVAL, STARTUP_MAX_RETRY_INTERVAL)
+
 async def start_server():
     """Start the WebSocket server"""
-    async with serve(handle_client, WS_HOST, WS_PORT):
-        logger.info(f"WebSocket server started on {WS_HOST}:{WS_PORT}")
-        await asyncio.Future()  # Run forever
+    reaper = asyncio.create_task(reap_sessions())
+    startup = None
+    try:
+        async with serve(
+            handle_client,
+            WS_HOST,
+            WS_PORT,
+            process_request=process_http_request,
+            compression=None,
+            extensions=[ThresholdDeflateFactory(WS_COMPRESSION_THRESHOLD)] if WS_COMPRESSION == "deflate" else None,
+            ping_interval=WS_PING_INTERVAL or None,
+            ping_timeout=WS_PING_TIMEOUT or None,
+        ):
+            logger.info(f"WebSocket server started on {WS_HOST}:{WS_PORT}")
+            startup = asyncio.create_task(start_agent_runtime())
+            await asyncio.Future()  # Run forever
+    finally:
+        reaper.cancel()
+        if startup is not None:
+            startup.cancel()
 
 def run_server():
     """Entry point to run the WebSocket server"""
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from compaction import extract_payload
+
+logger = logging.getLogger(__name__)
+
+
+def build_index(spreadsheets: List[Dict[str, Any]], summaries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Combine list_spreadsheets and get_multiple_spreadsheet_summary results"""
+    by_id = {summary.get("spreadsheet_id"): summary for summary in summaries if isinstance(summary, dict)}
+    index = []
+    for spreadsheet in spreadsheets:
+        summary = by_id.get(spreadsheet["id"], {})
+        index.append({
+            "id": spreadsheet["id"],
+            "title": summary.get("title") or spreadsheet.get("title"),
+            "sheets": [
+                {"title": sheet.get("title"), "headers": sheet.get("headers") or []}
+                for sheet in summary.get("sheets") or []
+            ],
+        })
+    return index
+
+
+def render_index(index: List[Dict[str, Any]], total: int) -> str:
+    """Render the index as a compact system message"""
+    lines = [
+        "Workspace index, prefetched when the session started. Use it instead of "
+        "calling list_spreadsheets, list_sheets or summaries to find spreadsheets, "
+        "sheets and columns. It may be outdated after edits.",
+    ]
+    for spreadsheet in index:
+        sheets = "; ".join(
+            f"{sheet['title']} [{', '.join(str(h) for h in sheet['headers'])}]" for sheet in spreadsheet["sheets"]
+        )
+        lines.append(f"- \"{spreadsheet['title']}\" (id: {spreadsheet['id']}): {sheets or 'no sheets read'}")
+    if total > len(index):
+        lines.append(f"... and {total - len(index)} more spreadsheets, call list_spreadsheets to see them.")
+    return "\n".join(lines)
+
+
+class WorkspaceIndex:
+    """Titles, sheet names and headers of the spreadsheets in the folder.
+
+    All sessions share the service account's folder, so one index is kept
+    for everyone. It is refreshed after `ttl` seconds or when invalidated,
+    and concurrent logins wait on a single fetch.
+    """
+
+    def __init__(self, client, max_spreadsheets: int = 20, ttl: float = 300.0):
+        self.client = client
+        self.max_spreadsheets = max_spreadsheets
+        self.ttl = ttl
+        self.text: Optional[str] = None
+        self.fetched_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self.text = None
+
+    async def get(self) -> Optional[str]:
+        async with self._lock:
+            if self.text is None or time.monotonic() - self.fetched_at > self.ttl:
+                started = time.monotonic()
+                self.text = await self.fetch()
+                self.fetched_at = time.monotonic()
+                logger.info(f"Prefetched workspace index in {self.fetched_at - started:.2f}s")
+            return self.text
+
+    async def fetch(self) -> Optional[str]:
+        spreadsheets = extract_payload(await self.client.call_tool("list_spreadsheets", {}))
+        if isinstance(spreadsheets, dict):
+            spreadsheets = [spreadsheets]
+        if not isinstance(spreadsheets, list) or not spreadsheets:
+            return None
+        selected = spreadsheets[:self.max_spreadsheets]
+        summaries = extract_payload(await self.client.call_tool(
+            "get_multiple_spreadsheet_summary",
+            {"spreadsheet_ids": [s["id"] for s in selected], "rows_to_fetch": 1},
+        ))
+        if isinstance(summaries, dict):
+            summaries = [summaries]
+        return render_index(build_index(selected, summaries or []), len(spreadsheets))
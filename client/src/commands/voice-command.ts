@@ -11,6 +11,8 @@ import * as websocket from 'ws';
 import { Command } from '../shared/command';
 import { BotContext } from '../shared/context';
 
+const PARTIAL_EDIT_INTERVAL_MS = 1500;
+
 export class VoiceCommand extends Command {
   private tempDir: string;
   private ws: websocket.WebSocket | null = null;
@@ -97,8 +99,31 @@ export class VoiceCommand extends Command {
           );
 
           try {
+            // Render partial answers while the agent is still streaming,
+            // throttled to stay within Telegram's message edit limits
+            let lastEdit = 0;
+            let partialEdit: Promise<unknown> = Promise.resolve();
+            const onDelta = (partial: string) => {
+              const now = Date.now();
+              if (now - lastEdit < PARTIAL_EDIT_INTERVAL_MS) {
+                return;
+              }
+              lastEdit = now;
+              partialEdit = ctx.telegram
+                .editMessageText(
+                  ctx.chat.id,
+                  processingMsg.message_id,
+                  undefined,
+                  `🤖 Ответ помощника:\n${partial}…`,
+                )
+                .catch((error) =>
+                  console.error('Error rendering partial answer:', error),
+                );
+            };
+
             // Send the transcription to the agent and get response
-            const agentResponse = await this.queryAgent(transcription);
+            const agentResponse = await this.queryAgent(transcription, onDelta);
+            await partialEdit;
 
             // Update the message with the agent's response
             await ctx.telegram.editMessageText(
@@ -153,7 +178,7 @@ export class VoiceCommand extends Command {
           this.ws.send(
             JSON.stringify({
               event: 'login',
-              data: {},
+              data: { capabilities: ['delta'] },
             }),
           );
         }
@@ -197,7 +222,10 @@ export class VoiceCommand extends Command {
     }
   }
 
-  private async queryAgent(message: string): Promise<string> {
+  private async queryAgent(
+    message: string,
+    onDelta?: (partial: string) => void,
+  ): Promise<string> {
     return new Promise((resolve, reject) => {
       // Ensure we have a connection and session
       if (!this.ws || this.ws.readyState !== websocket.WebSocket.OPEN) {
@@ -213,6 +241,8 @@ export class VoiceCommand extends Command {
 
       let taskId: string | null = null;
       let finalResponse = ''; // Initialize as empty string instead of null
+      let partialResponse = '';
+      let partialStep: number | undefined;
       let errorOccurred = false;
 
       // Set up message handler
@@ -226,6 +256,20 @@ export class VoiceCommand extends Command {
             console.log(`Agent request received, task ID: ${taskId}`);
           }
 
+          // Accumulate streamed tokens of the answer; a new LLM step (after
+          // tool calls) replaces the text of the previous one
+          if (
+            response.event === 'agent_delta' &&
+            response.data.task_id === taskId
+          ) {
+            if (response.data.step !== partialStep) {
+              partialStep = response.data.step;
+              partialResponse = '';
+            }
+            partialResponse += response.data.delta;
+            onDelta?.(partialResponse);
+          }
+
           // If we received the final response
           if (
             response.event === 'agent_response' &&
@@ -0,0 +1,137 @@
+"""
+Tool call throughput of the server by number of worker processes.
+
+Spawns the server with the offline fake backend (GOOGLE_API_BACKEND=fake,
+FAKE_BACKEND_LATENCY seconds per API request) once per worker count, then
+runs --clients MCP sessions against it, each calling get_sheet_data back
+to back for --duration seconds, and reports calls per second and latency
+percentiles. With one worker the synchronous tools run one at a time; with
+N workers behind the dispatcher up to N run at once.
+
+    python benchmarks/bench_workers.py
+    python benchmarks/bench_workers.py --workers 1 2 4 8 --clients 32 --latency 0.1
+    python benchmarks/bench_workers.py --transport streamable-http
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+from mcp import ClientSession
+from mcp.client.sse import sse_client
+from mcp.client.streamable_http import streamablehttp_client
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'src')
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def wait_for_port(port: int, timeout: float, process: subprocess.Popen):
+    deadline = time.monotonic() + timeout
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Server not listening after {timeout}s")
+            time.sleep(0.1)
+
+
+def start_server(args, workers: int, directory: str) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(filter(None, [SRC_DIR, os.environ.get('PYTHONPATH')])),
+        GOOGLE_API_BACKEND='fake',
+        FAKE_BACKEND_LATENCY=str(args.latency),
+        MCP_TRANSPORT=args.transport,
+        MCP_WORKERS=str(workers),
+        MCP_WORKER_BASE_PORT=str(args.port + 1),
+        FASTMCP_HOST='127.0.0.1',
+        FASTMCP_PORT=str(args.port),
+        FASTMCP_LOG_LEVEL='WARNING',
+        SEARCH_INDEX_ENABLED='false',
+        CATALOG_PATH=os.path.join(directory, 'catalog.json'),
+        SHARED_STORE_PATH=os.path.join(directory, 'shared_store.sqlite3'),
+    )
+    output = None if args.server_logs else subprocess.DEVNULL
+    server = subprocess.Popen([sys.executable, '-m', 'mcp_google_sheets'], env=env, stdout=output, stderr=output)
+    wait_for_port(args.port, 60, server)
+    return server
+
+
+def connect(args):
+    if args.transport == 'streamable-http':
+        return streamablehttp_client(f"http://127.0.0.1:{args.port}/mcp/")
+    return sse_client(f"http://127.0.0.1:{args.port}/sse")
+
+
+async def client(args, index: int, deadline: float, latencies: List[float]):
+    async with connect(args) as streams:
+        async with ClientSession(streams[0], streams[1]) as session:
+            await session.initialize()
+            i = 0
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                result = await session.call_tool('get_sheet_data', {
+                    'spreadsheet_id': f"fake-{(index + i) % 10}",
+                    'sheet': 'Sheet1',
+                    'range': f"A{i % 100 + 1}:F{i % 100 + 20}",
+                })
+                if result.isError:
+                    raise RuntimeError(result.content[0].text if result.content else "Tool call failed")
+                latencies.append(time.perf_counter() - started)
+                i += 1
+
+
+async def measure(args) -> List[float]:
+    latencies: List[float] = []
+    deadline = time.monotonic() + args.duration
+    await asyncio.gather(*(client(args, i, deadline, latencies) for i in range(args.clients)))
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=16, help="Concurrent MCP sessions")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds of calls per worker count")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds per fake Google API request")
+    parser.add_argument('--transport', choices=['sse', 'streamable-http'], default='sse')
+    parser.add_argument('--port', type=int, default=8950)
+    parser.add_argument('--server-logs', action='store_true', help="Show the spawned server's output")
+    args = parser.parse_args()
+
+    baseline = None
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as directory:
+            server = start_server(args, workers, directory)
+            try:
+                started = time.perf_counter()
+                latencies = asyncio.run(measure(args))
+                elapsed = time.perf_counter() - started
+            finally:
+                server.terminate()
+                server.wait()
+        rate = len(latencies) / elapsed
+        baseline = baseline or rate
+        print(
+            f"workers {workers:2d}  calls {len(latencies):6d}  {rate:7.1f} calls/s ({rate / baseline:4.1f}x)  "
+            f"p50 {percentile(latencies, 0.5) * 1000:7.1f} ms  p95 {percentile(latencies, 0.95) * 1000:7.1f} ms"
+        )
+
+
+if __name__ == '__main__':
+    main()
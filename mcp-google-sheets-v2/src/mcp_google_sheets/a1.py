@@ -0,0 +1,59 @@
+"""
+A1 notation helpers. Rows and columns are 0-based everywhere else in the
+package, as in the Sheets API GridRange.
+"""
+
+import re
+from typing import Tuple
+
+CELL_PATTERN = re.compile(r"^\$?([A-Za-z]*)\$?(\d*)$")
+
+
+def column_letters(column: int) -> str:
+    """0-based column index to A1 letters (0 -> A, 26 -> AA)"""
+    letters = ""
+    column += 1
+    while column:
+        column, remainder = divmod(column - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def column_index(letters: str) -> int:
+    """A1 column letters to a 0-based index (A -> 0, AA -> 26)"""
+    index = 0
+    for letter in letters.upper():
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+
+def cell_name(row: int, column: int) -> str:
+    """0-based row and column to an A1 cell name (0, 0 -> A1)"""
+    return f"{column_letters(column)}{row + 1}"
+
+
+def range_name(start_row: int, start_column: int, end_row: int, end_column: int) -> str:
+    """A1 range of the inclusive 0-based bounds, a single cell if they are equal"""
+    start = cell_name(start_row, start_column)
+    if (start_row, start_column) == (end_row, end_column):
+        return start
+    return f"{start}:{cell_name(end_row, end_column)}"
+
+
+def range_start(a1_range: str) -> Tuple[int, int]:
+    """0-based (row, column) of the top-left cell of a range like 'B2:D10'.
+
+    A whole-column range ('B:D') starts on the first row, a whole-row one
+    ('3:5') on the first column. Raises ValueError for anything else.
+    """
+    if '!' in a1_range:
+        a1_range = a1_range.rsplit('!', 1)[1]
+    match = CELL_PATTERN.match(a1_range.split(':', 1)[0].strip())
+    if match is None or not any(match.groups()):
+        raise ValueError(f"Invalid A1 range '{a1_range}'")
+    letters, digits = match.groups()
+    row = int(digits) - 1 if digits else 0
+    column = column_index(letters) if letters else 0
+    if row < 0:
+        raise ValueError(f"Invalid A1 range '{a1_range}'")
+    return row, column
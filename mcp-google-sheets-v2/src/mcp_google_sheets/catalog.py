@@ -0,0 +1,203 @@
+"""
+Local catalog of the spreadsheets in the Drive folder.
+
+The first sync lists the folder page by page; after that only the Drive
+changes feed is read, starting from a stored page token, so keeping the
+catalog current costs one small request however large the folder is. The
+catalog and its token are persisted, so a restart resumes from the feed
+instead of listing everything again.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from googleapiclient.errors import HttpError
+
+CATALOG_FORMAT_VERSION = 1
+SPREADSHEET_MIME_TYPE = 'application/vnd.google-apps.spreadsheet'
+# Largest page Drive returns for files().list and changes().list
+MAX_PAGE_SIZE = 1000
+
+
+def list_folder_spreadsheets(drive_service, folder_id: Optional[str]) -> List[Dict[str, str]]:
+    """All spreadsheets of a folder (or of the drive) with their modifiedTime"""
+    query = f"mimeType='{SPREADSHEET_MIME_TYPE}' and trashed=false"
+    if folder_id:
+        query += f" and '{folder_id}' in parents"
+    files = []
+    page_token = None
+    while True:
+        results = drive_service.files().list(
+            q=query,
+            spaces='drive',
+            fields='nextPageToken, files(id, name, modifiedTime)',
+            pageSize=MAX_PAGE_SIZE,
+            pageToken=page_token
+        ).execute()
+        files.extend(results.get('files', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return files
+
+
+class SpreadsheetCatalog:
+    """Spreadsheets of a folder by id, kept current through the changes feed"""
+
+    def __init__(self,
+                 folder_id: Optional[str],
+                 path: Optional[str] = None,
+                 sync_interval: float = 5.0):
+        self.folder_id = folder_id
+        self.path = path
+        self.sync_interval = sync_interval
+        self.files: Dict[str, Dict[str, str]] = {}
+        self.start_page_token: Optional[str] = None
+        self.synced_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._loaded = False
+
+    def load(self) -> bool:
+        """Load the catalog and page token persisted by a previous run"""
+        self._loaded = True
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable spreadsheet catalog {self.path}: {e}")
+            return False
+        if data.get('version') != CATALOG_FORMAT_VERSION or data.get('folder_id') != self.folder_id:
+            return False
+        with self._lock:
+            self.files = data.get('files', {})
+            self.start_page_token = data.get('start_page_token')
+        print(f"Loaded spreadsheet catalog with {len(self.files)} spreadsheets")
+        return True
+
+    def save(self):
+        """Write the catalog atomically"""
+        if not self.path:
+            return
+        with self._lock:
+            data = {
+                'version': CATALOG_FORMAT_VERSION,
+                'folder_id': self.folder_id,
+                'start_page_token': self.start_page_token,
+                'files': dict(self.files),
+            }
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+    def sync(self, drive_service, force: bool = False) -> int:
+        """Bring the catalog up to date; returns the number of changes applied.
+
+        Does nothing if the last sync is less than `sync_interval` seconds
+        old, unless `force` is set.
+        """
+        with self._sync_lock:
+            if not self._loaded:
+                self.load()
+            if not force and self.synced_at is not None and time.monotonic() - self.synced_at < self.sync_interval:
+                return 0
+            token = self.start_page_token
+            if token is None:
+                changed = self._full_sync(drive_service)
+            else:
+                try:
+                    changed = self._apply_changes(drive_service)
+                except HttpError as e:
+                    if e.resp.status not in (400, 404, 410):
+                        raise
+                    # The stored token is no longer accepted
+                    print(f"Drive rejected the stored changes token ({e.resp.status}), listing the folder again")
+                    changed = self._full_sync(drive_service)
+            self.synced_at = time.monotonic()
+            if changed or self.start_page_token != token:
+                self.save()
+            return changed
+
+    def expire(self):
+        """Sync on the next lookup, e.g. after creating a spreadsheet"""
+        self.synced_at = None
+
+    def get(self, spreadsheet_id: str) -> Optional[Dict[str, str]]:
+        with self._lock:
+            return self.files.get(spreadsheet_id)
+
+    def spreadsheets(self) -> List[Dict[str, str]]:
+        """Catalog entries, most recently modified first"""
+        with self._lock:
+            files = list(self.files.values())
+        return sorted(files, key=lambda f: f.get('modifiedTime', ''), reverse=True)
+
+    def lookup(self,
+               title_contains: Optional[str] = None,
+               modified_after: Optional[str] = None,
+               offset: int = 0,
+               limit: Optional[int] = None) -> List[Dict[str, str]]:
+        """Filter and page the catalog without calling Drive"""
+        files = self.spreadsheets()
+        if title_contains:
+            needle = title_contains.casefold()
+            files = [f for f in files if needle in f.get('name', '').casefold()]
+        if modified_after:
+            # RFC 3339 timestamps in UTC compare correctly as strings
+            files = [f for f in files if f.get('modifiedTime', '') > modified_after]
+        end = None if limit is None else offset + limit
+        return files[offset:end]
+
+    def _full_sync(self, drive_service) -> int:
+        # Take the token first, so changes made while listing are replayed
+        token = drive_service.changes().getStartPageToken().execute().get('startPageToken')
+        files = list_folder_spreadsheets(drive_service, self.folder_id)
+        with self._lock:
+            self.files = {f['id']: f for f in files}
+            self.start_page_token = token
+        print(f"Listed {len(files)} spreadsheets into the catalog")
+        return len(files)
+
+    def _apply_changes(self, drive_service) -> int:
+        page_token = self.start_page_token
+        changed = 0
+        while True:
+            results = drive_service.changes().list(
+                pageToken=page_token,
+                spaces='drive',
+                pageSize=MAX_PAGE_SIZE,
+                fields='nextPageToken, newStartPageToken, '
+                       'changes(fileId, removed, file(id, name, mimeType, modifiedTime, parents, trashed))'
+            ).execute()
+            with self._lock:
+                for change in results.get('changes', []):
+                    changed += self._apply_change(change)
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                self.start_page_token = results.get('newStartPageToken', self.start_page_token)
+                return changed
+
+    def _apply_change(self, change: Dict[str, Any]) -> int:
+        file_id = change.get('fileId')
+        file = change.get('file') or {}
+        belongs = (
+            not change.get('removed')
+            and not file.get('trashed')
+            and file.get('mimeType') == SPREADSHEET_MIME_TYPE
+            and (not self.folder_id or self.folder_id in file.get('parents', []))
+        )
+        if belongs:
+            entry = {'id': file_id, 'name': file.get('name', ''), 'modifiedTime': file.get('modifiedTime', '')}
+            if self.files.get(file_id) == entry:
+                return 0
+            self.files[file_id] = entry
+            return 1
+        return 1 if self.files.pop(file_id, None) is not None else 0
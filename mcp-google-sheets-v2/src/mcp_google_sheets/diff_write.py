@@ -0,0 +1,95 @@
+"""
+Minimal-diff writes: compare new values with what a range holds and keep
+only the cells that change, grouped into as few rectangles as possible.
+
+Current values are read with valueRenderOption=FORMULA, i.e. as they would
+be typed: formulas as '=...', numbers unformatted. Both sides are compared
+as that text, so a value written as 5 or '5' matches a cell holding 5.
+A cell that only might differ is written, never skipped.
+"""
+
+from typing import Any, Dict, List, Tuple
+
+from .a1 import range_name
+
+# (start_row, start_column, end_row, end_column) inclusive, relative to the data
+Block = Tuple[int, int, int, int]
+
+
+def normalize_value(value: Any) -> str:
+    """The text a value would be typed as"""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def changed_mask(current: List[List[Any]], data: List[List[Any]]) -> List[List[bool]]:
+    """Per cell of `data`, whether it differs from the same cell of `current`"""
+    mask = []
+    for r, row in enumerate(data):
+        old_row = current[r] if r < len(current) else []
+        # Rows are compared as whole lists first; most rows of a rewrite are unchanged
+        old = [normalize_value(v) for v in old_row[:len(row)]]
+        old += [''] * (len(row) - len(old))
+        new = [normalize_value(v) for v in row]
+        if old == new:
+            mask.append([False] * len(row))
+        else:
+            mask.append([a != b for a, b in zip(old, new)])
+    return mask
+
+
+def changed_blocks(mask: List[List[bool]]) -> List[Block]:
+    """Cover the changed cells with rectangles.
+
+    Each row is split into runs of consecutive changed cells, then a run
+    is merged into the block above it when both span the same columns.
+    """
+    blocks: List[Block] = []
+    # (start_column, end_column) -> index in blocks of the block ending on the previous row
+    open_blocks: Dict[Tuple[int, int], int] = {}
+    for r, row in enumerate(mask):
+        runs, c = [], 0
+        while c < len(row):
+            if row[c]:
+                start = c
+                while c < len(row) and row[c]:
+                    c += 1
+                runs.append((start, c - 1))
+            else:
+                c += 1
+        next_open = {}
+        for run in runs:
+            i = open_blocks.get(run)
+            if i is not None:
+                start_row, start_column, _, end_column = blocks[i]
+                blocks[i] = (start_row, start_column, r, end_column)
+            else:
+                i = len(blocks)
+                blocks.append((r, run[0], r, run[1]))
+            next_open[run] = i
+        open_blocks = next_open
+    return blocks
+
+
+def diff_updates(sheet: str,
+                 start_row: int,
+                 start_column: int,
+                 current: List[List[Any]],
+                 data: List[List[Any]]) -> Tuple[List[Dict[str, Any]], int]:
+    """The value ranges to send to values().batchUpdate and the number of changed cells"""
+    mask = changed_mask(current, data)
+    updates = []
+    changed = 0
+    for r0, c0, r1, c1 in changed_blocks(mask):
+        values = [data[r][c0:c1 + 1] for r in range(r0, r1 + 1)]
+        changed += sum(mask[r][c] for r in range(r0, r1 + 1) for c in range(c0, c1 + 1))
+        updates.append({
+            'range': f"{sheet}!{range_name(start_row + r0, start_column + c0, start_row + r1, start_column + c1)}",
+            'values': values
+        })
+    return updates, changed
@@ -0,0 +1,363 @@
+"""
+Offline stand-in for the Drive and Sheets APIs, for benchmarks and trying
+the server without a Google account (GOOGLE_API_BACKEND=fake).
+
+Holds generated spreadsheets in memory and answers the subset of the API
+the tools, the catalog and the search index use. Every `execute()` blocks
+for `latency` seconds like a real HTTP round trip, after taking a token
+from the API rate limiter. State is per process: with several workers,
+each one starts from the same generated spreadsheets and sees only its
+own writes.
+"""
+
+import copy
+import itertools
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .a1 import CELL_PATTERN, column_index, range_name, range_start
+
+SPREADSHEET_MIME_TYPE = 'application/vnd.google-apps.spreadsheet'
+
+
+def _timestamp() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _split_range(a1_range: str) -> Tuple[str, str]:
+    """'Sheet 1'!A1:B2 -> (Sheet 1, A1:B2); a bare sheet name has no cells"""
+    if '!' in a1_range:
+        sheet, cells = a1_range.rsplit('!', 1)
+    else:
+        sheet, cells = a1_range, ''
+    if len(sheet) > 1 and sheet[0] == sheet[-1] == "'":
+        sheet = sheet[1:-1].replace("''", "'")
+    return sheet, cells
+
+
+def _bounds(cells: str) -> Tuple[int, int, Optional[int], Optional[int]]:
+    """0-based (start row, start column, end row, end column) of an A1 range, open ends as None"""
+    if not cells:
+        return 0, 0, None, None
+    start_row, start_column = range_start(cells)
+    if ':' not in cells:
+        return start_row, start_column, start_row, start_column
+    match = CELL_PATTERN.match(cells.split(':', 1)[1].strip())
+    if match is None or not any(match.groups()):
+        raise ValueError(f"Invalid A1 range '{cells}'")
+    letters, digits = match.groups()
+    return (
+        start_row, start_column,
+        int(digits) - 1 if digits else None,
+        column_index(letters) if letters else None,
+    )
+
+
+class FakeRequest:
+    """What a discovery method returns; the call happens on execute()"""
+
+    def __init__(self, backend: 'FakeGoogle', call: Callable[[], Any]):
+        self.backend = backend
+        self.call = call
+
+    def execute(self, num_retries: int = 0) -> Any:
+        return self.backend.execute(self.call)
+
+
+class _Resource:
+    def __init__(self, backend: 'FakeGoogle'):
+        self.backend = backend
+
+    def _request(self, call: Callable[[], Any]) -> FakeRequest:
+        return FakeRequest(self.backend, call)
+
+
+class _Files(_Resource):
+    def list(self, pageToken: Optional[str] = None, **kwargs) -> FakeRequest:
+        b = self.backend
+        return self._request(lambda: {'files': [b.file(spreadsheet_id) for spreadsheet_id in b.spreadsheets]})
+
+    def get(self, fileId: str, **kwargs) -> FakeRequest:
+        return self._request(lambda: self.backend.file(fileId))
+
+    def update(self, fileId: str, addParents: Optional[str] = None, **kwargs) -> FakeRequest:
+        def call():
+            spreadsheet = self.backend.spreadsheet(fileId)
+            if addParents:
+                spreadsheet['parents'] = addParents.split(',')
+            self.backend.touch(fileId)
+            return {'id': fileId, 'parents': spreadsheet['parents']}
+        return self._request(call)
+
+
+class _Changes(_Resource):
+    def getStartPageToken(self, **kwargs) -> FakeRequest:
+        return self._request(lambda: {'startPageToken': str(len(self.backend.changes))})
+
+    def list(self, pageToken: str, **kwargs) -> FakeRequest:
+        def call():
+            changes = self.backend.changes[int(pageToken):]
+            return {
+                'changes': [{'fileId': spreadsheet_id, 'file': self.backend.file(spreadsheet_id)} for spreadsheet_id in changes],
+                'newStartPageToken': str(len(self.backend.changes)),
+            }
+        return self._request(call)
+
+
+class _Permissions(_Resource):
+    def create(self, fileId: str, **kwargs) -> FakeRequest:
+        return self._request(lambda: {'id': f"permission{next(self.backend.ids)}"})
+
+
+class FakeDrive(_Resource):
+    def files(self) -> _Files:
+        return _Files(self.backend)
+
+    def changes(self) -> _Changes:
+        return _Changes(self.backend)
+
+    def permissions(self) -> _Permissions:
+        return _Permissions(self.backend)
+
+
+class _Values(_Resource):
+    def get(self, spreadsheetId: str, range: str, **kwargs) -> FakeRequest:
+        return self._request(lambda: self.backend.read(spreadsheetId, range))
+
+    def update(self, spreadsheetId: str, range: str, body: Dict[str, Any], **kwargs) -> FakeRequest:
+        return self._request(lambda: self.backend.write(spreadsheetId, range, body.get('values', [])))
+
+    def batchUpdate(self, spreadsheetId: str, body: Dict[str, Any], **kwargs) -> FakeRequest:
+        def call():
+            responses = [self.backend.write(spreadsheetId, item['range'], item.get('values', [])) for item in body.get('data', [])]
+            return {
+                'spreadsheetId': spreadsheetId,
+                'totalUpdatedCells': sum(r['updatedCells'] for r in responses),
+                'responses': responses,
+            }
+        return self._request(call)
+
+
+class _Sheets(_Resource):
+    def copyTo(self, spreadsheetId: str, sheetId: int, body: Dict[str, Any], **kwargs) -> FakeRequest:
+        def call():
+            source = self.backend.sheet_by_id(spreadsheetId, sheetId)
+            destination = body['destinationSpreadsheetId']
+            return self.backend.add_sheet(destination, f"Copy of {source['title']}", copy.deepcopy(source['rows']))
+        return self._request(call)
+
+
+class _Spreadsheets(_Resource):
+    def values(self) -> _Values:
+        return _Values(self.backend)
+
+    def sheets(self) -> _Sheets:
+        return _Sheets(self.backend)
+
+    def get(self, spreadsheetId: str, includeGridData: bool = False, **kwargs) -> FakeRequest:
+        return self._request(lambda: self.backend.describe(spreadsheetId, includeGridData))
+
+    def create(self, body: Dict[str, Any], **kwargs) -> FakeRequest:
+        def call():
+            spreadsheet_id = self.backend.create(body.get('properties', {}).get('title', 'Untitled spreadsheet'))
+            return self.backend.describe(spreadsheet_id)
+        return self._request(call)
+
+    def batchUpdate(self, spreadsheetId: str, body: Dict[str, Any], **kwargs) -> FakeRequest:
+        def call():
+            replies = [self.backend.apply(spreadsheetId, request) for request in body.get('requests', [])]
+            return {'spreadsheetId': spreadsheetId, 'replies': replies}
+        return self._request(call)
+
+
+class FakeSheets(_Resource):
+    def spreadsheets(self) -> _Spreadsheets:
+        return _Spreadsheets(self.backend)
+
+
+class FakeGoogle:
+    """In-memory spreadsheets served through Drive and Sheets shaped clients"""
+
+    def __init__(self,
+                 spreadsheets: int = 10,
+                 rows: int = 200,
+                 columns: int = 6,
+                 latency: float = 0.05,
+                 folder_id: Optional[str] = None,
+                 rate_limiter=None):
+        self.latency = latency
+        self.folder_id = folder_id
+        self.rate_limiter = rate_limiter
+        self.spreadsheets: Dict[str, Dict[str, Any]] = {}
+        # Ids of the spreadsheets changed, the index is the changes page token
+        self.changes: List[str] = []
+        self.ids = itertools.count(1)
+        self.calls = 0
+        self._lock = threading.Lock()
+        for i in range(spreadsheets):
+            spreadsheet_id = self.create(f"Fake spreadsheet {i}", spreadsheet_id=f"fake-{i}")
+            self.spreadsheet(spreadsheet_id)['sheets'][0]['rows'] = [
+                [f"{['north', 'south', 'east', 'west'][r % 4]} item{r}" if c == 0 else str((r + 1) * (c + i))
+                 for c in range(columns)]
+                for r in range(rows)
+            ]
+
+    def drive(self) -> FakeDrive:
+        return FakeDrive(self)
+
+    def sheets(self) -> FakeSheets:
+        return FakeSheets(self)
+
+    def execute(self, call: Callable[[], Any]) -> Any:
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        if self.latency > 0:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            return copy.deepcopy(call())
+
+    # The methods below run under the lock, called from FakeRequest.execute
+
+    def spreadsheet(self, spreadsheet_id: str) -> Dict[str, Any]:
+        spreadsheet = self.spreadsheets.get(spreadsheet_id)
+        if spreadsheet is None:
+            raise KeyError(f"Requested entity was not found: spreadsheet {spreadsheet_id}")
+        return spreadsheet
+
+    def file(self, spreadsheet_id: str) -> Dict[str, Any]:
+        spreadsheet = self.spreadsheet(spreadsheet_id)
+        return {
+            'id': spreadsheet_id,
+            'name': spreadsheet['title'],
+            'mimeType': SPREADSHEET_MIME_TYPE,
+            'modifiedTime': spreadsheet['modifiedTime'],
+            'parents': spreadsheet['parents'],
+            'trashed': False,
+        }
+
+    def touch(self, spreadsheet_id: str):
+        self.spreadsheet(spreadsheet_id)['modifiedTime'] = _timestamp()
+        self.changes.append(spreadsheet_id)
+
+    def create(self, title: str, spreadsheet_id: Optional[str] = None) -> str:
+        spreadsheet_id = spreadsheet_id or f"fake-new-{next(self.ids)}"
+        self.spreadsheets[spreadsheet_id] = {
+            'title': title,
+            'sheets': [{'sheetId': 0, 'title': 'Sheet1', 'rows': []}],
+            'parents': [self.folder_id] if self.folder_id else [],
+            'modifiedTime': _timestamp(),
+        }
+        self.changes.append(spreadsheet_id)
+        return spreadsheet_id
+
+    def sheet(self, spreadsheet_id: str, title: str) -> Dict[str, Any]:
+        for sheet in self.spreadsheet(spreadsheet_id)['sheets']:
+            if sheet['title'] == title:
+                return sheet
+        raise KeyError(f"Unable to parse range: sheet '{title}' not found")
+
+    def sheet_by_id(self, spreadsheet_id: str, sheet_id: int) -> Dict[str, Any]:
+        for sheet in self.spreadsheet(spreadsheet_id)['sheets']:
+            if sheet['sheetId'] == sheet_id:
+                return sheet
+        raise KeyError(f"No sheet with id {sheet_id}")
+
+    def add_sheet(self, spreadsheet_id: str, title: str, rows: Optional[List[List[str]]] = None,
+                  sheet_id: Optional[int] = None) -> Dict[str, Any]:
+        sheets = self.spreadsheet(spreadsheet_id)['sheets']
+        if any(sheet['title'] == title for sheet in sheets):
+            raise ValueError(f"A sheet with the name '{title}' already exists")
+        sheet_id = sheet_id if sheet_id is not None else max((s['sheetId'] for s in sheets), default=0) + 1
+        sheets.append({'sheetId': sheet_id, 'title': title, 'rows': rows or []})
+        self.touch(spreadsheet_id)
+        return self._properties(sheets[-1], len(sheets) - 1)
+
+    @staticmethod
+    def _properties(sheet: Dict[str, Any], index: int) -> Dict[str, Any]:
+        return {
+            'sheetId': sheet['sheetId'],
+            'title': sheet['title'],
+            'index': index,
+            'sheetType': 'GRID',
+            'gridProperties': {
+                'rowCount': max(1000, len(sheet['rows'])),
+                'columnCount': max([26] + [len(row) for row in sheet['rows']]),
+            },
+        }
+
+    def describe(self, spreadsheet_id: str, include_grid_data: bool = False) -> Dict[str, Any]:
+        spreadsheet = self.spreadsheet(spreadsheet_id)
+        sheets = []
+        for index, sheet in enumerate(spreadsheet['sheets']):
+            entry = {'properties': self._properties(sheet, index)}
+            if include_grid_data:
+                entry['data'] = [{
+                    'startRow': 0,
+                    'startColumn': 0,
+                    'rowData': [{'values': [{'formattedValue': value} for value in row]} for row in sheet['rows']],
+                }]
+            sheets.append(entry)
+        return {'spreadsheetId': spreadsheet_id, 'properties': {'title': spreadsheet['title']}, 'sheets': sheets}
+
+    def read(self, spreadsheet_id: str, a1_range: str) -> Dict[str, Any]:
+        title, cells = _split_range(a1_range)
+        rows = self.sheet(spreadsheet_id, title)['rows']
+        start_row, start_column, end_row, end_column = _bounds(cells)
+        values = [
+            row[start_column:None if end_column is None else end_column + 1]
+            for row in rows[start_row:None if end_row is None else end_row + 1]
+        ]
+        while values and not values[-1]:
+            values.pop()
+        result = {'range': a1_range, 'majorDimension': 'ROWS'}
+        if values:
+            result['values'] = values
+        return result
+
+    def write(self, spreadsheet_id: str, a1_range: str, values: List[List[Any]]) -> Dict[str, Any]:
+        title, cells = _split_range(a1_range)
+        rows = self.sheet(spreadsheet_id, title)['rows']
+        start_row, start_column, _, _ = _bounds(cells)
+        for r, new_row in enumerate(values):
+            while len(rows) <= start_row + r:
+                rows.append([])
+            row = rows[start_row + r]
+            for c, value in enumerate(new_row):
+                while len(row) <= start_column + c:
+                    row.append('')
+                row[start_column + c] = '' if value is None else str(value)
+        self.touch(spreadsheet_id)
+        columns = max((len(row) for row in values), default=0)
+        return {
+            'spreadsheetId': spreadsheet_id,
+            'updatedRange': f"{title}!{range_name(start_row, start_column, start_row + max(len(values), 1) - 1, start_column + max(columns, 1) - 1)}",
+            'updatedRows': len(values),
+            'updatedColumns': columns,
+            'updatedCells': sum(len(row) for row in values),
+        }
+
+    def apply(self, spreadsheet_id: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        """One request of spreadsheets.batchUpdate; kinds the fake does not model are accepted as no-ops"""
+        sheets = self.spreadsheet(spreadsheet_id)['sheets']
+        if 'addSheet' in request:
+            properties = request['addSheet'].get('properties', {})
+            title = properties.get('title') or f"Sheet{len(sheets) + 1}"
+            return {'addSheet': {'properties': self.add_sheet(spreadsheet_id, title, sheet_id=properties.get('sheetId'))}}
+        if 'deleteSheet' in request:
+            sheet = self.sheet_by_id(spreadsheet_id, request['deleteSheet']['sheetId'])
+            sheets.remove(sheet)
+        elif 'updateSheetProperties' in request:
+            properties = request['updateSheetProperties']['properties']
+            sheet = self.sheet_by_id(spreadsheet_id, properties['sheetId'])
+            if 'title' in properties:
+                sheet['title'] = properties['title']
+        elif 'duplicateSheet' in request:
+            source = self.sheet_by_id(spreadsheet_id, request['duplicateSheet']['sourceSheetId'])
+            title = request['duplicateSheet'].get('newSheetName') or f"Copy of {source['title']}"
+            properties = self.add_sheet(spreadsheet_id, title, copy.deepcopy(source['rows']))
+            return {'duplicateSheet': {'properties': properties}}
+        self.touch(spreadsheet_id)
+        return {}
@@ -0,0 +1,112 @@
+"""
+Idempotency keys for tools that change spreadsheets.
+
+A client that retries a write after a timeout cannot know whether the
+first attempt went through. If both attempts carry the same key, the
+second one gets the result of the first instead of adding the rows or
+the sheet again. Results are kept for `ttl` seconds, up to `max_entries`
+keys. A duplicate that arrives while the first call is still running
+waits for it rather than running concurrently.
+
+That wait blocks the calling thread. It only happens when the two calls
+run on different threads: FastMCP runs the synchronous tools inline on
+its event loop, one at a time, so within one process a duplicate is only
+looked at once the first call has returned and finds its result. Across
+worker processes (shared_store.py) a duplicate blocks its worker, as the
+Google API request it stands in for would.
+"""
+
+import functools
+import inspect
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Tuple
+
+KEY_ARGUMENT = 'idempotency_key'
+
+
+def call_fingerprint(tool_name: str, arguments: Dict[str, Any]) -> str:
+    """Identify a call by its tool and arguments, so a key cannot be reused for another call"""
+    return json.dumps([tool_name, arguments], sort_keys=True, default=str)
+
+
+class IdempotencyStore:
+    """Bounded, TTL-evicted results of keyed calls with single-flight execution"""
+
+    def __init__(self, ttl: float = 600.0, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> (fingerprint, result, expiry), oldest first
+        self.results: 'OrderedDict[str, Tuple[str, Any, float]]' = OrderedDict()
+        # key -> (fingerprint, event set when the running call finishes)
+        self.in_flight: Dict[str, Tuple[str, threading.Event]] = {}
+        self.hits = 0
+        self._lock = threading.Lock()
+
+    def run(self, key: str, fingerprint: str, call: Callable[[], Any]) -> Any:
+        """Run `call` once per key, or return the result of the call that did"""
+        while True:
+            with self._lock:
+                self._evict()
+                stored = self.results.get(key)
+                if stored is not None:
+                    if stored[0] != fingerprint:
+                        return self._mismatch(key)
+                    self.hits += 1
+                    return stored[1]
+                running = self.in_flight.get(key)
+                if running is None:
+                    done = threading.Event()
+                    self.in_flight[key] = (fingerprint, done)
+                    break
+            if running[0] != fingerprint:
+                return self._mismatch(key)
+            # Only reached from another thread than the first call's (see above).
+            # A failed first call stores nothing and the duplicate runs itself.
+            running[1].wait()
+
+        try:
+            result = call()
+            with self._lock:
+                self.results[key] = (fingerprint, result, time.monotonic() + self.ttl)
+                self._evict()
+            return result
+        finally:
+            with self._lock:
+                del self.in_flight[key]
+            done.set()
+
+    def _evict(self):
+        now = time.monotonic()
+        while self.results:
+            key, (_, _, expiry) = next(iter(self.results.items()))
+            if expiry > now and len(self.results) <= self.max_entries:
+                return
+            del self.results[key]
+
+    @staticmethod
+    def _mismatch(key: str) -> Dict[str, Any]:
+        return {"error": f"Idempotency key '{key}' was already used for a different call"}
+
+
+def idempotent(store: IdempotencyStore):
+    """Decorate a tool taking an `idempotency_key` argument; calls without a key run as usual"""
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            key = bound.arguments.get(KEY_ARGUMENT)
+            if not key:
+                return fn(*args, **kwargs)
+            arguments = {
+                name: value for name, value in bound.arguments.items()
+                if name not in (KEY_ARGUMENT, 'ctx')
+            }
+            return store.run(key, call_fingerprint(fn.__name__, arguments), lambda: fn(*args, **kwargs))
+
+        return wrapper
+    return decorator
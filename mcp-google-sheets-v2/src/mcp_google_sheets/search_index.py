@@ -0,0 +1,406 @@
+"""
+Full-text search over the cell values of the spreadsheets in a Drive folder.
+
+Each spreadsheet gets its own inverted index (token -> cells), so a changed
+spreadsheet is re-indexed on its own: a background thread syncs the
+spreadsheet catalog, compares Drive `modifiedTime` with the indexed one and
+re-fetches only what changed. The index is bounded by a total number of cells and persisted to a
+gzipped JSON file, so a restart does not re-read the whole folder.
+
+With several workers (see workers.py) one of them refreshes the index and
+the others follow it: they reload the file whenever it is saved and post
+the spreadsheets they write to through the shared store.
+"""
+
+import bisect
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .a1 import cell_name
+from .catalog import SpreadsheetCatalog
+from .shared_store import SharedStore
+
+INDEX_FORMAT_VERSION = 1
+
+# Seconds between checks for a newer index file or invalidations from other workers
+FOLLOW_INTERVAL = 2.0
+
+# Shared store topic of spreadsheets invalidated by following workers
+INVALIDATIONS_TOPIC = 'search_index.invalidate'
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Split a cell value or a query into case-folded word tokens"""
+    return TOKEN_PATTERN.findall(text.casefold())
+
+
+@dataclass
+class IndexedSpreadsheet:
+    """Cells of one spreadsheet and the postings pointing into them"""
+    spreadsheet_id: str
+    title: str
+    modified_time: str
+    sheets: List[str]
+    # (sheet index, row, column, value), rows and columns 0-based
+    cells: List[Tuple[int, int, int, str]]
+    truncated: bool = False
+    # Written since it was indexed: re-fetched whatever modifiedTime Drive reports
+    stale: bool = False
+    postings: Dict[str, List[int]] = field(default_factory=dict, repr=False)
+    terms: List[str] = field(default_factory=list, repr=False)
+
+    def build_postings(self):
+        postings: Dict[str, List[int]] = {}
+        for i, (_, _, _, value) in enumerate(self.cells):
+            for token in set(tokenize(value)):
+                postings.setdefault(token, []).append(i)
+        self.postings = postings
+        self.terms = sorted(postings)
+
+    def match(self, tokens: List[str]) -> List[int]:
+        """Cells containing every token; the last one may be a word prefix"""
+        sets = []
+        for i, token in enumerate(tokens):
+            if i == len(tokens) - 1:
+                cells = set(self.postings.get(token, ()))
+                start = bisect.bisect_left(self.terms, token)
+                for term in self.terms[start:]:
+                    if not term.startswith(token):
+                        break
+                    cells.update(self.postings[term])
+            else:
+                cells = set(self.postings.get(token, ()))
+            if not cells:
+                return []
+            sets.append(cells)
+        sets.sort(key=len)
+        return sorted(set.intersection(*sets))
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'title': self.title,
+            'modified_time': self.modified_time,
+            'sheets': self.sheets,
+            'cells': self.cells,
+            'truncated': self.truncated,
+            'stale': self.stale,
+        }
+
+
+def fetch_spreadsheet_cells(sheets_service, spreadsheet_id: str, max_cells: int,
+                            max_value_chars: int) -> Tuple[List[str], List[Tuple[int, int, int, str]], bool]:
+    """Read the formatted values of every sheet in a single API call"""
+    spreadsheet = sheets_service.spreadsheets().get(
+        spreadsheetId=spreadsheet_id,
+        includeGridData=True,
+        fields='sheets(properties(title),data(startRow,startColumn,rowData(values(formattedValue))))'
+    ).execute()
+    sheets, cells = [], []
+    for sheet_index, sheet in enumerate(spreadsheet.get('sheets', [])):
+        sheets.append(sheet.get('properties', {}).get('title', ''))
+        for grid in sheet.get('data', []):
+            start_row, start_column = grid.get('startRow', 0), grid.get('startColumn', 0)
+            for r, row in enumerate(grid.get('rowData', [])):
+                for c, cell in enumerate(row.get('values', [])):
+                    value = cell.get('formattedValue')
+                    if not value:
+                        continue
+                    if len(cells) >= max_cells:
+                        return sheets, cells, True
+                    cells.append((sheet_index, start_row + r, start_column + c, value[:max_value_chars]))
+    return sheets, cells, False
+
+
+class SearchIndex:
+    """Inverted index over the cells of the spreadsheets in a Drive folder.
+
+    `refresh` brings the index up to date with the folder; `start` runs it
+    every `refresh_interval` seconds in a daemon thread. Searches are served
+    from memory and never wait for Google APIs. When the folder holds more
+    than `max_cells` non-empty cells, the least recently modified
+    spreadsheets are left out and reported as not indexed.
+    """
+
+    def __init__(self,
+                 catalog: SpreadsheetCatalog,
+                 path: Optional[str] = None,
+                 max_cells: int = 1_000_000,
+                 max_value_chars: int = 200,
+                 refresh_interval: float = 60.0,
+                 store: Optional[SharedStore] = None):
+        self.catalog = catalog
+        self.folder_id = catalog.folder_id
+        self.path = path
+        self.max_cells = max_cells
+        self.max_value_chars = max_value_chars
+        self.refresh_interval = refresh_interval
+        self.store = store
+        self.following = False
+        self.spreadsheets: Dict[str, IndexedSpreadsheet] = {}
+        # Spreadsheets left out for lack of room, with the modifiedTime seen
+        self.skipped: Dict[str, str] = {}
+        self.pending = 0
+        self.last_refresh: Optional[float] = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def cell_count(self) -> int:
+        return sum(len(entry.cells) for entry in self.spreadsheets.values())
+
+    def load(self) -> bool:
+        """Load the index persisted by a previous run, if it is for this folder"""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable search index {self.path}: {e}")
+            return False
+        if data.get('version') != INDEX_FORMAT_VERSION or data.get('folder_id') != self.folder_id:
+            return False
+        spreadsheets = {}
+        for spreadsheet_id, entry in data.get('spreadsheets', {}).items():
+            indexed = IndexedSpreadsheet(
+                spreadsheet_id=spreadsheet_id,
+                title=entry['title'],
+                modified_time=entry['modified_time'],
+                sheets=entry['sheets'],
+                cells=[tuple(cell) for cell in entry['cells']],
+                truncated=entry.get('truncated', False),
+                stale=entry.get('stale', False),
+            )
+            indexed.build_postings()
+            spreadsheets[spreadsheet_id] = indexed
+        with self._lock:
+            self.spreadsheets = spreadsheets
+            self.skipped = data.get('skipped', {})
+        print(f"Loaded search index with {len(spreadsheets)} spreadsheets, {self.cell_count} cells")
+        return True
+
+    def save(self):
+        """Write the index atomically; postings are rebuilt on load"""
+        if not self.path:
+            return
+        with self._lock:
+            data = {
+                'version': INDEX_FORMAT_VERSION,
+                'folder_id': self.folder_id,
+                'spreadsheets': {key: entry.to_json() for key, entry in self.spreadsheets.items()},
+                'skipped': dict(self.skipped),
+            }
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+    def refresh(self, drive_service, sheets_service) -> int:
+        """Re-index the spreadsheets added or modified since the last refresh.
+
+        Returns the number of spreadsheets fetched. Each one becomes
+        searchable as soon as it is indexed.
+        """
+        with self._refresh_lock:
+            self.catalog.sync(drive_service)
+            files = self.catalog.spreadsheets()
+            current = {f['id']: f for f in files}
+            changed = False
+
+            with self._lock:
+                for spreadsheet_id in set(self.spreadsheets) - set(current):
+                    del self.spreadsheets[spreadsheet_id]
+                    changed = True
+                for spreadsheet_id in set(self.skipped) - set(current):
+                    del self.skipped[spreadsheet_id]
+
+            # Most recently modified first, so they win the room in the index
+            stale = [
+                f for f in sorted(files, key=lambda f: f.get('modifiedTime', ''), reverse=True)
+                if self._needs_fetch(f)
+            ]
+            self.pending = len(stale)
+            fetched = 0
+            for f in stale:
+                try:
+                    sheets, cells, truncated = fetch_spreadsheet_cells(
+                        sheets_service, f['id'], self.max_cells, self.max_value_chars
+                    )
+                except Exception as e:
+                    print(f"Could not index spreadsheet {f['id']}: {e}")
+                    self.pending -= 1
+                    continue
+                entry = IndexedSpreadsheet(
+                    spreadsheet_id=f['id'],
+                    title=f.get('name', ''),
+                    modified_time=f.get('modifiedTime', ''),
+                    sheets=sheets,
+                    cells=cells,
+                    truncated=truncated,
+                )
+                entry.build_postings()
+                with self._lock:
+                    self.spreadsheets[entry.spreadsheet_id] = entry
+                    self.skipped.pop(entry.spreadsheet_id, None)
+                    self._evict()
+                self.pending -= 1
+                fetched += 1
+                changed = True
+
+            self.pending = 0
+            self.last_refresh = time.time()
+            if changed:
+                self.save()
+            return fetched
+
+    def invalidate(self, spreadsheet_id: str):
+        """Re-index a spreadsheet on the next refresh, which is started now.
+
+        Drive may report the old modifiedTime for a few seconds after a
+        write, so the spreadsheet is marked stale rather than compared. It
+        keeps its modifiedTime, by which eviction and search results go.
+        """
+        with self._lock:
+            entry = self.spreadsheets.get(spreadsheet_id)
+            if entry is not None:
+                entry.stale = True
+            self.skipped.pop(spreadsheet_id, None)
+        if self.following:
+            self.store.post(INVALIDATIONS_TOPIC, spreadsheet_id)
+        else:
+            self.request_refresh()
+
+    def _needs_fetch(self, f: Dict[str, str]) -> bool:
+        with self._lock:
+            entry = self.spreadsheets.get(f['id'])
+            if entry is not None:
+                return entry.stale or entry.modified_time != f.get('modifiedTime')
+            return self.skipped.get(f['id']) != f.get('modifiedTime')
+
+    def _evict(self):
+        """Drop the least recently modified spreadsheets beyond max_cells"""
+        total = self.cell_count
+        while total > self.max_cells and len(self.spreadsheets) > 1:
+            oldest = min(self.spreadsheets.values(), key=lambda entry: entry.modified_time)
+            del self.spreadsheets[oldest.spreadsheet_id]
+            self.skipped[oldest.spreadsheet_id] = oldest.modified_time
+            total -= len(oldest.cells)
+
+    def search(self, query: str, spreadsheet_id: Optional[str] = None, limit: int = 20) -> Dict[str, Any]:
+        """Find cells containing every word of `query`"""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        hits, total = [], 0
+        if tokens:
+            with self._lock:
+                entries = sorted(self.spreadsheets.values(), key=lambda entry: entry.modified_time, reverse=True)
+                if spreadsheet_id:
+                    entries = [entry for entry in entries if entry.spreadsheet_id == spreadsheet_id]
+                for entry in entries:
+                    matches = entry.match(tokens)
+                    total += len(matches)
+                    for i in matches[:max(0, limit - len(hits))]:
+                        sheet_index, row, column, value = entry.cells[i]
+                        hits.append({
+                            'spreadsheet_id': entry.spreadsheet_id,
+                            'spreadsheet': entry.title,
+                            'sheet': entry.sheets[sheet_index],
+                            'cell': cell_name(row, column),
+                            'value': value,
+                        })
+        result = {
+            'hits': hits,
+            'total': total,
+            'indexed_spreadsheets': len(self.spreadsheets),
+            'not_indexed': len(self.skipped) + self.pending,
+            'truncated': [entry.spreadsheet_id for entry in self.spreadsheets.values() if entry.truncated],
+        }
+        if self.last_refresh is not None:
+            result['refreshed_seconds_ago'] = round(time.time() - self.last_refresh, 1)
+        return result
+
+    def start(self, services: Callable[[], Tuple[Any, Any]]):
+        """Refresh in a daemon thread every `refresh_interval` seconds.
+
+        `services` builds the (drive, sheets) services the thread uses;
+        Google API clients are not thread-safe, so it must not share the
+        ones tools run on.
+        """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(services,), name='search-index', daemon=True)
+        self._thread.start()
+
+    def follow(self):
+        """Serve the index another worker refreshes, reloading `path` whenever it is saved.
+
+        Needs `path` and `store`; invalidations go to the refreshing worker.
+        """
+        if self._thread is not None:
+            return
+        self.following = True
+        self._thread = threading.Thread(target=self._follow, name='search-index-follow', daemon=True)
+        self._thread.start()
+
+    def request_refresh(self):
+        """Refresh now instead of at the end of the interval"""
+        self._wake.set()
+
+    def _run(self, services: Callable[[], Tuple[Any, Any]]):
+        if not self.spreadsheets:
+            self.load()
+        drive_service, sheets_service = services()
+        while True:
+            try:
+                fetched = self.refresh(drive_service, sheets_service)
+                if fetched:
+                    print(f"Search index: indexed {fetched} spreadsheets, {self.cell_count} cells in total")
+            except Exception as e:
+                print(f"Search index refresh failed: {e}")
+            self._wait()
+
+    def _wait(self):
+        """Until the refresh interval is over or a spreadsheet was invalidated, here or by a follower"""
+        deadline = time.monotonic() + self.refresh_interval
+        while True:
+            remaining = deadline - time.monotonic()
+            if self.store is None:
+                self._wake.wait(max(remaining, 0))
+                break
+            if remaining <= 0 or self._wake.wait(min(remaining, FOLLOW_INTERVAL)):
+                break
+            try:
+                invalidated = self.store.take(INVALIDATIONS_TOPIC)
+            except Exception as e:
+                print(f"Cannot read search index invalidations: {e}")
+                continue
+            if invalidated:
+                for spreadsheet_id in set(invalidated):
+                    self.invalidate(spreadsheet_id)
+                break
+        self._wake.clear()
+
+    def _follow(self):
+        loaded_mtime = None
+        while True:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime is not None and mtime != loaded_mtime:
+                loaded_mtime = mtime
+                if self.load():
+                    self.last_refresh = mtime / 1e9
+            time.sleep(FOLLOW_INTERVAL)
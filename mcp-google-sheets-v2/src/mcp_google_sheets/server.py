@@ -14,6 +14,7 @@ from collections.abc import AsyncIterator
 
 # MCP imports
 from mcp.server.fastmcp import FastMCP, Context
+from pydantic import AnyUrl
 
 # Google API imports
 from google.oauth2.credentials import Credentials
@@ -21,6 +22,17 @@ from google.oauth2 import service_account
 from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.http import HttpRequest
+
+from .a1 import range_name, range_start
+from .catalog import SpreadsheetCatalog
+from .idempotency import IdempotencyStore, idempotent
+from .diff_write import diff_updates
+from .fake_backend import FakeGoogle
+from .search_index import SearchIndex
+from .shared_store import RateLimiter, SharedIdempotencyStore, SharedStore
+from .structure import OperationError, build_batch
+from .subscriptions import SubscriptionPoller
 
 # Constants
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
@@ -30,18 +42,94 @@ CREDENTIALS_PATH = os.environ.get('CREDENTIALS_PATH', 'credentials.json')
 SERVICE_ACCOUNT_PATH = os.environ.get('SERVICE_ACCOUNT_PATH', 'service_account.json')
 DRIVE_FOLDER_ID = os.environ.get('DRIVE_FOLDER_ID', '')  # Working directory in Google Drive
 
+# Local list of the folder's spreadsheets, kept current through the Drive changes feed
+CATALOG_PATH = os.environ.get('CATALOG_PATH', 'spreadsheet_catalog.json')
+CATALOG_SYNC_INTERVAL = float(os.environ.get('CATALOG_SYNC_INTERVAL', '5'))
+
+# Adaptive polling for spreadsheet resource subscriptions, in seconds
+SUBSCRIPTION_POLL_MIN_INTERVAL = float(os.environ.get('SUBSCRIPTION_POLL_MIN_INTERVAL', '5'))
+SUBSCRIPTION_POLL_MAX_INTERVAL = float(os.environ.get('SUBSCRIPTION_POLL_MAX_INTERVAL', '60'))
+
+# Results of write tools called with an idempotency_key, kept for retries
+IDEMPOTENCY_TTL = float(os.environ.get('IDEMPOTENCY_TTL', '600'))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get('IDEMPOTENCY_MAX_ENTRIES', '10000'))
+
+# Full-text search over cell values, kept up to date in the background
+SEARCH_INDEX_ENABLED = os.environ.get('SEARCH_INDEX_ENABLED', 'true').lower() == 'true'
+SEARCH_INDEX_PATH = os.environ.get('SEARCH_INDEX_PATH', 'search_index.json.gz')
+SEARCH_INDEX_MAX_CELLS = int(os.environ.get('SEARCH_INDEX_MAX_CELLS', '1000000'))
+SEARCH_INDEX_REFRESH_INTERVAL = float(os.environ.get('SEARCH_INDEX_REFRESH_INTERVAL', '60'))
+
+# Transport, and worker processes behind a session-affine dispatcher (see workers.py)
+MCP_TRANSPORT = os.environ.get('MCP_TRANSPORT', 'sse')
+MCP_WORKERS = int(os.environ.get('MCP_WORKERS', '1'))
+MCP_WORKER_BASE_PORT = int(os.environ.get('MCP_WORKER_BASE_PORT', '0')) or None
+# Set by the dispatcher in each worker; worker 0 refreshes the search index
+MCP_WORKER_INDEX = os.environ.get('MCP_WORKER_INDEX')
+# SQLite file through which workers share idempotency results and the rate limit
+SHARED_STORE_PATH = os.environ.get('SHARED_STORE_PATH', 'shared_store.sqlite3')
+
+# Google API requests per second over all workers (0 = no limit), and the burst allowed
+GOOGLE_API_RATE_LIMIT = float(os.environ.get('GOOGLE_API_RATE_LIMIT', '0'))
+GOOGLE_API_BURST = float(os.environ.get('GOOGLE_API_BURST', '0'))
+
+# 'fake' serves generated spreadsheets from memory instead of calling Google (benchmarks)
+GOOGLE_API_BACKEND = os.environ.get('GOOGLE_API_BACKEND', 'google')
+FAKE_BACKEND_LATENCY = float(os.environ.get('FAKE_BACKEND_LATENCY', '0.05'))
+FAKE_BACKEND_SPREADSHEETS = int(os.environ.get('FAKE_BACKEND_SPREADSHEETS', '10'))
+
+# Shared by all client sessions; the lifespan runs once per session
+shared_store = SharedStore(SHARED_STORE_PATH) if MCP_WORKERS > 1 else None
+catalog = SpreadsheetCatalog(
+    DRIVE_FOLDER_ID or None,
+    path=CATALOG_PATH,
+    sync_interval=CATALOG_SYNC_INTERVAL
+)
+search_index = SearchIndex(
+    catalog,
+    path=SEARCH_INDEX_PATH,
+    max_cells=SEARCH_INDEX_MAX_CELLS,
+    refresh_interval=SEARCH_INDEX_REFRESH_INTERVAL,
+    store=shared_store
+) if SEARCH_INDEX_ENABLED else None
+if shared_store is not None:
+    idempotency_store = SharedIdempotencyStore(shared_store, ttl=IDEMPOTENCY_TTL, max_entries=IDEMPOTENCY_MAX_ENTRIES)
+else:
+    idempotency_store = IdempotencyStore(ttl=IDEMPOTENCY_TTL, max_entries=IDEMPOTENCY_MAX_ENTRIES)
+api_rate_limiter = RateLimiter(GOOGLE_API_RATE_LIMIT, burst=GOOGLE_API_BURST, store=shared_store)
+fake_google = FakeGoogle(
+    spreadsheets=FAKE_BACKEND_SPREADSHEETS,
+    latency=FAKE_BACKEND_LATENCY,
+    folder_id=DRIVE_FOLDER_ID or None,
+    rate_limiter=api_rate_limiter
+) if GOOGLE_API_BACKEND == 'fake' else None
+subscriptions = SubscriptionPoller(
+    catalog,
+    min_interval=SUBSCRIPTION_POLL_MIN_INTERVAL,
+    max_interval=SUBSCRIPTION_POLL_MAX_INTERVAL
+)
+
+
 @dataclass
 class SpreadsheetContext:
     """Context for Google Spreadsheet service"""
     sheets_service: Any
     drive_service: Any
     folder_id: Optional[str] = None
+    catalog: Optional[SpreadsheetCatalog] = None
+    search_index: Optional[SearchIndex] = None
 
 
-@asynccontextmanager
-async def spreadsheet_lifespan(server: FastMCP) -> AsyncIterator[SpreadsheetContext]:
-    """Manage Google Spreadsheet API connection lifecycle"""
-    # Authenticate and build the service
+class RateLimitedRequest(HttpRequest):
+    """Google API request that waits for the rate limiter before it is sent"""
+
+    def execute(self, http=None, num_retries=0):
+        api_rate_limiter.acquire()
+        return super().execute(http=http, num_retries=num_retries)
+
+
+def google_credentials():
+    """Credentials from CREDENTIALS_CONFIG, the service account file or the OAuth flow"""
     creds = None
 
     if CREDENTIALS_CONFIG:
@@ -80,17 +168,44 @@ async def spreadsheet_lifespan(server: FastMCP) -> AsyncIterator[SpreadsheetCont
             # Save the credentials for the next run
             with open(TOKEN_PATH, 'w') as token:
                 token.write(creds.to_json())
-    
-    # Build the services
-    sheets_service = build('sheets', 'v4', credentials=creds)
-    drive_service = build('drive', 'v3', credentials=creds)
+    return creds
+
+
+def service_factories():
+    """Functions building a Drive and a Sheets service of the configured backend"""
+    if fake_google is not None:
+        return fake_google.drive, fake_google.sheets
+    creds = google_credentials()
+    return (
+        lambda: build('drive', 'v3', credentials=creds, requestBuilder=RateLimitedRequest),
+        lambda: build('sheets', 'v4', credentials=creds, requestBuilder=RateLimitedRequest)
+    )
+
+
+@asynccontextmanager
+async def spreadsheet_lifespan(server: FastMCP) -> AsyncIterator[SpreadsheetContext]:
+    """Manage Google Spreadsheet API connection lifecycle"""
+    build_drive, build_sheets = service_factories()
+    sheets_service = build_sheets()
+    drive_service = build_drive()
+    
+    subscriptions.configure(build_drive)
+    if search_index is not None:
+        if MCP_WORKER_INDEX not in (None, '0') and search_index.path and search_index.store is not None:
+            # Worker 0 keeps the index current, the others reload what it saves
+            search_index.follow()
+        else:
+            # The index thread gets its own clients, they are not thread-safe
+            search_index.start(lambda: (build_drive(), build_sheets()))
     
     try:
         # Provide the service in the context
         yield SpreadsheetContext(
             sheets_service=sheets_service,
             drive_service=drive_service,
-            folder_id=DRIVE_FOLDER_ID if DRIVE_FOLDER_ID else None
+            folder_id=DRIVE_FOLDER_ID if DRIVE_FOLDER_ID else None,
+            catalog=catalog,
+            search_index=search_index
         )
     finally:
         # No explicit cleanup needed for Google APIs
@@ -103,6 +218,14 @@ mcp = FastMCP("Google Spreadsheet",
               lifespan=spreadsheet_lifespan)
 
 
+def mark_changed(ctx: Context, spreadsheet_id: str):
+    """Have the search index and subscribers pick up a write right away"""
+    index = ctx.request_context.lifespan_context.search_index
+    if index is not None:
+        index.invalidate(spreadsheet_id)
+    subscriptions.touch(spreadsheet_id)
+
+
 @mcp.tool()
 def get_sheet_data(spreadsheet_id: str, 
                    sheet: str,
@@ -173,10 +296,13 @@ def get_sheet_formulas(spreadsheet_id: str,
     return formulas
 
 @mcp.tool()
+@idempotent(idempotency_store)
 def update_cells(spreadsheet_id: str,
                 sheet: str,
                 range: str,
                 data: List[List[Any]],
+                mode: str = "overwrite",
+                idempotency_key: Optional[str] = None,
                 ctx: Context = None) -> Dict[str, Any]:
     """
     Update cells in a Google Spreadsheet.
@@ -186,12 +312,23 @@ def update_cells(spreadsheet_id: str,
         sheet: The name of the sheet
         range: Cell range in A1 notation (e.g., 'A1:C10')
         data: 2D array of values to update
+        mode: "overwrite" (default) writes all of data. "diff" first reads the range
+              and writes only the cells whose value changes; use it when rewriting
+              a table in which few cells actually changed.
+        idempotency_key: Optional unique key for this change. Repeating a call with the same
+                         key returns the first call's result instead of applying it again
     
     Returns:
-        Result of the update operation
+        Result of the update operation. In diff mode also the number of cells
+        written and skipped and the request bytes saved.
     """
     sheets_service = ctx.request_context.lifespan_context.sheets_service
     
+    if mode == "diff":
+        return diff_update_cells(ctx, spreadsheet_id, sheet, range, data)
+    if mode != "overwrite":
+        return {"error": f"Unknown mode '{mode}', expected 'overwrite' or 'diff'"}
+    
     # Construct the range
     full_range = f"{sheet}!{range}"
     
@@ -208,13 +345,69 @@ def update_cells(spreadsheet_id: str,
         body=value_range_body
     ).execute()
     
+    mark_changed(ctx, spreadsheet_id)
+    return result
+
+
+def diff_update_cells(ctx: Context,
+                      spreadsheet_id: str,
+                      sheet: str,
+                      range: str,
+                      data: List[List[Any]]) -> Dict[str, Any]:
+    """Write only the cells of data that differ from the sheet"""
+    sheets_service = ctx.request_context.lifespan_context.sheets_service
+    
+    try:
+        start_row, start_column = range_start(range)
+    except ValueError as e:
+        return {"error": str(e)}
+    
+    total = sum(len(row) for row in data)
+    width = max((len(row) for row in data), default=0)
+    if total == 0:
+        return {"spreadsheetId": spreadsheet_id, "updatedCells": 0, "skippedCells": 0, "bytesSaved": 0}
+    
+    # Read exactly the area data covers, as the values would be typed
+    read_range = f"{sheet}!{range_name(start_row, start_column, start_row + len(data) - 1, start_column + width - 1)}"
+    current = sheets_service.spreadsheets().values().get(
+        spreadsheetId=spreadsheet_id,
+        range=read_range,
+        valueRenderOption='FORMULA'
+    ).execute().get('values', [])
+    
+    updates, changed = diff_updates(sheet, start_row, start_column, current, data)
+    full_bytes = len(json.dumps({'range': f"{sheet}!{range}", 'values': data}))
+    sent_bytes = len(json.dumps(updates)) if updates else 0
+    
+    result = {
+        "spreadsheetId": spreadsheet_id,
+        "updatedCells": changed,
+        "skippedCells": total - changed,
+        "updatedRanges": [update['range'] for update in updates],
+        "bytesSaved": full_bytes - sent_bytes
+    }
+    if not updates:
+        return result
+    
+    # All changed blocks in one request
+    sheets_service.spreadsheets().values().batchUpdate(
+        spreadsheetId=spreadsheet_id,
+        body={
+            'valueInputOption': 'USER_ENTERED',
+            'data': updates
+        }
+    ).execute()
+    
+    mark_changed(ctx, spreadsheet_id)
     return result
 
 
 @mcp.tool()
+@idempotent(idempotency_store)
 def batch_update_cells(spreadsheet_id: str,
                        sheet: str,
                        ranges: Dict[str, List[List[Any]]],
+                       idempotency_key: Optional[str] = None,
                        ctx: Context = None) -> Dict[str, Any]:
     """
     Batch update multiple ranges in a Google Spreadsheet.
@@ -224,6 +417,8 @@ def batch_update_cells(spreadsheet_id: str,
         sheet: The name of the sheet
         ranges: Dictionary mapping range strings to 2D arrays of values
                e.g., {'A1:B2': [[1, 2], [3, 4]], 'D1:E2': [['a', 'b'], ['c', 'd']]}
+        idempotency_key: Optional unique key for this change. Repeating a call with the same
+                         key returns the first call's result instead of applying it again
     
     Returns:
         Result of the batch update operation
@@ -250,14 +445,17 @@ def batch_update_cells(spreadsheet_id: str,
         body=batch_body
     ).execute()
     
+    mark_changed(ctx, spreadsheet_id)
     return result
 
 
 @mcp.tool()
+@idempotent(idempotency_store)
 def add_rows(spreadsheet_id: str,
              sheet: str,
              count: int,
              start_row: Optional[int] = None,
+             idempotency_key: Optional[str] = None,
              ctx: Context = None) -> Dict[str, Any]:
     """
     Add rows to a sheet in a Google Spreadsheet.
@@ -267,6 +465,8 @@ def add_rows(spreadsheet_id: str,
         sheet: The name of the sheet
         count: Number of rows to add
         start_row: 0-based row index to start adding. If not provided, adds at the end.
+        idempotency_key: Optional unique key for this change. Repeating a call with the same
+                         key returns the first call's result instead of applying it again
     
     Returns:
         Result of the operation
@@ -308,14 +508,17 @@ def add_rows(spreadsheet_id: str,
         body=request_body
     ).execute()
     
+    mark_changed(ctx, spreadsheet_id)
     return result
 
 
 @mcp.tool()
+@idempotent(idempotency_store)
 def add_columns(spreadsheet_id: str,
                 sheet: str,
                 count: int,
                 start_column: Optional[int] = None,
+                idempotency_key: Optional[str] = None,
                 ctx: Context = None) -> Dict[str, Any]:
     """
     Add columns to a sheet in a Google Spreadsheet.
@@ -325,6 +528,8 @@ def add_columns(spreadsheet_id: str,
         sheet: The name of the sheet
         count: Number of columns to add
         start_column: 0-based column index to start adding. If not provided, adds at the end.
+        idempotency_key: Optional unique key for this change. Repeating a call with the same
+                         key returns the first call's result instead of applying it again
     
     Returns:
         Result of the operation
@@ -366,6 +571,7 @@ def add_columns(spreadsheet_id: str,
         body=request_body
     ).execute()
     
+    mark_changed(ctx, spreadsheet_id)
     return result
 
 
@@ -392,10 +598,12 @@ def list_sheets(spreadsheet_id: str, ctx: Context = None) -> List[str]:
 
 
 @mcp.tool()
+@idempotent(idempotency_store)
 def copy_sheet(src_spreadsheet: str,
                src_sheet: str,
                dst_spreadsheet: str,
                dst_sheet: str,
+               idempotency_key: Optional[str] = None,
                ctx: Context = None) -> Dict[str, Any]:
     """
     Copy a sheet from one spreadsheet to another.
@@ -405,6 +613,8 @@ def copy_sheet(src_spreadsheet: str,
         src_sheet: Source sheet name
         dst_spreadsheet: Destination spreadsheet ID
         dst_sheet: Destination sheet name
+        idempotency_key: Optional unique key for this change. Repeating a call with the same
+                         key returns the first call's result instead of applying it again
     
     Returns:
         Result of the operation
@@ -432,6 +642,8 @@ def copy_sheet(src_spreadsheet: str,
         }
     ).execute()
     
+    mark_changed(ctx, dst_spreadsheet)
+    
     # If destination sheet name is different from the default copied name, rename it
     if 'title' in copy_result and copy_result['title'] != dst_sheet:
         # Get the ID of the newly copied sheet
@@ -466,9 +678,11 @@ def copy_sheet(src_spreadsheet: str,
 
 
 @mcp.tool()
+@idempotent(idempotency_store)
 def rename_sheet(spreadsheet: str,
                  sheet: str,
                  new_name: str,
+                 idempotency_key: Optional[str] = None,
                  ctx: Context = None) -> Dict[str, Any]:
     """
     Rename a sheet in a Google Spreadsheet.
@@ -477,6 +691,8 @@ def rename_sheet(spreadsheet: str,
         spreadsheet: Spreadsheet ID
         sheet: Current sheet name
         new_name: New sheet name
+        idempotency_key: Optional unique key for this change. Repeating a call with the same
+                         key returns the first call's result instead of applying it again
     
     Returns:
         Result of the operation
@@ -516,6 +732,7 @@ def rename_sheet(spreadsheet: str,
         body=request_body
     ).execute()
     
+    mark_changed(ctx, spreadsheet)
     return result
 
 
@@ -667,12 +884,15 @@ def get_spreadsheet_info(spreadsheet_id: str) -> str:
     Returns:
         JSON string with spreadsheet information
     """
-    # Access the context through mcp.get_lifespan_context() for resources
-    context = mcp.get_lifespan_context()
+    # Resources get no ctx argument, the request context is reached through the server
+    context = mcp.get_context().request_context.lifespan_context
     sheets_service = context.sheets_service
     
-    # Get spreadsheet metadata
-    spreadsheet = sheets_service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
+    # Get spreadsheet metadata, without the cell data
+    spreadsheet = sheets_service.spreadsheets().get(
+        spreadsheetId=spreadsheet_id,
+        fields='properties(title),sheets(properties(sheetId,title,gridProperties))'
+    ).execute()
     
     # Extract relevant information
     info = {
@@ -690,13 +910,39 @@ def get_spreadsheet_info(spreadsheet_id: str) -> str:
     return json.dumps(info, indent=2)
 
 
+@mcp._mcp_server.subscribe_resource()
+async def subscribe_resource(uri: AnyUrl):
+    """Send notifications/resources/updated when the spreadsheet changes"""
+    await subscriptions.subscribe(mcp._mcp_server.request_context.session, str(uri))
+
+
+@mcp._mcp_server.unsubscribe_resource()
+async def unsubscribe_resource(uri: AnyUrl):
+    await subscriptions.unsubscribe(mcp._mcp_server.request_context.session, str(uri))
+
+
+def get_capabilities_with_subscribe(notification_options, experimental_capabilities):
+    """Advertise resource subscriptions, which the MCP SDK always reports as unsupported"""
+    capabilities = _get_capabilities(notification_options, experimental_capabilities)
+    if capabilities.resources is not None:
+        capabilities.resources.subscribe = True
+    return capabilities
+
+
+_get_capabilities = mcp._mcp_server.get_capabilities
+mcp._mcp_server.get_capabilities = get_capabilities_with_subscribe
+
+
 @mcp.tool()
-def create_spreadsheet(title: str, ctx: Context = None) -> Dict[str, Any]:
+@idempotent(idempotency_store)
+def create_spreadsheet(title: str, idempotency_key: Optional[str] = None, ctx: Context = None) -> Dict[str, Any]:
     """
     Create a new Google Spreadsheet.
     
     Args:
         title: The title of the new spreadsheet
+        idempotency_key: Optional unique key for this change. Repeating a call with the same
+                         key returns the first call's result instead of applying it again
     
     Returns:
         Information about the newly created spreadsheet including its ID
@@ -744,6 +990,8 @@ def create_spreadsheet(title: str, ctx: Context = None) -> Dict[str, Any]:
         except Exception as e:
             print(f"Warning: Could not move spreadsheet to folder: {e}")
     
+    ctx.request_context.lifespan_context.catalog.expire()
+    mark_changed(ctx, spreadsheet_id)
     return {
         'spreadsheetId': spreadsheet_id,
         'title': spreadsheet.get('properties', {}).get('title', title),
@@ -753,8 +1001,10 @@ def create_spreadsheet(title: str, ctx: Context = None) -> Dict[str, Any]:
 
 
 @mcp.tool()
+@idempotent(idempotency_store)
 def create_sheet(spreadsheet_id: str, 
                 title: str, 
+                idempotency_key: Optional[str] = None,
                 ctx: Context = None) -> Dict[str, Any]:
     """
     Create a new sheet tab in an existing Google Spreadsheet.
@@ -762,6 +1012,8 @@ def create_sheet(spreadsheet_id: str,
     Args:
         spreadsheet_id: The ID of the spreadsheet
         title: The title for the new sheet
+        idempotency_key: Optional unique key for this change. Repeating a call with the same
+                         key returns the first call's result instead of applying it again
     
     Returns:
         Information about the newly created sheet
@@ -787,6 +1039,8 @@ def create_sheet(spreadsheet_id: str,
         body=request_body
     ).execute()
     
+    mark_changed(ctx, spreadsheet_id)
+    
     # Extract the new sheet information
     new_sheet_props = result['replies'][0]['addSheet']['properties']
     
@@ -799,43 +1053,138 @@ def create_sheet(spreadsheet_id: str,
 
 
 @mcp.tool()
-def list_spreadsheets(ctx: Context = None) -> List[Dict[str, str]]:
+@idempotent(idempotency_store)
+def batch_structure(spreadsheet_id: str,
+                    operations: List[Dict[str, Any]],
+                    idempotency_key: Optional[str] = None,
+                    ctx: Context = None) -> Dict[str, Any]:
+    """
+    Apply several structural changes to a spreadsheet in one atomic request,
+    e.g. create a report tab, write its header, freeze it and rename the old tab.
+    Either all operations are applied or none is. Operations run in order and can
+    refer to sheets created or renamed by earlier operations by their new title.
+    
+    Args:
+        spreadsheet_id: The ID of the spreadsheet (found in the URL)
+        operations: Ordered list of operations, each an object with an "op" key:
+            - {"op": "create_sheet", "title": str, "index": int?, "rows": int?, "columns": int?}
+            - {"op": "rename_sheet", "sheet": str, "new_name": str}
+            - {"op": "delete_sheet", "sheet": str}
+            - {"op": "add_rows", "sheet": str, "count": int, "start_row": int?} (appends if no start_row)
+            - {"op": "add_columns", "sheet": str, "count": int, "start_column": int?} (appends if no start_column)
+            - {"op": "delete_rows", "sheet": str, "start": int, "count": int}
+            - {"op": "delete_columns", "sheet": str, "start": int, "count": int}
+            - {"op": "freeze", "sheet": str, "rows": int?, "columns": int?}
+            - {"op": "write", "sheet": str, "data": 2D array, "start_row": int?, "start_column": int?}
+            Row and column indexes are 0-based. Values starting with '=' are written as formulas.
+        idempotency_key: Optional unique key for this change. Repeating a call with the same
+                         key returns the first call's result instead of applying it again
+    
+    Returns:
+        One result per operation with the sheet name and sheetId it applied to,
+        or an error naming the first invalid operation (nothing is applied then)
+    """
+    sheets_service = ctx.request_context.lifespan_context.sheets_service
+    
+    if not operations:
+        return {"error": "No operations given"}
+    
+    # One metadata fetch resolves every sheet title in the batch
+    spreadsheet = sheets_service.spreadsheets().get(
+        spreadsheetId=spreadsheet_id,
+        fields='sheets(properties(sheetId,title))'
+    ).execute()
+    
+    try:
+        batch = build_batch(spreadsheet.get('sheets', []), operations)
+    except OperationError as e:
+        return {"error": str(e), "operation": e.index}
+    
+    result = sheets_service.spreadsheets().batchUpdate(
+        spreadsheetId=spreadsheet_id,
+        body={"requests": batch.requests}
+    ).execute()
+    
+    mark_changed(ctx, spreadsheet_id)
+    return {
+        "spreadsheetId": spreadsheet_id,
+        "results": batch.results(result.get('replies', []))
+    }
+
+
+@mcp.tool()
+def list_spreadsheets(title_contains: Optional[str] = None,
+                      modified_after: Optional[str] = None,
+                      offset: int = 0,
+                      limit: Optional[int] = None,
+                      ctx: Context = None) -> List[Dict[str, str]]:
     """
     List all spreadsheets in the configured Google Drive folder.
     If no folder is configured, lists spreadsheets from 'My Drive'.
+    Spreadsheets are listed most recently modified first.
+    
+    Args:
+        title_contains: Optional text the title must contain (case-insensitive)
+        modified_after: Optional RFC 3339 UTC timestamp, e.g. '2024-05-01T00:00:00Z',
+                        to list only spreadsheets modified after it
+        offset: Number of matching spreadsheets to skip (default: 0)
+        limit: Optional maximum number of spreadsheets to return (default: all)
     
     Returns:
-        List of spreadsheets with their ID and title
+        List of spreadsheets with their ID, title and last modification time
     """
     drive_service = ctx.request_context.lifespan_context.drive_service
-    folder_id = ctx.request_context.lifespan_context.folder_id
-    
-    query = "mimeType='application/vnd.google-apps.spreadsheet'"
+    catalog = ctx.request_context.lifespan_context.catalog
+    
+    # Served from the local catalog; Drive is only asked what changed
+    catalog.sync(drive_service)
+    spreadsheets = catalog.lookup(
+        title_contains=title_contains,
+        modified_after=modified_after,
+        offset=offset,
+        limit=limit
+    )
+    
+    return [
+        {'id': sheet['id'], 'title': sheet['name'], 'modifiedTime': sheet.get('modifiedTime', '')}
+        for sheet in spreadsheets
+    ]
+
+
+@mcp.tool()
+def search_cells(query: str,
+                 spreadsheet_id: Optional[str] = None,
+                 limit: int = 20,
+                 ctx: Context = None) -> Dict[str, Any]:
+    """
+    Find cells containing all words of a query across the spreadsheets in the folder,
+    e.g. which sheet mentions a customer, an order number or an email. Much faster
+    than reading sheets with get_sheet_data. Matching ignores case; the last word
+    also matches as a prefix.
     
-    # If a specific folder is configured, search only in that folder
-    if folder_id:
-        query += f" and '{folder_id}' in parents"
-        print(f"Searching for spreadsheets in folder: {folder_id}")
-    else:
-        print("Searching for spreadsheets in 'My Drive'")
-    
-    # List spreadsheets
-    results = drive_service.files().list(
-        q=query,
-        spaces='drive',
-        fields='files(id, name)',
-        orderBy='modifiedTime desc'
-    ).execute()
+    Args:
+        query: Words to look for
+        spreadsheet_id: Optional ID to search a single spreadsheet
+        limit: Maximum number of hits to return (default: 20)
     
-    spreadsheets = results.get('files', [])
+    Returns:
+        Hits with spreadsheet_id, spreadsheet, sheet, cell (A1) and value, the total
+        number of matches, and how many spreadsheets are not indexed (yet). Recent
+        changes can take up to a minute to show up.
+    """
+    index = ctx.request_context.lifespan_context.search_index
+    if index is None:
+        return {"error": "Search is disabled (SEARCH_INDEX_ENABLED=false)"}
     
-    return [{'id': sheet['id'], 'title': sheet['name']} for sheet in spreadsheets]
+    return index.search(query, spreadsheet_id=spreadsheet_id, limit=limit)
 
 
 @mcp.tool()
+@idempotent(idempotency_store)
 def share_spreadsheet(spreadsheet_id: str, 
                       recipients: List[Dict[str, str]],
                       send_notification: bool = True,
+                      idempotency_key: Optional[str] = None,
                       ctx: Context = None) -> Dict[str, List[Dict[str, Any]]]:
     """
     Share a Google Spreadsheet with multiple users via email, assigning specific roles.
@@ -849,6 +1198,8 @@ def share_spreadsheet(spreadsheet_id: str,
                         {'email_address': 'user2@example.com', 'role': 'reader'}
                     ]
         send_notification: Whether to send a notification email to the users. Defaults to True.
+        idempotency_key: Optional unique key for this change. Repeating a call with the same
+                         key returns the first call's result instead of applying it again
 
     Returns:
         A dictionary containing lists of 'successes' and 'failures'. 
@@ -911,7 +1262,13 @@ def share_spreadsheet(spreadsheet_id: str,
     return {"successes": successes, "failures": failures}
 
 def main():
-    # Run the server
-    mcp.run(transport="sse")
-
-main()  
\ No newline at end of file
+    # Run the server, or the workers and their dispatcher
+    if MCP_WORKERS > 1 and MCP_WORKER_INDEX is None:
+        from .workers import serve
+        serve(mcp.settings, MCP_WORKERS, MCP_TRANSPORT, base_port=MCP_WORKER_BASE_PORT, store_path=SHARED_STORE_PATH)
+    else:
+        if MCP_WORKER_INDEX is not None:
+            from .workers import exit_with_supervisor
+            exit_with_supervisor()
+        mcp.run(transport=MCP_TRANSPORT)
+  
\ No newline at end of file
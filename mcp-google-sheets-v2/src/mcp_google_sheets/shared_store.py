@@ -0,0 +1,209 @@
+"""
+State shared by the worker processes of one server (see workers.py).
+
+A SQLite database in WAL mode on local disk holds what has to be the same
+in every worker: the results of idempotent writes, so a retry that lands
+on another worker still gets the first call's result; the token bucket
+that paces Google API requests of all workers together; and a small
+message queue, through which workers tell the one refreshing the search
+index what they changed. Each thread opens its own connection; every
+read-modify-write runs in a `BEGIN IMMEDIATE` transaction.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Optional
+
+from .idempotency import IdempotencyStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    result TEXT,
+    expiry REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idempotency_expiry ON idempotency (expiry);
+CREATE TABLE IF NOT EXISTS rate_limits (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic TEXT NOT NULL,
+    item TEXT NOT NULL
+);
+"""
+
+
+class SharedStore:
+    """SQLite database shared by the processes of one server"""
+
+    def __init__(self, path: str, timeout: float = 30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection().executescript(SCHEMA)
+
+    def connection(self) -> sqlite3.Connection:
+        """The calling thread's connection, in autocommit mode"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Write transaction; other processes wait up to `timeout` for it"""
+        db = self.connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def post(self, topic: str, item: str):
+        """Queue `item` for the process that takes `topic`"""
+        with self.transaction() as db:
+            db.execute('INSERT INTO messages (topic, item) VALUES (?, ?)', (topic, item))
+
+    def take(self, topic: str) -> List[str]:
+        """Remove and return the items queued for `topic`, oldest first"""
+        with self.transaction() as db:
+            rows = db.execute('SELECT id, item FROM messages WHERE topic = ? ORDER BY id', (topic,)).fetchall()
+            if rows:
+                db.execute('DELETE FROM messages WHERE topic = ? AND id <= ?', (topic, rows[-1][0]))
+        return [item for _, item in rows]
+
+
+class SharedIdempotencyStore(IdempotencyStore):
+    """IdempotencyStore whose results and in-flight calls are seen by every worker.
+
+    A key being run is a row without a result. Duplicates in any worker
+    poll it until the result is stored, or the row is removed because the
+    call failed; polling blocks the worker's thread like the tool call
+    itself. A worker that dies mid-call leaves a row that expires after
+    `lease` seconds. Results must be JSON serializable.
+    """
+
+    def __init__(self,
+                 store: SharedStore,
+                 ttl: float = 600.0,
+                 max_entries: int = 10000,
+                 lease: float = 300.0,
+                 poll_interval: float = 0.05):
+        super().__init__(ttl=ttl, max_entries=max_entries)
+        self.store = store
+        self.lease = lease
+        self.poll_interval = poll_interval
+
+    def run(self, key: str, fingerprint: str, call: Callable[[], Any]) -> Any:
+        while True:
+            with self.store.transaction() as db:
+                now = time.time()
+                db.execute('DELETE FROM idempotency WHERE expiry <= ?', (now,))
+                row = db.execute('SELECT fingerprint, result FROM idempotency WHERE key = ?', (key,)).fetchone()
+                if row is None:
+                    db.execute(
+                        'INSERT INTO idempotency (key, fingerprint, result, expiry) VALUES (?, ?, NULL, ?)',
+                        (key, fingerprint, now + self.lease)
+                    )
+                    break
+            if row[0] != fingerprint:
+                return self._mismatch(key)
+            if row[1] is not None:
+                self.hits += 1
+                return json.loads(row[1])
+            time.sleep(self.poll_interval)
+
+        try:
+            result = call()
+        except BaseException:
+            with self.store.transaction() as db:
+                db.execute('DELETE FROM idempotency WHERE key = ? AND result IS NULL', (key,))
+            raise
+        with self.store.transaction() as db:
+            db.execute(
+                'UPDATE idempotency SET result = ?, expiry = ? WHERE key = ?',
+                (json.dumps(result, default=str), time.time() + self.ttl, key)
+            )
+            self._evict_rows(db)
+        return result
+
+    def _evict_rows(self, db: sqlite3.Connection):
+        excess = db.execute('SELECT COUNT(*) FROM idempotency').fetchone()[0] - self.max_entries
+        if excess > 0:
+            db.execute(
+                'DELETE FROM idempotency WHERE key IN ('
+                'SELECT key FROM idempotency WHERE result IS NOT NULL ORDER BY expiry LIMIT ?)',
+                (excess,)
+            )
+
+
+class RateLimiter:
+    """Token bucket of `rate` requests per second with bursts up to `burst`.
+
+    With a store the bucket is a row of it and all workers draw from the
+    same one, otherwise it is per process. `acquire` blocks the calling
+    thread like the API request it precedes. A rate of 0 means no limit.
+    """
+
+    def __init__(self,
+                 rate: float,
+                 burst: Optional[float] = None,
+                 store: Optional[SharedStore] = None,
+                 name: str = 'google_api'):
+        self.rate = rate
+        self.burst = max(burst if burst else rate, 1.0)
+        self.store = store
+        self.name = name
+        self.waited = 0.0
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait for and take one token"""
+        if self.rate <= 0:
+            return
+        while True:
+            wait = self._take()
+            if wait <= 0:
+                return
+            self.waited += wait
+            time.sleep(wait)
+
+    def _take(self) -> float:
+        """Take a token if there is one, else return the seconds until there is"""
+        if self.store is None:
+            with self._lock:
+                self._tokens, self._updated, wait = self._refill(self._tokens, self._updated)
+            return wait
+        with self.store.transaction() as db:
+            row = db.execute('SELECT tokens, updated FROM rate_limits WHERE name = ?', (self.name,)).fetchone()
+            tokens, updated, wait = self._refill(*(row or (self.burst, time.time())))
+            db.execute(
+                'INSERT OR REPLACE INTO rate_limits (name, tokens, updated) VALUES (?, ?, ?)',
+                (self.name, tokens, updated)
+            )
+        return wait
+
+    def _refill(self, tokens: float, updated: float):
+        now = time.time()
+        tokens = min(self.burst, tokens + max(now - updated, 0.0) * self.rate)
+        if tokens >= 1:
+            return tokens - 1, now, 0.0
+        return tokens, now, (1 - tokens) / self.rate
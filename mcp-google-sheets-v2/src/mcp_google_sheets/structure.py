@@ -0,0 +1,242 @@
+"""
+Translate high-level structural operations into one spreadsheets().batchUpdate.
+
+Sheet titles are resolved against a single metadata fetch and then tracked
+through the batch: a sheet created (with a sheetId chosen here) or renamed
+by an earlier operation can be referenced by its new title later on.
+Google applies the requests of a batchUpdate atomically, so either every
+operation takes effect or none does.
+"""
+
+import random
+from typing import Any, Dict, List, Optional, Tuple
+
+# Largest sheetId accepted by the Sheets API
+MAX_SHEET_ID = 2 ** 31 - 1
+
+OPERATIONS = (
+    'create_sheet', 'rename_sheet', 'delete_sheet', 'add_rows', 'add_columns',
+    'delete_rows', 'delete_columns', 'freeze', 'write',
+)
+
+
+class OperationError(ValueError):
+    """An operation is malformed or refers to a sheet that does not exist"""
+
+    def __init__(self, index: int, message: str):
+        super().__init__(f"Operation {index}: {message}")
+        self.index = index
+
+
+def cell_data(value: Any) -> Dict[str, Any]:
+    """A value as the API's CellData, formulas starting with '='"""
+    if value is None or value == '':
+        return {}
+    if isinstance(value, bool):
+        return {'userEnteredValue': {'boolValue': value}}
+    if isinstance(value, (int, float)):
+        return {'userEnteredValue': {'numberValue': value}}
+    value = str(value)
+    if value.startswith('='):
+        return {'userEnteredValue': {'formulaValue': value}}
+    return {'userEnteredValue': {'stringValue': value}}
+
+
+class StructureBatch:
+    """Builds the requests of a batch and describes what each operation did"""
+
+    def __init__(self, sheets: List[Dict[str, Any]]):
+        # title -> sheetId as the batch will have left them so far
+        self.sheet_ids: Dict[str, int] = {
+            sheet['properties']['title']: sheet['properties']['sheetId'] for sheet in sheets
+        }
+        self.used_ids = set(self.sheet_ids.values())
+        self.requests: List[Dict[str, Any]] = []
+        # For each operation: (its result, index of its first request, number of requests)
+        self.operations: List[Tuple[Dict[str, Any], int, int]] = []
+
+    def add(self, index: int, operation: Dict[str, Any]):
+        op = operation.get('op')
+        if op not in OPERATIONS:
+            raise OperationError(index, f"unknown op '{op}', expected one of: {', '.join(OPERATIONS)}")
+        first = len(self.requests)
+        result = getattr(self, f"_{op}")(index, operation)
+        self.operations.append((result, first, len(self.requests) - first))
+
+    def results(self, replies: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Per-operation results, with the replies of their requests"""
+        results = []
+        for result, first, count in self.operations:
+            reply = [r for r in replies[first:first + count] if r]
+            if reply:
+                result['reply'] = reply[0] if len(reply) == 1 else reply
+            results.append(result)
+        return results
+
+    def _sheet_id(self, index: int, operation: Dict[str, Any], key: str = 'sheet') -> int:
+        title = operation.get(key)
+        if title not in self.sheet_ids:
+            raise OperationError(index, f"sheet '{title}' not found")
+        return self.sheet_ids[title]
+
+    def _count(self, index: int, operation: Dict[str, Any], key: str = 'count') -> int:
+        count = operation.get(key)
+        if not isinstance(count, int) or isinstance(count, bool) or count < 1:
+            raise OperationError(index, f"'{key}' must be a positive integer")
+        return count
+
+    def _start(self, index: int, operation: Dict[str, Any], key: str, required: bool = False) -> Optional[int]:
+        start = operation.get(key)
+        if start is None and not required:
+            return None
+        if not isinstance(start, int) or isinstance(start, bool) or start < 0:
+            raise OperationError(index, f"'{key}' must be a 0-based index")
+        return start
+
+    def _new_sheet_id(self) -> int:
+        while True:
+            sheet_id = random.randint(1, MAX_SHEET_ID)
+            if sheet_id not in self.used_ids:
+                self.used_ids.add(sheet_id)
+                return sheet_id
+
+    def _create_sheet(self, index: int, operation: Dict[str, Any]) -> Dict[str, Any]:
+        title = operation.get('title')
+        if not title:
+            raise OperationError(index, "'title' is required")
+        if title in self.sheet_ids:
+            raise OperationError(index, f"a sheet named '{title}' already exists")
+        sheet_id = self._new_sheet_id()
+        properties: Dict[str, Any] = {'sheetId': sheet_id, 'title': title}
+        if operation.get('index') is not None:
+            properties['index'] = operation['index']
+        grid = {}
+        if operation.get('rows') is not None:
+            grid['rowCount'] = self._count(index, operation, 'rows')
+        if operation.get('columns') is not None:
+            grid['columnCount'] = self._count(index, operation, 'columns')
+        if grid:
+            properties['gridProperties'] = grid
+        self.requests.append({'addSheet': {'properties': properties}})
+        self.sheet_ids[title] = sheet_id
+        return {'op': 'create_sheet', 'sheet': title, 'sheetId': sheet_id}
+
+    def _rename_sheet(self, index: int, operation: Dict[str, Any]) -> Dict[str, Any]:
+        sheet_id = self._sheet_id(index, operation)
+        new_name = operation.get('new_name')
+        if not new_name:
+            raise OperationError(index, "'new_name' is required")
+        if new_name in self.sheet_ids:
+            raise OperationError(index, f"a sheet named '{new_name}' already exists")
+        self.requests.append({
+            'updateSheetProperties': {
+                'properties': {'sheetId': sheet_id, 'title': new_name},
+                'fields': 'title'
+            }
+        })
+        del self.sheet_ids[operation['sheet']]
+        self.sheet_ids[new_name] = sheet_id
+        return {'op': 'rename_sheet', 'sheet': new_name, 'sheetId': sheet_id}
+
+    def _delete_sheet(self, index: int, operation: Dict[str, Any]) -> Dict[str, Any]:
+        sheet_id = self._sheet_id(index, operation)
+        self.requests.append({'deleteSheet': {'sheetId': sheet_id}})
+        del self.sheet_ids[operation['sheet']]
+        return {'op': 'delete_sheet', 'sheet': operation['sheet'], 'sheetId': sheet_id}
+
+    def _insert(self, index: int, operation: Dict[str, Any], dimension: str, start_key: str) -> Dict[str, Any]:
+        sheet_id = self._sheet_id(index, operation)
+        count = self._count(index, operation)
+        start = self._start(index, operation, start_key)
+        if start is None:
+            self.requests.append({
+                'appendDimension': {'sheetId': sheet_id, 'dimension': dimension, 'length': count}
+            })
+        else:
+            self.requests.append({
+                'insertDimension': {
+                    'range': {
+                        'sheetId': sheet_id,
+                        'dimension': dimension,
+                        'startIndex': start,
+                        'endIndex': start + count
+                    },
+                    'inheritFromBefore': start > 0
+                }
+            })
+        return {'op': operation['op'], 'sheet': operation['sheet'], 'sheetId': sheet_id, 'count': count}
+
+    def _add_rows(self, index: int, operation: Dict[str, Any]) -> Dict[str, Any]:
+        return self._insert(index, operation, 'ROWS', 'start_row')
+
+    def _add_columns(self, index: int, operation: Dict[str, Any]) -> Dict[str, Any]:
+        return self._insert(index, operation, 'COLUMNS', 'start_column')
+
+    def _delete(self, index: int, operation: Dict[str, Any], dimension: str) -> Dict[str, Any]:
+        sheet_id = self._sheet_id(index, operation)
+        count = self._count(index, operation)
+        start = self._start(index, operation, 'start', required=True)
+        self.requests.append({
+            'deleteDimension': {
+                'range': {
+                    'sheetId': sheet_id,
+                    'dimension': dimension,
+                    'startIndex': start,
+                    'endIndex': start + count
+                }
+            }
+        })
+        return {'op': operation['op'], 'sheet': operation['sheet'], 'sheetId': sheet_id, 'count': count}
+
+    def _delete_rows(self, index: int, operation: Dict[str, Any]) -> Dict[str, Any]:
+        return self._delete(index, operation, 'ROWS')
+
+    def _delete_columns(self, index: int, operation: Dict[str, Any]) -> Dict[str, Any]:
+        return self._delete(index, operation, 'COLUMNS')
+
+    def _freeze(self, index: int, operation: Dict[str, Any]) -> Dict[str, Any]:
+        sheet_id = self._sheet_id(index, operation)
+        grid = {}
+        for key, field in (('rows', 'frozenRowCount'), ('columns', 'frozenColumnCount')):
+            if operation.get(key) is not None:
+                grid[field] = operation[key]
+        if not grid:
+            raise OperationError(index, "'rows' or 'columns' is required")
+        self.requests.append({
+            'updateSheetProperties': {
+                'properties': {'sheetId': sheet_id, 'gridProperties': grid},
+                'fields': ','.join(f"gridProperties.{field}" for field in grid)
+            }
+        })
+        return {'op': 'freeze', 'sheet': operation['sheet'], 'sheetId': sheet_id, **grid}
+
+    def _write(self, index: int, operation: Dict[str, Any]) -> Dict[str, Any]:
+        sheet_id = self._sheet_id(index, operation)
+        data = operation.get('data')
+        if not isinstance(data, list) or not all(isinstance(row, list) for row in data):
+            raise OperationError(index, "'data' must be a 2D array of values")
+        start_row = self._start(index, operation, 'start_row') or 0
+        start_column = self._start(index, operation, 'start_column') or 0
+        self.requests.append({
+            'updateCells': {
+                'start': {'sheetId': sheet_id, 'rowIndex': start_row, 'columnIndex': start_column},
+                'rows': [{'values': [cell_data(value) for value in row]} for row in data],
+                'fields': 'userEnteredValue'
+            }
+        })
+        return {
+            'op': 'write',
+            'sheet': operation['sheet'],
+            'sheetId': sheet_id,
+            'cells': sum(len(row) for row in data)
+        }
+
+
+def build_batch(sheets: List[Dict[str, Any]], operations: List[Dict[str, Any]]) -> StructureBatch:
+    """Validate `operations` against the current sheets and build their requests"""
+    batch = StructureBatch(sheets)
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise OperationError(index, "expected an object with an 'op' key")
+        batch.add(index, operation)
+    return batch
@@ -0,0 +1,154 @@
+"""
+Change notifications for subscribed spreadsheet resources.
+
+Clients subscribe to `spreadsheet://{id}/info` instead of polling it. One
+poller shared by every session checks the subscribed spreadsheets' Drive
+`modifiedTime` and sends `notifications/resources/updated` to the
+subscribers of those that changed. Spreadsheets in the catalog are checked
+through its changes feed, others with one files().get each, so the cost of
+a poll depends on the number of spreadsheets, not on the number of clients.
+The poll interval doubles while nothing changes and drops back to the
+minimum as soon as something does.
+"""
+
+import asyncio
+import re
+from typing import Any, Callable, Dict, Optional, Set
+
+from googleapiclient.errors import HttpError
+from pydantic import AnyUrl
+
+from .catalog import SpreadsheetCatalog
+
+RESOURCE_URI = "spreadsheet://{spreadsheet_id}/info"
+RESOURCE_URI_PATTERN = re.compile(r"^spreadsheet://([^/]+)/info$")
+
+
+def spreadsheet_id_from_uri(uri: str) -> str:
+    match = RESOURCE_URI_PATTERN.match(uri)
+    if match is None:
+        raise ValueError(f"Unknown resource '{uri}', expected {RESOURCE_URI}")
+    return match.group(1)
+
+
+class SubscriptionPoller:
+    """Tracks resource subscriptions per session and polls Drive for them"""
+
+    def __init__(self,
+                 catalog: Optional[SpreadsheetCatalog],
+                 min_interval: float = 5.0,
+                 max_interval: float = 60.0):
+        self.catalog = catalog
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        # spreadsheet id -> sessions subscribed to it
+        self.subscribers: Dict[str, Set[Any]] = {}
+        # spreadsheet id -> modifiedTime seen on the last poll
+        self.modified: Dict[str, str] = {}
+        # Spreadsheets written through this server since the last poll
+        self.touched: Set[str] = set()
+        self._drive_factory: Optional[Callable[[], Any]] = None
+        self._drive_service = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+
+    def configure(self, drive_factory: Callable[[], Any]):
+        """Set how the poller builds its own Drive client"""
+        if self._drive_factory is None:
+            self._drive_factory = drive_factory
+
+    async def subscribe(self, session, uri: str):
+        spreadsheet_id = spreadsheet_id_from_uri(uri)
+        self.subscribers.setdefault(spreadsheet_id, set()).add(session)
+        self.interval = self.min_interval
+        if self._task is None or self._task.done():
+            self._loop = asyncio.get_running_loop()
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        else:
+            self._wake.set()
+
+    async def unsubscribe(self, session, uri: str):
+        spreadsheet_id = spreadsheet_id_from_uri(uri)
+        self._remove(spreadsheet_id, session)
+
+    def touch(self, spreadsheet_id: str):
+        """Notify subscribers of a spreadsheet this server just wrote to.
+
+        May be called from any thread.
+        """
+        if spreadsheet_id not in self.subscribers or self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._touch, spreadsheet_id)
+
+    def _touch(self, spreadsheet_id: str):
+        self.touched.add(spreadsheet_id)
+        self._wake.set()
+
+    def _remove(self, spreadsheet_id: str, session):
+        sessions = self.subscribers.get(spreadsheet_id)
+        if sessions is None:
+            return
+        sessions.discard(session)
+        if not sessions:
+            del self.subscribers[spreadsheet_id]
+            self.modified.pop(spreadsheet_id, None)
+
+    async def _run(self):
+        while self.subscribers:
+            try:
+                modified = await asyncio.to_thread(self._poll, list(self.subscribers))
+            except Exception as e:
+                print(f"Subscription poll failed: {e}")
+                modified = {}
+            changed = set(self.touched)
+            self.touched.clear()
+            for spreadsheet_id, modified_time in modified.items():
+                previous = self.modified.get(spreadsheet_id)
+                if previous is not None and previous != modified_time:
+                    changed.add(spreadsheet_id)
+                self.modified[spreadsheet_id] = modified_time
+            for spreadsheet_id in changed:
+                await self._notify(spreadsheet_id)
+
+            if changed:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * 2, self.max_interval)
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def _poll(self, spreadsheet_ids) -> Dict[str, str]:
+        """modifiedTime of each spreadsheet, read in a worker thread"""
+        if self._drive_service is None:
+            self._drive_service = self._drive_factory()
+        modified = {}
+        if self.catalog is not None:
+            self.catalog.sync(self._drive_service)
+        for spreadsheet_id in spreadsheet_ids:
+            entry = self.catalog.get(spreadsheet_id) if self.catalog is not None else None
+            if entry is None:
+                try:
+                    entry = self._drive_service.files().get(
+                        fileId=spreadsheet_id,
+                        fields='modifiedTime'
+                    ).execute()
+                except HttpError as e:
+                    print(f"Cannot check spreadsheet {spreadsheet_id} for changes: {e}")
+                    continue
+            modified[spreadsheet_id] = entry.get('modifiedTime', '')
+        return modified
+
+    async def _notify(self, spreadsheet_id: str):
+        uri = AnyUrl(RESOURCE_URI.format(spreadsheet_id=spreadsheet_id))
+        for session in list(self.subscribers.get(spreadsheet_id, ())):
+            try:
+                await session.send_resource_updated(uri)
+            except Exception:
+                # The client is gone
+                self._remove(spreadsheet_id, session)
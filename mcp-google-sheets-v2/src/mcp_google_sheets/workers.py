@@ -0,0 +1,286 @@
+"""
+Serve the MCP endpoint from several worker processes.
+
+Tools are synchronous and block the event loop while they wait for Google,
+so one process serves one tool call at a time. `serve` starts `count`
+copies of the server on local ports and a dispatcher on the public host
+and port that pins every MCP session to one worker: the SSE stream and the
+messages posted for it, or all requests carrying a streamable HTTP
+`mcp-session-id`, go to the worker that holds the session. New sessions go
+to the worker with the fewest open ones. A worker that exits is started
+again; its sessions are lost and their clients reconnect.
+
+Workers share idempotency results, the Google API rate limit and the
+search index through the shared store (see shared_store.py).
+"""
+
+import asyncio
+import itertools
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+import anyio
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+SESSION_HEADER = 'mcp-session-id'
+
+# The SSE transport's first event names the URL to post messages to
+SSE_SESSION_PATTERN = re.compile(rb"session_id=([0-9a-fA-F]+)")
+
+# Not forwarded either way; Host is, so redirects of workers point to the dispatcher
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailers', 'transfer-encoding', 'upgrade',
+}
+
+
+def wait_for_port(host: str, port: int, timeout: float, process: Optional[subprocess.Popen] = None):
+    """Block until something accepts connections on host:port"""
+    deadline = time.monotonic() + timeout
+    while True:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Worker on port {port} exited with code {process.returncode}")
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Nothing listening on {host}:{port} after {timeout}s")
+            time.sleep(0.1)
+
+
+def exit_with_supervisor(interval: float = 1.0):
+    """In a worker: exit once the supervisor is gone, even if it was killed without stopping us"""
+    supervisor = os.getppid()
+
+    def watch():
+        while os.getppid() == supervisor:
+            time.sleep(interval)
+        print("Supervisor exited, stopping worker")
+        os._exit(0)
+
+    threading.Thread(target=watch, name='supervisor-watch', daemon=True).start()
+
+
+class WorkerPool:
+    """Worker processes running the server on 127.0.0.1:base_port + index"""
+
+    def __init__(self, count: int, base_port: int, env: Dict[str, str]):
+        self.ports = [base_port + i for i in range(count)]
+        self.env = env
+        self.processes: List[Optional[subprocess.Popen]] = [None] * count
+        self.restarts = 0
+
+    def start(self, index: int):
+        env = dict(
+            self.env,
+            FASTMCP_HOST='127.0.0.1',
+            FASTMCP_PORT=str(self.ports[index]),
+            MCP_WORKER_INDEX=str(index),
+        )
+        self.processes[index] = subprocess.Popen([sys.executable, '-m', 'mcp_google_sheets'], env=env)
+
+    def start_all(self, timeout: float = 60.0):
+        for index in range(len(self.ports)):
+            self.start(index)
+        for port, process in zip(self.ports, self.processes):
+            wait_for_port('127.0.0.1', port, timeout, process)
+        print(f"Started {len(self.ports)} workers on ports {self.ports[0]}-{self.ports[-1]}")
+
+    def exited(self) -> List[int]:
+        """Indexes of the workers that are no longer running"""
+        return [i for i, process in enumerate(self.processes) if process is not None and process.poll() is not None]
+
+    def stop(self):
+        for process in self.processes:
+            if process is not None and process.poll() is None:
+                process.terminate()
+        for process in self.processes:
+            if process is not None:
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+
+class Dispatcher:
+    """Routes MCP requests to workers, keeping each session on its worker"""
+
+    def __init__(self, pool: WorkerPool, sse_path: str, message_path: str, restart_interval: float = 1.0):
+        self.pool = pool
+        self.sse_path = sse_path
+        self.message_path = message_path.rstrip('/')
+        self.restart_interval = restart_interval
+        # Streamable HTTP session id -> worker index
+        self.sessions: Dict[str, int] = {}
+        # SSE session id -> worker index, while the stream is open
+        self.streams: Dict[str, int] = {}
+        self.open_sessions = [0] * len(pool.ports)
+        self._rotation = itertools.count()
+        self.client: Optional[httpx.AsyncClient] = None
+
+    def app(self) -> Starlette:
+        methods = ['GET', 'POST', 'DELETE', 'PUT', 'PATCH', 'OPTIONS', 'HEAD']
+        return Starlette(routes=[Route('/{path:path}', self.dispatch, methods=methods)], lifespan=self.lifespan)
+
+    @asynccontextmanager
+    async def lifespan(self, app: Starlette):
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(None, connect=10.0),
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=100),
+        )
+        monitor = asyncio.create_task(self._restart_exited())
+        try:
+            yield
+        finally:
+            monitor.cancel()
+            await self.client.aclose()
+
+    async def _restart_exited(self):
+        while True:
+            await asyncio.sleep(self.restart_interval)
+            for index in self.pool.exited():
+                print(f"Worker {index} exited with code {self.pool.processes[index].returncode}, restarting it")
+                # SSE streams of the worker end by themselves
+                for session_id in [s for s, worker in self.sessions.items() if worker == index]:
+                    self._close_session(session_id)
+                self.pool.restarts += 1
+                self.pool.start(index)
+
+    def pick(self) -> int:
+        """Worker for a new session: the one with the fewest open sessions, rotating among equals"""
+        count = len(self.open_sessions)
+        offset = next(self._rotation) % count
+        return min(range(count), key=lambda i: (self.open_sessions[i], (i - offset) % count))
+
+    def _open_session(self, session_id: str, worker: int):
+        if session_id not in self.sessions:
+            self.sessions[session_id] = worker
+            self.open_sessions[worker] += 1
+
+    def _close_session(self, session_id: str):
+        worker = self.sessions.pop(session_id, None)
+        if worker is not None:
+            self.open_sessions[worker] -= 1
+
+    async def dispatch(self, request: Request) -> Response:
+        path = request.url.path
+        if path == self.sse_path and request.method == 'GET':
+            return await self._sse(request)
+        if path.rstrip('/') == self.message_path:
+            worker = self.streams.get(request.query_params.get('session_id', ''))
+            if worker is None:
+                return PlainTextResponse("Could not find session", status_code=404)
+            return await self._forward(request, worker)
+        return await self._streamable_http(request)
+
+    async def _sse(self, request: Request) -> Response:
+        worker = self.pick()
+        upstream = await self._send(request, worker)
+        if upstream is None:
+            return PlainTextResponse("Worker unavailable", status_code=503)
+        self.open_sessions[worker] += 1
+        session: List[str] = []
+
+        async def body():
+            head = b''
+            try:
+                async for chunk in upstream.aiter_raw():
+                    if not session and len(head) < 65536:
+                        head += chunk
+                        match = SSE_SESSION_PATTERN.search(head)
+                        if match:
+                            session.append(match.group(1).decode())
+                            self.streams[session[0]] = worker
+                    yield chunk
+            finally:
+                with anyio.CancelScope(shield=True):
+                    await upstream.aclose()
+                self.open_sessions[worker] -= 1
+                if session:
+                    self.streams.pop(session[0], None)
+
+        return self._response(upstream, body())
+
+    async def _streamable_http(self, request: Request) -> Response:
+        session_id = request.headers.get(SESSION_HEADER)
+        if session_id:
+            worker = self.sessions.get(session_id)
+            if worker is None:
+                return PlainTextResponse("Session not found", status_code=404)
+        else:
+            worker = self.pick()
+        upstream = await self._send(request, worker)
+        if upstream is None:
+            return PlainTextResponse("Worker unavailable", status_code=503)
+        new_session_id = upstream.headers.get(SESSION_HEADER)
+        if new_session_id and upstream.status_code < 400:
+            self._open_session(new_session_id, worker)
+        if session_id and (upstream.status_code == 404 or (request.method == 'DELETE' and upstream.status_code < 300)):
+            self._close_session(session_id)
+        return self._response(upstream, self._relay(upstream))
+
+    async def _forward(self, request: Request, worker: int) -> Response:
+        upstream = await self._send(request, worker)
+        if upstream is None:
+            return PlainTextResponse("Worker unavailable", status_code=503)
+        return self._response(upstream, self._relay(upstream))
+
+    async def _send(self, request: Request, worker: int) -> Optional[httpx.Response]:
+        url = httpx.URL(
+            f"http://127.0.0.1:{self.pool.ports[worker]}{request.url.path}",
+            query=request.url.query.encode('utf-8')
+        )
+        headers = [(k, v) for k, v in request.headers.raw if k.decode('latin-1').lower() not in HOP_BY_HOP_HEADERS]
+        upstream_request = self.client.build_request(request.method, url, headers=headers, content=request.stream())
+        try:
+            return await self.client.send(upstream_request, stream=True)
+        except httpx.TransportError as e:
+            print(f"Worker {worker} did not answer: {e!r}")
+            return None
+
+    @staticmethod
+    async def _relay(upstream: httpx.Response):
+        try:
+            async for chunk in upstream.aiter_raw():
+                yield chunk
+        finally:
+            with anyio.CancelScope(shield=True):
+                await upstream.aclose()
+
+    @staticmethod
+    def _response(upstream: httpx.Response, body) -> StreamingResponse:
+        headers = {k: v for k, v in upstream.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+        return StreamingResponse(body, status_code=upstream.status_code, headers=headers)
+
+
+def serve(settings, count: int, transport: str, base_port: Optional[int] = None, store_path: Optional[str] = None):
+    """Run `count` workers behind a dispatcher on settings.host:settings.port until interrupted"""
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, MCP_TRANSPORT=transport, MCP_WORKERS=str(count))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_root, os.environ.get('PYTHONPATH')]))
+    if store_path:
+        env['SHARED_STORE_PATH'] = store_path
+    pool = WorkerPool(count, base_port or settings.port + 1, env)
+    dispatcher = Dispatcher(pool, settings.sse_path, settings.message_path)
+    # uvicorn re-raises the SIGTERM it stopped on; exit through the finally below
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        pool.start_all()
+        print(f"Dispatching {transport} sessions on {settings.host}:{settings.port} to {count} workers")
+        uvicorn.run(dispatcher.app(), host=settings.host, port=settings.port, log_level=settings.log_level.lower())
+    finally:
+        pool.stop()